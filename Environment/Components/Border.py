@@ -1,18 +1,15 @@
-from PyQt5.QtGui import QPen
-from PyQt5.QtCore import Qt
-
 class ColliderLine:
     def __init__(self,x1, y1, x2, y2, xn = 0, yn = 0):
         self.a = (x1, y1)
         self.b = (x2, y2)
+        xDif = x2-x1
+        yDif = y2-y1
         if xn == 0 and yn == 0:
-            xDif = x2-x1
-            yDif = y2-y1
             length = math.sqrt(xDif**2 + yDif**2)
             self.n = (-yDif/length, xDif/length)
-            self.normalOrigin = (x1 + xDif/2, y1 + yDif/2)
         else:
             self.n = (xn, yn)
+        self.normalOrigin = (x1 + xDif/2, y1 + yDif/2)
 
     def updatePos(self, pos1, pos2):
         self.a = pos1
@@ -34,6 +31,8 @@ class ColliderLine:
         return self.b
 
     def paint(self, painter, scaleFactor, showNormals):
+        from PyQt5.QtGui import QPen
+        from PyQt5.QtCore import Qt
         painter.setPen(QPen(Qt.black, 3))
         painter.drawLine(self.a[0] * scaleFactor, self.a[1] * scaleFactor, self.b[0] * scaleFactor, self.b[1] * scaleFactor)
         #Flächen-Normalen der Wände
@@ -129,6 +128,8 @@ class CircleWall:
         self.radius = r
 
     def paint(self, painter, scaleFactor):
+        from PyQt5.QtGui import QPen
+        from PyQt5.QtCore import Qt
         self.scaleFactor = scaleFactor
         painter.setPen(QPen(Qt.black, 3))
         painter.drawEllipse((self.posX-self.radius) * self.scaleFactor, (self.posY-self.radius) * self.scaleFactor, self.radius*2 * self.scaleFactor, self.radius*2 * self.scaleFactor)
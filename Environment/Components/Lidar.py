@@ -0,0 +1,747 @@
+import numpy as np
+
+
+def rayLineHits(x1, y1, x2V, y2V, x3, y3, x4, y4, nX, nY):
+    """
+    Calculates the factors t of the ray equations (origin + t * direction) at the intersections with the collider
+    lines. All parameters are broadcast against each other, so any shape of rays and lines can be used.
+
+    :param x1, y1: origin of the rays
+    :param x2V, y2V: direction of the rays (length 1)
+    :param x3, y3: start points of the lines
+    :param x4, y4: end points of the lines
+    :param nX, nY: normals of the lines, only lines facing the ray are hit
+    :return: np.array - t of every intersection, 2048 if a ray does not hit a line
+    """
+    x2 = x2V + x1
+    y2 = y2V + y1
+
+    skalarProd = nX * x2V + nY * y2V
+
+    # Ersten den denominator berechnen, da er für t1 und t2 gleich ist.
+    denominator = np.where(skalarProd < 0, 1.0 / ((x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)), -1)
+
+    t1 = np.where(skalarProd < 0, ((x1 - x3) * (y3 - y4) - (y1 - y3) * (x3 - x4)) * denominator, -1)  # Faktor des Laserstrahls vom Roboter bis zum Schnittpunkt
+    t2 = np.where(skalarProd < 0, ((x2 - x1) * (y1 - y3) - (y2 - y1) * (x1 - x3)) * denominator, -1)  # Faktor vom Startpunkt des Geradenabschnitts bis zum Schnittpunkt
+
+    # Liegt der Schnitt bei einem t2<0 oder t2>1 ist der Schnitt nicht auf dem Geradenabschnitt
+    # Liegt der Schnitt bei einem t1<0 ist der Schnitt in negativer Richtung des Lichtstrahls
+    t1 = np.where((t2 < 0) | (t2 > 1), -1, t1)
+    return np.where(t1 >= 0, t1, 2048)
+
+
+
+def rayLineHitsInPlace(x1, y1, x2V, y2V, x3, y3, x4, y4, nX, nY, workspace):
+    """
+    Same as rayLineHits, but all arrays of the shape (sensors x rays x lines) are buffers of the workspace and
+    are calculated in place. The operations are done in the same order, so the results are identical.
+
+    :param x1, y1: np.array (sensors x 1 x 1) - origin of the rays
+    :param x2V, y2V: np.array (sensors x rays x 1) - direction of the rays (length 1)
+    :param x3, y3: np.array (lines) - start points of the lines
+    :param x4, y4: np.array (lines) - end points of the lines
+    :param nX, nY: np.array (lines) - normals of the lines
+    :param workspace: LidarWorkspace
+    :return: np.array (sensors x rays x lines) - t of every intersection, 2048 if a ray does not hit a line.
+        The array is a buffer of the workspace and is overwritten by the next call.
+    """
+    shape = (x2V.shape[0], x2V.shape[1], x3.shape[0])
+    skalarProd = workspace.get('skalarProd', shape)
+    tmp = workspace.get('tmp', shape)
+    denominator = workspace.get('denominator', shape)
+    t1 = workspace.get('t1', shape)
+    notFacing = workspace.get('notFacing', shape, bool)
+    invalid = workspace.get('invalid', shape, bool)
+
+    x2 = x2V + x1
+    y2 = y2V + y1
+
+    np.multiply(nX, x2V, out=skalarProd)
+    np.multiply(nY, y2V, out=tmp)
+    np.add(skalarProd, tmp, out=skalarProd)
+    np.less(skalarProd, 0, out=notFacing)
+    np.logical_not(notFacing, out=notFacing)
+
+    np.multiply(x1 - x2, y3 - y4, out=denominator)
+    np.multiply(y1 - y2, x3 - x4, out=tmp)
+    np.subtract(denominator, tmp, out=denominator)
+    np.divide(1.0, denominator, out=denominator)
+    np.copyto(denominator, -1, where=notFacing)
+
+    np.multiply((x1 - x3) * (y3 - y4) - (y1 - y3) * (x3 - x4), denominator, out=t1)
+    np.copyto(t1, -1, where=notFacing)
+
+    t2 = skalarProd
+    np.multiply(x2 - x1, y1 - y3, out=t2)
+    np.multiply(y2 - y1, x1 - x3, out=tmp)
+    np.subtract(t2, tmp, out=t2)
+    np.multiply(t2, denominator, out=t2)
+    np.copyto(t2, -1, where=notFacing)
+
+    np.less(t2, 0, out=invalid)
+    np.greater(t2, 1, out=notFacing)
+    np.logical_or(invalid, notFacing, out=invalid)
+    np.copyto(t1, -1, where=invalid)
+    np.greater_equal(t1, 0, out=invalid)
+    np.logical_not(invalid, out=invalid)
+    np.copyto(t1, 2048, where=invalid)
+    return t1
+
+
+class LidarWorkspace:
+    """
+    Preallocated buffers for the ray casting of the swarm. The large temporary arrays of the shape
+    (sensors x rays x colliders) are not allocated anew for every scan but reused. A buffer only grows if a scan
+    needs more elements than before (e.g. a level with more walls), smaller scans (e.g. after some robots were
+    deactivated) use a view of the front of the buffer.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=float):
+        """
+        :param name: string - name of the buffer
+        :param shape: tuple - shape of the needed array
+        :param dtype: data type of the array
+        :return: np.array - uninitialized view of the buffer in the given shape
+        """
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = np.empty(size, dtype=dtype)
+            self.buffers[name] = buffer
+        return buffer[:size].reshape(shape)
+
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+
+class UniformGrid:
+    """
+    Broad phase of the ray casting: a uniform grid over the static walls of a level. Every wall is registered in
+    all cells its bounding box overlaps. The rays are traversed through the grid cell by cell (Amanatides & Woo)
+    and are only tested against the walls of the visited cells, until a hit inside the current cell is found.
+
+    The narrow phase uses rayLineHits like the brute force calculation, so the distances are bit-identical.
+    """
+
+    def __init__(self, lineStarts, lineEnds, normals, cellSize):
+        """
+        :param lineStarts: np.array [[x1,x2,x3...xn],[y1,y2,y3...yn]] - start points of the walls
+        :param lineEnds: np.array [[x1,x2,x3...xn],[y1,y2,y3...yn]] - end points of the walls
+        :param normals: np.array [[x1,x2,x3...xn],[y1,y2,y3...yn]] - normals of the walls
+        :param cellSize: float - edge length of a grid cell in meters
+        """
+        self.lineStarts = lineStarts
+        self.lineEnds = lineEnds
+        self.normals = normals
+        self.cellSize = cellSize
+
+        lower = np.minimum(lineStarts, lineEnds)
+        upper = np.maximum(lineStarts, lineEnds)
+        # walls lying on the border of a cell are registered in both cells
+        padding = cellSize * 1e-6
+        self.origin = lower.min(axis=1) - cellSize
+        self.size = (np.floor((upper.max(axis=1) + cellSize - self.origin) / cellSize) + 1).astype(int)
+
+        firstCells = np.floor((lower - padding - self.origin[:, np.newaxis]) / cellSize).astype(int)
+        lastCells = np.floor((upper + padding - self.origin[:, np.newaxis]) / cellSize).astype(int)
+
+        cells = [[] for _ in range(self.size[0] * self.size[1])]
+        for line in range(lineStarts.shape[1]):
+            for cellY in range(firstCells[1, line], lastCells[1, line] + 1):
+                for cellX in range(firstCells[0, line], lastCells[0, line] + 1):
+                    cells[cellY * self.size[0] + cellX].append(line)
+
+        # lines of each cell padded with -1 to a matrix of the shape (cells x max lines per cell)
+        self.cellLines = np.full((len(cells), max(1, max(len(c) for c in cells))), -1, dtype=int)
+        for i, c in enumerate(cells):
+            self.cellLines[i, :len(c)] = c
+
+    def contains(self, points):
+        """
+        :param points: np.array (points x 2)
+        :return: np.array of Booleans - True for each point inside the grid
+        """
+        cells = np.floor((points - self.origin) / self.cellSize)
+        return np.all((cells >= 0) & (cells < self.size), axis=1)
+
+    def nearestHits(self, origins, rayDirX, rayDirY):
+        """
+        Traverses all rays through the grid and finds the nearest intersection of each ray with a wall
+
+        :param origins: np.array (sensors x 2) - positions of the sensors, all have to be inside of the grid
+        :param rayDirX: np.array (sensors x rays) - x components of the ray directions
+        :param rayDirY: np.array (sensors x rays) - y components of the ray directions
+        :return: np.array (sensors x rays) - t of the nearest intersections, 2048 if a ray does not hit a wall
+        """
+        ox = np.repeat(origins[:, 0], rayDirX.shape[1])
+        oy = np.repeat(origins[:, 1], rayDirX.shape[1])
+        dx = rayDirX.ravel()
+        dy = rayDirY.ravel()
+        h = self.cellSize
+
+        cellX = np.floor((ox - self.origin[0]) / h).astype(int)
+        cellY = np.floor((oy - self.origin[1]) / h).astype(int)
+        stepX = np.where(dx > 0, 1, -1)
+        stepY = np.where(dy > 0, 1, -1)
+        with np.errstate(divide='ignore'):
+            tMaxX = np.where(dx != 0, (self.origin[0] + (cellX + (dx > 0)) * h - ox) / dx, np.inf)
+            tMaxY = np.where(dy != 0, (self.origin[1] + (cellY + (dy > 0)) * h - oy) / dy, np.inf)
+            tDeltaX = np.where(dx != 0, h / np.abs(dx), np.inf)
+            tDeltaY = np.where(dy != 0, h / np.abs(dy), np.inf)
+
+        (x3, y3), (x4, y4), (nX, nY) = self.lineStarts, self.lineEnds, self.normals
+        nearestHit = np.full(dx.shape, 2048.0)
+        active = np.arange(dx.size)
+        while active.size > 0:
+            lines = self.cellLines[cellY[active] * self.size[0] + cellX[active]]
+            used = lines >= 0
+            lines = np.where(used, lines, 0)
+            t = rayLineHits(ox[active, np.newaxis], oy[active, np.newaxis], dx[active, np.newaxis], dy[active, np.newaxis],
+                            x3[lines], y3[lines], x4[lines], y4[lines], nX[lines], nY[lines])
+            t = np.where(used, t, 2048)
+            nearestHit[active] = np.minimum(nearestHit[active], np.amin(t, axis=1))
+
+            # a hit inside the current cell can not be hidden by walls of the following cells
+            tExit = np.minimum(tMaxX[active], tMaxY[active])
+            done = nearestHit[active] <= tExit
+
+            # step into the next cell
+            inX = tMaxX[active] < tMaxY[active]
+            movedX, movedY = active[inX], active[~inX]
+            cellX[movedX] += stepX[movedX]
+            tMaxX[movedX] += tDeltaX[movedX]
+            cellY[movedY] += stepY[movedY]
+            tMaxY[movedY] += tDeltaY[movedY]
+
+            outside = (cellX[active] < 0) | (cellX[active] >= self.size[0]) | \
+                      (cellY[active] < 0) | (cellY[active] >= self.size[1])
+            active = active[~(done | outside)]
+
+        return nearestHit.reshape(rayDirX.shape)
+
+
+class DistanceField:
+    """
+    Precomputed distances to the static walls and circular obstacles of a level on a regular grid of nodes (the
+    distance is negative inside of a circular obstacle). The clearance of a robot is interpolated bilinearly from
+    the 4 nodes around it instead of calculating the distance to every wall. As the distance changes at most as much
+    as the position, the interpolated clearance differs at most by the length of a cell diagonal from the exact one.
+    """
+
+    def __init__(self, lineStarts, lineEnds, circles, radii, cellSize):
+        """
+        :param lineStarts: np.array [[x1,x2,x3...xn],[y1,y2,y3...yn]] - start points of the walls
+        :param lineEnds: np.array [[x1,x2,x3...xn],[y1,y2,y3...yn]] - end points of the walls
+        :param circles: np.array [[x1,x2,x3...xn],[y1,y2,y3...yn]] - centers of the circular obstacles
+        :param radii: np.array - radii of the circular obstacles
+        :param cellSize: float - distance between two nodes in meters
+        """
+        self.cellSize = cellSize
+        points = np.concatenate((lineStarts, lineEnds, circles - radii, circles + radii), axis=1)
+        self.origin = points.min(axis=1) - 2 * cellSize
+        self.size = np.ceil((points.max(axis=1) + 2 * cellSize - self.origin) / cellSize).astype(int) + 1
+
+        x1 = (self.origin[0] + np.arange(self.size[0]) * cellSize)[np.newaxis, :, np.newaxis]
+        x2, y2 = lineStarts[:, np.newaxis, :]
+        x3, y3 = lineEnds[:, np.newaxis, :]
+        x4, y4 = circles[:, np.newaxis, :]
+        # the nodes are calculated row by row to keep the temporary arrays small
+        self.distances = np.empty((self.size[1], self.size[0]))
+        for row in range(self.size[1]):
+            y1 = self.origin[1] + row * cellSize
+            t = np.clip(((x1 - x2) * (x3 - x2) + (y1 - y2) * (y3 - y2)) / ((x2 - x3) ** 2 + (y2 - y3) ** 2), 0, 1)
+            dist = np.sqrt((x1 - (x2 + t * (x3 - x2))) ** 2 + (y1 - (y2 + t * (y3 - y2))) ** 2)
+            distCircles = np.sqrt((x1 - x4) ** 2 + (y1 - y4) ** 2) - radii
+            self.distances[row] = np.fmin(np.fmin.reduce(dist[0], axis=1, initial=np.inf),
+                                          np.fmin.reduce(distCircles[0], axis=1, initial=np.inf))
+
+        # bilinear coefficients of every cell, the distance at (tX, tY) inside a cell is a + b*tX + c*tY + d*tX*tY
+        d = self.distances
+        d00, d01, d10, d11 = d[:-1, :-1], d[:-1, 1:], d[1:, :-1], d[1:, 1:]
+        self.coefficients = np.stack((d00, d01 - d00, d10 - d00, d00 - d01 - d10 + d11), axis=2).reshape(-1, 4)
+
+    def lookup(self, points):
+        """
+        :param points: np.array (points x 2)
+        :return: np.array (points) - bilinearly interpolated distances to the nearest static collider, None if a point
+            is outside of the field
+        """
+        cells = (points - self.origin) / self.cellSize
+        index = np.floor(cells)
+        if index.min() < 0 or (index >= self.size - 1).any():
+            return None
+        tX, tY = (cells - index).T
+        index = index.astype(int)
+        a, b, c, d = self.coefficients[index[:, 1] * (self.size[0] - 1) + index[:, 0]].T
+        return a + b * tX + (c + d * tX) * tY
+
+
+class LevelGeometry:
+    """
+    Holds the collider lines and circles of a level as contiguous numpy arrays. The static walls of a level are
+    compiled once when the level is loaded, only the rows of dynamic colliders (the pie slices of the robots)
+    are patched after the robots moved.
+    """
+
+    def __init__(self, walls, circleWalls, robots, gridCellSize=0, distanceField=None):
+        """
+        :param walls: list of Borders.ColliderLines - static walls of the level
+        :param circleWalls: list of Borders.CircleWalls - static circular obstacles of the level
+        :param robots: list of Robot.Robot objects - their pie slices (if used) are dynamic collider lines
+        :param gridCellSize: float - cell size of the UniformGrid over the static walls, 0 disables the grid
+        :param distanceField: DistanceField - distances to the walls and circular obstacles (see
+            SVGParser.CompiledLevel.getDistanceField), if given the clearance of the robots is looked up in it
+        """
+        self.distanceField = distanceField
+        self.walls = walls
+        self.circleWalls = circleWalls
+        self.robots = robots
+        self.numberOfStaticLines = len(walls)
+
+        self.pieSliceWalls = []
+        pieSliceOwners = []
+        for i, robot in enumerate(robots):
+            self.pieSliceWalls += robot.getPieSliceWalls()
+            pieSliceOwners += [i] * len(robot.getPieSliceWalls())
+        self.lineOwners = np.array([-1] * len(walls) + pieSliceOwners, dtype=int)
+
+        colliderLines = walls + self.pieSliceWalls
+        # [[x,x,x,x],[y,y,y,y]]
+        self.lineStarts = np.ascontiguousarray(np.array([cl.getStart() for cl in colliderLines], dtype=float).reshape(-1, 2).T)
+        self.lineEnds = np.ascontiguousarray(np.array([cl.getEnd() for cl in colliderLines], dtype=float).reshape(-1, 2).T)
+        self.normals = np.ascontiguousarray(np.array([cl.getN() for cl in colliderLines], dtype=float).reshape(-1, 2).T)
+
+        circles = np.array([(wall.getPosX(), wall.getPosY(), wall.getRadius()) for wall in circleWalls], dtype=float).reshape(-1, 3)
+        self.circles = np.ascontiguousarray(circles[:, :2].T)
+        self.radii = np.ascontiguousarray(circles[:, 2])
+
+        self.grid = None
+        if gridCellSize > 0 and self.numberOfStaticLines > 0:
+            static = slice(0, self.numberOfStaticLines)
+            self.grid = UniformGrid(self.lineStarts[:, static], self.lineEnds[:, static], self.normals[:, static], gridCellSize)
+
+    def updateDynamicLines(self):
+        """
+        Copies the current position of the pie slices of the robots into the collider arrays.
+        Has to be called after the robots moved.
+        """
+        for i, wall in enumerate(self.pieSliceWalls, start=self.numberOfStaticLines):
+            self.lineStarts[:, i] = wall.getStart()
+            self.lineEnds[:, i] = wall.getEnd()
+            self.normals[:, i] = wall.getN()
+
+    def getLines(self, robot=None):
+        """
+        :param robot: Robot.Robot - if given, the pie slice of this robot is left out
+        :return: tuple (np.array starts, np.array ends, np.array normals) of the collider lines,
+            each in the shape [[x1,x2,x3...xn],[y1,y2,y3...yn]]
+        """
+        if robot is None or len(self.pieSliceWalls) == 0:
+            return self.lineStarts, self.lineEnds, self.normals
+        used = self.lineOwners != self.robots.index(robot)
+        return self.lineStarts[:, used], self.lineEnds[:, used], self.normals[:, used]
+
+
+class NeighborGrid:
+    """
+    Spatial hash of the robot positions, built every step. The cells are as large as the neighbor range (plus the
+    largest robot radius), so the neighbors of a robot are only searched among the robots of the 3 x 3 cells around
+    it instead of testing all pairs of robots. A robot is a neighbor if its chassis is within the range, robots
+    farther away can't be seen by the lidar (see Robot.isNeighbor).
+    """
+
+    def __init__(self, positions, radii, neighborRange):
+        """
+        :param positions: np.array (robots x 2) - positions of all robots
+        :param radii: np.array (robots) - radii of the robots
+        :param neighborRange: float - range of the lidar
+        """
+        self.positions = positions
+        self.radii = radii
+        self.neighborRange = neighborRange
+        self.cellSize = neighborRange + radii.max()
+        cells = np.floor(positions / self.cellSize).astype(np.int64)
+        # all robots are found in the 3 x 3 cells around every robot, so the hash is not needed
+        self.singleCell = np.all(cells.max(axis=0) - cells.min(axis=0) <= 1)
+        self.origin = cells.min(axis=0) - 1
+        cells -= self.origin
+        self.rows = cells[:, 1].max() + 2
+        keys = cells[:, 0] * self.rows + cells[:, 1]
+        self.order = np.argsort(keys, kind='stable')
+        self.sortedKeys = keys[self.order]
+
+    def candidates(self, robotIndices):
+        """
+        :param robotIndices: np.array - robots whose neighbors are searched
+        :return: tuple (np.array, np.array) - pairs of indices into robotIndices and robots in the surrounding cells
+        """
+        n = len(robotIndices)
+        if self.singleCell:
+            return np.repeat(np.arange(n), len(self.positions)), np.tile(np.arange(len(self.positions)), n)
+
+        offsets = np.array([(dX, dY) for dX in (-1, 0, 1) for dY in (-1, 0, 1)])
+        cells = np.floor(self.positions[robotIndices] / self.cellSize).astype(np.int64) - self.origin
+        cells = cells[:, np.newaxis, :] + offsets
+        keys = (cells[:, :, 0] * self.rows + cells[:, :, 1]).ravel()
+        starts = np.searchsorted(self.sortedKeys, keys, side='left')
+        counts = np.searchsorted(self.sortedKeys, keys, side='right') - starts
+        # flat index of every robot of the cells in the sorted order
+        inCell = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(np.arange(len(keys)) // len(offsets), counts), self.order[np.repeat(starts, counts) + inCell]
+
+    def neighbors(self, robotIndices):
+        """
+        :param robotIndices: np.array - robots whose neighbors are searched
+        :return: np.array (len(robotIndices) x most neighbors) - indices of the neighbors of every robot (without
+            itself) in ascending order, padded with -1
+        """
+        owners, candidates = self.candidates(robotIndices)
+        dX = self.positions[candidates, 0] - self.positions[robotIndices[owners], 0]
+        dY = self.positions[candidates, 1] - self.positions[robotIndices[owners], 1]
+        isNeighbor = np.sqrt(dX * dX + dY * dY) - self.radii[candidates] <= self.neighborRange
+        isNeighbor &= candidates != robotIndices[owners]
+        owners, candidates = owners[isNeighbor], candidates[isNeighbor]
+
+        order = np.lexsort((candidates, owners))
+        owners, candidates = owners[order], candidates[order]
+        counts = np.bincount(owners, minlength=len(robotIndices))
+        table = np.full((len(robotIndices), counts.max(initial=0)), -1, dtype=int)
+        table[owners, np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)] = candidates
+        return table
+
+
+class SwarmCollisionRay:
+    """
+    A class for simulating the laser scans of a whole swarm at once. Instead of casting the rays of every robot
+    separately (see Robot.FastCollisionRay) the rays of all active robots are tested against the collider lines
+    and circles of the level in one batched numpy calculation of the shape (robots x rays x colliders).
+    """
+
+    def __init__(self, args):
+        """
+        :param args:
+            args defined in main
+        """
+        self.args = args
+        self.numberOfRays = args.number_of_rays
+        self.fieldOfView = args.field_of_view / 180 * np.pi
+        self.stepSize = self.fieldOfView / self.numberOfRays
+        self.workspace = LidarWorkspace()
+        self.angleTolerance = args.lidar_angle_tolerance
+        if self.angleTolerance > 0:
+            self.createDirectionTable()
+        self.numbaKernels = None
+        if args.lidar_backend == 'numba':
+            import Environment.Components.LidarNumba as LidarNumba
+            self.numbaKernels = LidarNumba
+
+    def createDirectionTable(self):
+        """
+        Precomputes the unit directions for all angles of a full circle (plus one field of view) at a resolution
+        which divides the step size between two rays. The rays of a scan are then every k-th entry of the table
+        starting at the quantized start angle, so no trigonometry is needed per step. The angles of the rays
+        differ at most by half the resolution (<= lidar_angle_tolerance / 2) from the exact ones.
+        """
+        self.tableStride = int(np.ceil(self.stepSize / self.angleTolerance))
+        self.tableResolution = self.stepSize / self.tableStride
+        self.tableOffsets = np.arange(self.numberOfRays) * self.tableStride
+        tableSize = int(np.ceil(2 * np.pi / self.tableResolution)) + self.tableOffsets[-1] + 1
+        angles = np.arange(tableSize) * self.tableResolution
+        self.directionTableX = np.cos(angles)
+        self.directionTableY = np.sin(angles)
+
+    def rayDirections(self, startAngles):
+        """
+        Calculates the direction vectors of the rays of every sensor. If lidar_angle_tolerance is set, the directions
+        are looked up in the precomputed direction table instead.
+
+        :param startAngles: list of floats - start angle (in radians) of the scan of each sensor
+        :return: tuple (np.array, np.array) - x and y components of the ray directions in the shape (sensors x rays)
+        """
+        if self.angleTolerance > 0:
+            startIndices = np.rint(np.asarray(startAngles) / self.tableResolution).astype(int)
+            indices = startIndices[:, np.newaxis] + self.tableOffsets
+            return self.directionTableX[indices], self.directionTableY[indices]
+
+        steps = np.array([np.arange(startAngle, (startAngle + self.stepSize * self.numberOfRays) - (self.stepSize / 2),
+                                    self.stepSize) for startAngle in startAngles])
+        return np.cos(steps), np.sin(steps)
+
+    def collectColliders(self, sensors, robots, geometry, stations):
+        """
+        Collects the colliders of the level and the swarm into flat arrays. The circles are stored per sensor: the
+        circular obstacles (and stations) of the level followed by the chassis of the robots within the lidar range
+        of the sensor (see NeighborGrid). As every robot must not detect its own goal or pie slice, masks of the shape
+        (sensors x colliders) mark the colliders ignored by a sensor.
+
+        :param sensors: list of Robot.Robot objects - the robots that are scanning
+        :param robots: list of Robot.Robot objects - all robots of the simulation (they are colliders for each other)
+        :param geometry: LevelGeometry - compiled walls and circular obstacles of the level
+        :param stations: list of Station.Stations - goals of the robots
+        :return: dict of collider arrays and masks
+        """
+        staticCircles = np.concatenate((geometry.circles, geometry.radii[np.newaxis]))
+        circleStations = [None] * len(geometry.radii)
+        if self.args.collide_other_targets:
+            stationCircles = [(station.getPosX(), station.getPosY(), station.getRadius()) for station in stations]
+            staticCircles = np.concatenate((staticCircles, np.array(stationCircles).reshape(-1, 3).T), axis=1)
+            circleStations += stations
+        numberOfStaticCircles = len(circleStations)
+
+        robotCircles = np.array([(robot.getPosX(), robot.getPosY(), robot.getRadius()) for robot in robots])
+        sensorIdx = np.array([robots.index(sensor) for sensor in sensors])
+        neighborRange = max(sensor.maxDistSim for sensor in sensors)
+        neighbors = NeighborGrid(robotCircles[:, :2], robotCircles[:, 2], neighborRange).neighbors(sensorIdx)
+        neighborCircles = robotCircles[neighbors].transpose(2, 0, 1)
+
+        # shapes: (3, sensors, circles)
+        staticCircles = np.broadcast_to(staticCircles[:, np.newaxis, :], (3, len(sensors), numberOfStaticCircles))
+        circles = np.concatenate((staticCircles, neighborCircles), axis=2)
+        ownStation = np.array([[station is sensor.station for station in circleStations] for sensor in sensors],
+                              dtype=bool).reshape(len(sensors), numberOfStaticCircles)
+        ignoredCircles = np.concatenate((ownStation, neighbors < 0), axis=1)
+        ignoredCirclesRays = ignoredCircles.copy()
+        if self.args.has_pie_slice:
+            # the pie slices of the other robots are detected by the rays instead of their circular chassis
+            ignoredCirclesRays[:, numberOfStaticCircles:] = True
+
+        return {'lineStarts': geometry.lineStarts,
+                'lineEnds': geometry.lineEnds,
+                'normals': geometry.normals,
+                'ignoredLines': geometry.lineOwners == sensorIdx[:, np.newaxis],
+                'numberOfStaticLines': geometry.numberOfStaticLines,
+                'numberOfCircleWalls': len(geometry.radii),
+                'grid': geometry.grid,
+                'distanceField': geometry.distanceField,
+                'circles': np.ascontiguousarray(circles[:2]),
+                'radii': np.ascontiguousarray(circles[2]),
+                'ignoredCircles': ignoredCircles,
+                'ignoredCirclesRays': ignoredCirclesRays}
+
+    def scan(self, sensors, robots, geometry, stations):
+        """
+        Casts the rays of all given sensors and calculates the distances of every robot to its nearest colliders
+
+        :param sensors: list of Robot.Robot objects - the robots that are scanning
+        :param robots: list of Robot.Robot objects - all robots of the simulation
+        :param geometry: LevelGeometry - compiled walls and circular obstacles of the level
+        :param stations: list of Station.Stations - goals of the robots
+        :return: tuple (np.array distances (sensors x rays), np.array lidar hits (sensors x rays x 2),
+            list of np.arrays distances to all colliders, list of np.arrays distances to all circle colliders,
+            np.array (sensors) distance to the nearest collider)
+        """
+        if len(sensors) == 0:
+            return np.zeros((0, self.numberOfRays)), np.zeros((0, self.numberOfRays, 2)), [], [], np.zeros(0)
+
+        colliders = self.collectColliders(sensors, robots, geometry, stations)
+
+        origins = [sensor.posSensor if sensor.hasPieSlice else [sensor.getPosX(), sensor.getPosY()] for sensor in sensors]
+        # squared with the scalar values like in FastCollisionRay, as scalar and array powers may differ in the last bit
+        originsSquared = np.array([x1 ** 2 + y1 ** 2 for x1, y1 in origins])
+        origins = np.array(origins)
+        startAngles = [(sensor.getDirectionAngle() - (sensor.fieldOfView / 2)) % (2 * np.pi) for sensor in sensors]
+        rayDirX, rayDirY = self.rayDirections(startAngles)
+
+        distances, lidarHits = self.lineRayIntersectionPoint(origins, originsSquared, rayDirX, rayDirY, colliders)
+
+        positions = np.array([[sensor.getPosX(), sensor.getPosY()] for sensor in sensors])
+        collisionDistances, collisionDistancesRobots, nearestCollisions = \
+            self.shortestDistanceToCollidors(positions, colliders)
+
+        return distances, lidarHits, collisionDistances, collisionDistancesRobots, nearestCollisions
+
+    def lineRayIntersectionPoint(self, origins, originsSquared, rayDirX, rayDirY, colliders):
+        """
+        Batched version of Robot.FastCollisionRay.lineRayIntersectionPoint. The calculation is done element wise in
+        the same order, so the results are identical to the ones of the single robot version.
+
+        :param origins: np.array (sensors x 2) - positions of the sensors
+        :param originsSquared: np.array (sensors) - squared length of the position vectors of the sensors
+        :param rayDirX: np.array (sensors x rays) - x components of the ray directions
+        :param rayDirY: np.array (sensors x rays) - y components of the ray directions
+        :param colliders: dict - colliders created by collectColliders
+        :return: tuple (np.array distances (sensors x rays), np.array lidar hits (sensors x rays x 2))
+        """
+        grid = colliders['grid']
+        if grid is not None and np.all(grid.contains(origins)):
+            # the static walls are found through the grid, only the dynamic lines are tested by brute force
+            t1NearestHit = grid.nearestHits(origins, rayDirX, rayDirY)
+            lines = slice(colliders['numberOfStaticLines'], None)
+        else:
+            t1NearestHit = np.full(rayDirX.shape, 2048.0)
+            lines = slice(0, None)
+
+        if self.numbaKernels is not None:
+            self.numbaKernels.nearestHits(origins, originsSquared, rayDirX, rayDirY, colliders['lineStarts'],
+                                          colliders['lineEnds'], colliders['normals'], colliders['ignoredLines'],
+                                          lines.start, colliders['circles'], colliders['radii'],
+                                          colliders['ignoredCirclesRays'], t1NearestHit)
+        else:
+            t1NearestHit = self.nearestHits(origins, originsSquared, rayDirX, rayDirY, colliders, t1NearestHit, lines)
+
+        collisionPoints = np.stack((origins[:, 0, np.newaxis] + t1NearestHit * rayDirX,
+                                    origins[:, 1, np.newaxis] + t1NearestHit * rayDirY), axis=2)
+
+        return t1NearestHit, collisionPoints
+
+    def nearestHits(self, origins, originsSquared, rayDirX, rayDirY, colliders, t1NearestHit, lines):
+        """
+        Numpy implementation of the intersection tests of lineRayIntersectionPoint
+
+        :param origins: np.array (sensors x 2) - positions of the sensors
+        :param originsSquared: np.array (sensors) - squared length of the position vectors of the sensors
+        :param rayDirX: np.array (sensors x rays) - x components of the ray directions
+        :param rayDirY: np.array (sensors x rays) - y components of the ray directions
+        :param colliders: dict - colliders created by collectColliders
+        :param t1NearestHit: np.array (sensors x rays) - distances found so far (e.g. through the uniform grid)
+        :param lines: slice - collider lines which have to be tested
+        :return: np.array (sensors x rays) - distance to the nearest collider of every ray
+        """
+        # shapes: (sensors, rays, lines)
+        nX, nY = colliders['normals'][:, lines]
+        x3, y3 = colliders['lineStarts'][:, lines]
+        x4, y4 = colliders['lineEnds'][:, lines]
+        if x3.size > 0:
+            t1 = rayLineHitsInPlace(origins[:, 0, np.newaxis, np.newaxis], origins[:, 1, np.newaxis, np.newaxis],
+                                    rayDirX[:, :, np.newaxis], rayDirY[:, :, np.newaxis], x3, y3, x4, y4, nX, nY,
+                                    self.workspace)
+            np.copyto(t1, 2048, where=colliders['ignoredLines'][:, np.newaxis, lines])
+            t1NearestHit = np.minimum(t1NearestHit, np.amin(t1, axis=2))
+
+        if colliders['radii'].size > 0:
+            # shapes: (sensors, circles, rays)
+            x1 = origins[:, 0, np.newaxis, np.newaxis]
+            y1 = origins[:, 1, np.newaxis, np.newaxis]
+            qX = colliders['circles'][0][:, :, np.newaxis]
+            qY = colliders['circles'][1][:, :, np.newaxis]
+            radii = colliders['radii'][:, :, np.newaxis]
+
+            colX = (origins[:, 0, np.newaxis] + t1NearestHit * rayDirX)[:, np.newaxis, :]
+            colY = (origins[:, 1, np.newaxis] + t1NearestHit * rayDirY)[:, np.newaxis, :]
+
+            vX = colX - x1
+            vY = colY - y1
+            vLengthFact = 1 / np.sqrt(vX ** 2 + vY ** 2)
+            vX = vX * vLengthFact
+            vY = vY * vLengthFact
+
+            # the large arrays of the shape (sensors, circles, rays) are buffers of the workspace
+            shape = (len(origins), qX.shape[1], rayDirX.shape[1])
+            ws = self.workspace
+            b, tmp, disc = ws.get('b', shape), ws.get('circleTmp', shape), ws.get('disc', shape)
+            tc1, tc2 = ws.get('tc1', shape), ws.get('tc2', shape)
+            noHit, mask = ws.get('noHit', shape, bool), ws.get('mask', shape, bool)
+
+            a = vX * vX + vY * vY
+            np.multiply(vX, x1 - qX, out=b)
+            np.multiply(vY, y1 - qY, out=tmp)
+            np.add(b, tmp, out=b)
+            np.multiply(2, b, out=b)
+            c = originsSquared[:, np.newaxis, np.newaxis] + (qX ** 2 + qY ** 2) - (2 * (x1 * qX + y1 * qY)) - radii ** 2
+
+            np.square(b, out=disc)
+            np.multiply(4 * a, c, out=tmp)
+            np.subtract(disc, tmp, out=disc)
+            denominator = 1 / (2 * a)
+
+            # check if discriminat is negative ==> no collision
+            np.greater(disc, 0, out=noHit)
+            np.logical_not(noHit, out=noHit)
+            sqrtDisc = tmp
+            np.sqrt(disc, out=sqrtDisc, where=~noHit)
+            np.copyto(sqrtDisc, 0, where=noHit)
+
+            np.negative(b, out=tc1)
+            np.add(tc1, sqrtDisc, out=tc1)
+            np.multiply(tc1, denominator, out=tc1)
+            np.copyto(tc1, -1, where=noHit)
+
+            np.negative(b, out=tc2)
+            np.subtract(tc2, sqrtDisc, out=tc2)
+            np.multiply(tc2, denominator, out=tc2)
+            np.copyto(tc2, -1, where=noHit)
+
+            ignored = colliders['ignoredCirclesRays'][:, :, np.newaxis]
+            for tc in (tc1, tc2):
+                np.greater_equal(tc, 0, out=mask)
+                np.logical_and(mask, ~ignored, out=mask)
+                np.logical_not(mask, out=mask)
+                np.copyto(tc, 2048, where=mask)
+
+            # smallest t of both intersections is written to tc2
+            np.less(tc1, tc2, out=mask)
+            np.copyto(tc2, tc1, where=mask)
+            smallestTOfCircle = np.amin(tc2, axis=1)
+
+            t1NearestHit = np.where(((smallestTOfCircle < 2048) & (smallestTOfCircle < t1NearestHit)),
+                                    smallestTOfCircle, t1NearestHit)
+
+        return t1NearestHit
+
+    def shortestDistanceToCollidors(self, positions, colliders):
+        """
+        Batched version of Robot.FastCollisionRay.shortestDistanceToCollidors. If the level has a distance field, the
+        distance to the walls and circular obstacles of the level (the clearance) is looked up in the field and only
+        the distances to the dynamic colliders (robots, pie slices, stations) are calculated.
+
+        :param positions: np.array (sensors x 2) - positions of the robots
+        :param colliders: dict - colliders created by collectColliders
+        :return: tuple (list of np.arrays distances to all colliders, list of np.arrays distances to all circles,
+            np.array distance to the nearest collider) of every robot without the colliders ignored by it.
+            With the distance field, the distances to all colliders start with the clearance instead of the
+            distances to every wall and circular obstacle
+        """
+        field = colliders['distanceField']
+        clearance = None if field is None else field.lookup(positions)
+        lines, circles = slice(0, None), slice(0, None)
+        if clearance is not None:
+            lines = slice(colliders['numberOfStaticLines'], None)
+            circles = slice(colliders['numberOfCircleWalls'], None)
+        lineStarts = colliders['lineStarts'][:, lines]
+        lineEnds = colliders['lineEnds'][:, lines]
+        ignoredLines = colliders['ignoredLines'][:, lines]
+        ignoredCircles = colliders['ignoredCircles'][:, circles]
+
+        if self.numbaKernels is not None:
+            circlePositions = np.ascontiguousarray(colliders['circles'][:, :, circles])
+            circleRadii = np.ascontiguousarray(colliders['radii'][:, circles])
+            dist, distCircles = self.numbaKernels.collisionDistances(positions, np.ascontiguousarray(lineStarts),
+                                                                     np.ascontiguousarray(lineEnds), circlePositions,
+                                                                     circleRadii)
+        else:
+            x1 = positions[:, 0, np.newaxis]
+            y1 = positions[:, 1, np.newaxis]
+
+            x2, y2 = lineStarts
+            x3, y3 = lineEnds
+
+            if lineStarts.shape[1] > 0:
+                t = np.clip(((x1 - x2) * (x3 - x2) + (y1 - y2) * (y3 - y2)) / ((x2 - x3) ** 2 + (y2 - y3) ** 2), 0, 1)
+                dist = np.sqrt((x1 - (x2 + t * (x3 - x2))) ** 2 + (y1 - (y2 + t * (y3 - y2))) ** 2)
+            else:
+                # all walls are in the distance field (no pie slices)
+                dist = np.zeros((len(positions), 0))
+
+            x4, y4 = colliders['circles'][:, :, circles]
+            distCircles = np.sqrt((x1 - x4) ** 2 + (y1 - y4) ** 2) - colliders['radii'][:, circles]
+
+        collisionDistances, collisionDistancesRobots = [], []
+        for i in range(len(positions)):
+            distCirclesI = distCircles[i][~ignoredCircles[i]]
+            distances = (dist[i][~ignoredLines[i]], distCirclesI)
+            if clearance is not None:
+                distances = (clearance[i:i + 1],) + distances
+            collisionDistances.append(np.concatenate(distances))
+            collisionDistancesRobots.append(distCirclesI)
+
+        # the nearest collider of all robots at once (the termination check), inf if a robot ignores all colliders
+        nearestLines = np.where(ignoredLines, np.inf, dist).min(axis=1, initial=np.inf)
+        nearestCircles = np.where(ignoredCircles, np.inf, distCircles).min(axis=1, initial=np.inf)
+        nearestCollisions = np.minimum(nearestLines, nearestCircles)
+        if clearance is not None:
+            nearestCollisions = np.minimum(clearance, nearestCollisions)
+
+        return collisionDistances, collisionDistancesRobots, nearestCollisions
@@ -0,0 +1,140 @@
+"""
+Numba implementation of the batched lidar of Lidar.SwarmCollisionRay. Every ray is handled by its own loop iteration
+(parallelized over the cores of the CPU), so no temporary arrays of the shape (sensors x rays x colliders) are needed.
+The formulas are evaluated in the same order as in the numpy implementation, which stays the reference.
+
+Only imported if the numba backend is selected (--lidar_backend numba).
+"""
+import math
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True, cache=True, error_model='numpy')
+def nearestHits(origins, originsSquared, rayDirX, rayDirY, lineStarts, lineEnds, normals, ignoredLines, firstLine,
+                circles, radii, ignoredCirclesRays, t1NearestHit):
+    """
+    Calculates the nearest intersection of every ray with the collider lines and circles
+
+    :param origins: np.array (sensors x 2) - positions of the sensors
+    :param originsSquared: np.array (sensors) - squared length of the position vectors of the sensors
+    :param rayDirX, rayDirY: np.array (sensors x rays) - ray directions
+    :param lineStarts, lineEnds, normals: np.array (2 x lines) - collider lines
+    :param ignoredLines: np.array (sensors x lines) - lines ignored by each sensor
+    :param firstLine: int - lines before this index are skipped (already tested through the uniform grid)
+    :param circles: np.array (2 x sensors x circles) - centers of the collider circles of each sensor
+    :param radii: np.array (sensors x circles) - radii of the collider circles of each sensor
+    :param ignoredCirclesRays: np.array (sensors x circles) - circles ignored by the rays of each sensor
+    :param t1NearestHit: np.array (sensors x rays) - distances found so far, updated in place
+    """
+    numberOfSensors, numberOfRays = rayDirX.shape
+    numberOfLines = lineStarts.shape[1]
+    numberOfCircles = radii.shape[1]
+
+    # c of the quadratic equation only depends on the sensor and the circle
+    c = np.empty((numberOfSensors, numberOfCircles))
+    for i in range(numberOfSensors):
+        x1 = origins[i, 0]
+        y1 = origins[i, 1]
+        for k in range(numberOfCircles):
+            qX = circles[0, i, k]
+            qY = circles[1, i, k]
+            c[i, k] = originsSquared[i] + (qX * qX + qY * qY) - (2 * (x1 * qX + y1 * qY)) - radii[i, k] * radii[i, k]
+
+    for n in prange(numberOfSensors * numberOfRays):
+        i = n // numberOfRays
+        j = n % numberOfRays
+        x1 = origins[i, 0]
+        y1 = origins[i, 1]
+        x2V = rayDirX[i, j]
+        y2V = rayDirY[i, j]
+        x2 = x2V + x1
+        y2 = y2V + y1
+
+        nearest = t1NearestHit[i, j]
+        for l in range(firstLine, numberOfLines):
+            if ignoredLines[i, l]:
+                continue
+            # Skalarprodukt der Normalen mit dem Strahl, nur Wände auf die der Strahl von vorne trifft
+            if not normals[0, l] * x2V + normals[1, l] * y2V < 0:
+                continue
+            x3 = lineStarts[0, l]
+            y3 = lineStarts[1, l]
+            x4 = lineEnds[0, l]
+            y4 = lineEnds[1, l]
+            denominator = 1.0 / ((x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4))
+            t1 = ((x1 - x3) * (y3 - y4) - (y1 - y3) * (x3 - x4)) * denominator
+            t2 = ((x2 - x1) * (y1 - y3) - (y2 - y1) * (x1 - x3)) * denominator
+            if t2 < 0 or t2 > 1:
+                continue
+            if t1 >= 0 and t1 < nearest:
+                nearest = t1
+
+        if numberOfCircles > 0:
+            vX = (x1 + nearest * x2V) - x1
+            vY = (y1 + nearest * y2V) - y1
+            vLengthFact = 1 / math.sqrt(vX * vX + vY * vY)
+            vX = vX * vLengthFact
+            vY = vY * vLengthFact
+            a = vX * vX + vY * vY
+            denominator = 1 / (2 * a)
+
+            smallestTOfCircle = 2048.0
+            for k in range(numberOfCircles):
+                if ignoredCirclesRays[i, k]:
+                    continue
+                b = 2 * (vX * (x1 - circles[0, i, k]) + vY * (y1 - circles[1, i, k]))
+                disc = b * b - (4 * a) * c[i, k]
+                # check if discriminat is negative ==> no collision
+                if not disc > 0:
+                    continue
+                sqrtDisc = math.sqrt(disc)
+                tc1 = (-b + sqrtDisc) * denominator
+                tc2 = (-b - sqrtDisc) * denominator
+                if tc1 >= 0 and tc1 < smallestTOfCircle:
+                    smallestTOfCircle = tc1
+                if tc2 >= 0 and tc2 < smallestTOfCircle:
+                    smallestTOfCircle = tc2
+            if smallestTOfCircle < 2048 and smallestTOfCircle < nearest:
+                nearest = smallestTOfCircle
+
+        t1NearestHit[i, j] = nearest
+
+
+@njit(parallel=True, cache=True, error_model='numpy')
+def collisionDistances(positions, lineStarts, lineEnds, circles, radii):
+    """
+    Calculates the shortest distance of every robot to every collider line and circle
+
+    :param positions: np.array (sensors x 2) - positions of the robots
+    :param lineStarts, lineEnds: np.array (2 x lines) - collider lines
+    :param circles: np.array (2 x sensors x circles) - centers of the collider circles of each robot
+    :param radii: np.array (sensors x circles) - radii of the collider circles of each robot
+    :return: tuple (np.array (sensors x lines), np.array (sensors x circles)) - distances to the lines and circles
+    """
+    numberOfSensors = positions.shape[0]
+    numberOfLines = lineStarts.shape[1]
+    numberOfCircles = radii.shape[1]
+    dist = np.empty((numberOfSensors, numberOfLines))
+    distCircles = np.empty((numberOfSensors, numberOfCircles))
+
+    for i in prange(numberOfSensors):
+        x1 = positions[i, 0]
+        y1 = positions[i, 1]
+        for l in range(numberOfLines):
+            x2 = lineStarts[0, l]
+            y2 = lineStarts[1, l]
+            x3 = lineEnds[0, l]
+            y3 = lineEnds[1, l]
+            t = ((x1 - x2) * (x3 - x2) + (y1 - y2) * (y3 - y2)) / ((x2 - x3) * (x2 - x3) + (y2 - y3) * (y2 - y3))
+            t = min(max(t, 0.0), 1.0)
+            dX = x1 - (x2 + t * (x3 - x2))
+            dY = y1 - (y2 + t * (y3 - y2))
+            dist[i, l] = math.sqrt(dX * dX + dY * dY)
+        for k in range(numberOfCircles):
+            dX = x1 - circles[0, i, k]
+            dY = y1 - circles[1, i, k]
+            distCircles[i, k] = math.sqrt(dX * dX + dY * dY) - radii[i, k]
+
+    return dist, distCircles
@@ -1,15 +1,13 @@
 from Environment.Components.Border import ColliderLine
+from Environment.Components.SwarmState import SwarmState
 
 import math
-from pynput.keyboard import Listener
-import copy
 import numpy as np
-from utils import scan1DTo2D, CircularBuffer
+from utils import scan1DTo2D, CircularBuffer, FrameHistory, observedRays, minPoolScan
 import torch
 
 import os
 import time
-from PIL import Image
 
 
 class Robot:
@@ -52,8 +50,10 @@ class Robot:
 
         # Variables regarding the state
         self.time_steps = args.time_frames #4
-        self.state_raw = []
-        self.stateLidar = []
+        # pose and velocities are stored in a row of a SwarmState (of the simulation, else of this robot alone)
+        self.swarm = None
+        self.swarmIndex = 0
+        self.stateLidar = FrameHistory(self.time_steps, observedRays(args))
         self.netOutput = (0,0)
         self.distances = []
         self.lidarHits = []
@@ -94,6 +94,8 @@ class Robot:
         # Maximum distance in laserscan is 20 meters
         self.maxDistFact = 1/20
         self.maxDistSim = 22
+        # own state until the simulation binds the robots of the level to a common SwarmState
+        SwarmState([self])
 
         #Pie Slice (chassy for better lidar detection as used with real robots)
         self.hasPieSlice = args.has_pie_slice
@@ -115,6 +117,11 @@ class Robot:
 
         self.walls = walls
         self.circleWalls = circleWalls
+        # Lidar.LevelGeometry of the walls, set by the simulation when the level is loaded
+        self.geometry = None
+        # optional VectorEnvironment.SharedObservations the frames are written to (row of this robot)
+        self.observationBuffer = None
+        self.observationRow = 0
         #only use with rectangular targets
         self.collidorStationsWalls = []
         # for pickUp in allStations:
@@ -131,6 +138,8 @@ class Robot:
 
         self.manuell = args.manually
         if self.manuell:
+            # imported only for manual control, pynput needs an X server
+            from pynput.keyboard import Listener
             self.listener = Listener(on_press=self.on_press, on_release=self.on_release)
             self.listener.start()
             self.linTast = 0
@@ -179,6 +188,7 @@ class Robot:
             self.station = goalStation
         self.goalX = self.station.getPosX()
         self.goalY = self.station.getPosY()
+        self.swarm.goalRadius[self.swarmIndex] = self.station.radius
 
         if walls != None:
             self.walls = walls
@@ -195,10 +205,9 @@ class Robot:
 
         frame = [posX, posY, directionX, directionY, linVel, angVel, self.goalX, self.goalY, goalDist, orientation]
 
-        for _ in range(self.time_steps):
-            self.push_frame(frame)
+        self.swarm.setFrame(self.swarmIndex, frame)
 
-        self.stateLidar = []
+        self.stateLidar.clear()
 
         self.stepsAlive = 0
         self.distances = []
@@ -243,23 +252,36 @@ class Robot:
 
     def push_frame(self, frame):
         """
-        adds the given frame to the end of the objects state list.
-        If the state has reached its maximum length (defined by timeframes in the constructor),
-        it will pop its first element of the list before adding the given frame.
+        makes the given frame the current frame of the robot (the current frame becomes the last frame)
 
         :param frame: list -
-            frame that should be added to the state
+            [posX, posY, directionX, directionY, linVel * dt, angVel * dt, goalX, goalY, goalDist, direction]
         """
-        if len(self.state_raw) >= self.time_steps:
-            self.state_raw.pop(0)
-            self.state_raw.append(frame)
-        else:
-            self.state_raw.append(frame)
+        self.swarm.pushFrame(self.swarmIndex, frame)
+
+    def getFrame(self, last=False):
+        """
+        :param last: Boolean - whether the last frame is returned instead of the current one
+        :return: list - [posX, posY, directionX, directionY, linVel * dt, angVel * dt, goalX, goalY, goalDist, direction]
+        """
+        return self.swarm.getFrame(self.swarmIndex, last)
+
+    @property
+    def state_raw(self):
+        """
+        read-only frame history for reward functions written against the old per robot state (e.g. the notebooks).
+        Only the current and the last frame are kept, so [time_steps - 1] is the current frame and all older
+        entries are the last frame.
+
+        :return: list of time_steps frames (see getFrame), oldest first
+        """
+        return [self.getFrame(last=True)] * (self.time_steps - 1) + [self.getFrame()]
 
     def update(self, dt, tarLinVel, tarAngVel):
         """
         updates the robots position, direction and velocities.
-        In addition to that a new frame is created
+        In addition to that a new frame is created.
+        The simulation moves all robots at once with SwarmState.move instead.
 
         :param dt: float -
             passed (simulated) time since last call
@@ -268,43 +290,31 @@ class Robot:
         :param tarAngVel: int/ float -
             target angular velocity
         """
-        posX, posY = self.getPosX(), self.getPosY()
-        goalX, goalY = self.goalX, self.goalY
-
+        rows = [self.swarmIndex]
         if not self.manuell:
-            linVel, angVel = self.computeNextVelocityContinuous(dt, self.getLinearVelocity(), self.getAngularVelocity(),
-                                                                tarLinVel, tarAngVel)
+            self.netOutput = (tarLinVel, tarAngVel)
+            velocities = self.swarm.computeNextVelocities([(tarLinVel, tarAngVel)], rows)
         else:
-            linVel = self.linTast
-            angVel = self.angTast
-
-        #print("linVel: ", linVel, "angVel: ", angVel)
-        oldDir = self.getDirectionAngle()
-        #directionVector = self.directionVectorFromAngle(oldDir)
+            velocities = np.array([(self.linTast, self.angTast)], dtype=float)
 
-        direction = (self.getDirectionAngle() + (angVel * dt) + 2 * math.pi) % (2 * math.pi)
-        directionVector = self.directionVectorFromAngle(direction)
+        # TODO Question: Should the linVel and angVel be saved with or without dt ?
+        deltaPos, deltaDir = self.swarm.move(dt, velocities, rows)
+        self.moved(deltaPos[0], deltaDir[0])
 
-        deltaPosX = directionVector[0] * linVel * dt  # math.cos(direction) * linVel * dt
-        deltaPosY = directionVector[1] * linVel * dt  # math.sin(direction) * linVel * dt
-        posX += deltaPosX
-        posY += deltaPosY
+    def moved(self, deltaPos, deltaDir):
+        """
+        updates the parts of the robot which are not stored in the SwarmState after the robot has been moved
 
+        :param deltaPos: np.array (float, float) - change of the position
+        :param deltaDir: float - change of the direction in radians
+        """
+        posX, posY = self.getPosX(), self.getPosY()
         self.last_positions.add(posX, posY)
 
-        deltaDir = direction - oldDir
-
-        goalDist = math.sqrt((posX-goalX)**2+(posY-goalY)**2)
-
         self.stepsAlive += 1
 
-        # TODO Question: Should the linVel and angVel be saved with or without dt ?
-        frame = [posX, posY, directionVector[0], directionVector[1], linVel * dt, angVel * dt, goalX, goalY, goalDist, direction]
-
-        self.push_frame(frame)
-
         if self.hasPieSlice:
-            self.updatePieSlice(deltaDir, (deltaPosX, deltaPosY))
+            self.updatePieSlice(deltaDir, (deltaPos[0], deltaPos[1]))
         else:
             self.posSensor = [posX, posY]
 
@@ -352,7 +362,7 @@ class Robot:
         self.posSensor = points[0]
         self.pieSlicePoints = points
 
-    def lidarReading(self, robots, stepsLeft, steps):
+    def lidarReading(self, robots, stepsLeft, steps, scan=None):
         """
         Creates a state with a virtual 2D laser scan
 
@@ -366,49 +376,13 @@ class Robot:
             the positions of the other robots are needed for the laser scan
         :param stepsLeft: remaining steps of current epoch
         :param steps: number of steps in one epoch
+        :param scan: tuple (distances, lidarHits, collisionDistances, collisionDistancesRobots) -
+            result of an already casted scan of this robot (e.g. by Lidar.SwarmCollisionRay).
+            If None the scan is casted by the robots own FastCollisionRay
         """
-
-        dir = (self.getDirectionAngle() - (self.fieldOfView / 2)) % (2 * math.pi)
-
-        colliderLines = self.walls + self.collidorStationsWalls + self.robotsPieSliceWalls
-        collidorCirclePosWithoutRobots = [(wall.getPosX(), wall.getPosY(), wall.getRadius()) for wall in self.circleWalls]
-        collidorCirclePosOnlyRobots = []
-
-        for robotA in robots:
-            if robotA is not self:
-                collidorCirclePosOnlyRobots.append((robotA.getPosX(), robotA.getPosY(), robotA.getRadius()))
-
-        if self.args.collide_other_targets:
-            collidorCirclePosWithoutRobots += self.collidorStationsCircles
-
-        colLinesStartPoints = np.swapaxes(np.array([cl.getStart() for cl in colliderLines]), 0, 1)  # [[x,x,x,x],[y,y,y,y]]
-        colLinesEndPoints = np.swapaxes(np.array([cl.getEnd() for cl in colliderLines]), 0, 1)
-        normals = np.swapaxes(np.array([cl.getN() for cl in colliderLines]), 0, 1)
-
-        collidorCircleAllForTerminations = collidorCirclePosWithoutRobots + collidorCirclePosOnlyRobots
-
-        if self.hasPieSlice:
-            position = self.posSensor
-            usedCircleCollider = collidorCirclePosWithoutRobots
-        else:
-            position = [self.getPosX(), self.getPosY()]
-            usedCircleCollider = collidorCircleAllForTerminations
-
-        circleX = [r[0] for r in usedCircleCollider]
-        circleY = [r[1] for r in usedCircleCollider]
-        circleR = [r[2] for r in usedCircleCollider]
-
-        circlesPositions = np.array([circleX, circleY])
-
-        #rayCol = FastCollisionRay(position, self.args.number_of_rays, dir, self.radius, self.fieldOfView)
-        self.rayCol.new_scan(position, dir)
-        distances, lidarHits = (self.rayCol.lineRayIntersectionPoint(colLinesStartPoints, colLinesEndPoints, normals, circlesPositions, circleR, self.offsetSensorDist))
-
-        circleX = [r[0] for r in collidorCircleAllForTerminations]
-        circleY = [r[1] for r in collidorCircleAllForTerminations]
-        circleR = [r[2] for r in collidorCircleAllForTerminations]
-        circlesPositionsAll = np.array([circleX, circleY])
-        self.collisionDistances, self.collisionDistancesRobots = self.rayCol.shortestDistanceToCollidors([self.getPosX(), self.getPosY()], colliderLines, circlesPositionsAll, circleR)
+        if scan is None:
+            scan = self.castRays(robots)
+        distances, lidarHits, self.collisionDistances, self.collisionDistancesRobots = scan
 
         self.lidarHits = [lidarHits]
         self.distances = [distances]
@@ -437,6 +411,8 @@ class Robot:
         distances = distances + noise
         laser = distances * self.maxDistFact
         laser = np.where(laser > 1, 1, laser)
+        if self.args.lidar_pooling > 1:
+            laser = minPoolScan(laser, self.args.lidar_pooling)
 
         # Convert 1D scan to 2D Scan # TODO DEPRECATED
         # if self.args.input_style == "image":
@@ -446,23 +422,74 @@ class Robot:
 
         frame_lidar = [laser, np.asarray(orientation), np.expand_dims(np.asarray(distance/self.maxDistSim), axis=0), np.array([self.getLinearVelocityNorm(), self.getAngularVelocityNorm()]), currentTimestep]
 
-        if len(self.stateLidar) >= self.time_steps:
-            self.stateLidar.pop(0)
-            self.stateLidar.append(frame_lidar)
+        self.stateLidar.add(*frame_lidar)
+
+        if self.observationBuffer is not None:
+            self.observationBuffer.pushFrame(self.observationRow, frame_lidar)
+
+    def castRays(self, robots):
+        """
+        Casts the rays of the robots laser scanner with its own FastCollisionRay
+        and calculates the distances to the nearest colliders
+
+        :param robots: list of Robot.Robot objects -
+            the positions of the other robots are needed for the laser scan
+        :return: tuple (distances, lidarHits, collisionDistances, collisionDistancesRobots)
+        """
+        dir = (self.getDirectionAngle() - (self.fieldOfView / 2)) % (2 * math.pi)
+
+        colLinesStartPoints, colLinesEndPoints, normals = self.geometry.getLines(self)  # [[x,x,x,x],[y,y,y,y]]
+        collidorCirclePosWithoutRobots = []
+        collidorCirclePosOnlyRobots = []
+
+        for robotA in robots:
+            if robotA is not self and self.isNeighbor(robotA):
+                collidorCirclePosOnlyRobots.append((robotA.getPosX(), robotA.getPosY(), robotA.getRadius()))
+
+        if self.args.collide_other_targets:
+            collidorCirclePosWithoutRobots += self.collidorStationsCircles
+
+        collidorCircleAllForTerminations = collidorCirclePosWithoutRobots + collidorCirclePosOnlyRobots
+
+        if self.hasPieSlice:
+            position = self.posSensor
+            usedCircleCollider = collidorCirclePosWithoutRobots
         else:
-            self.stateLidar.append(frame_lidar)
+            position = [self.getPosX(), self.getPosY()]
+            usedCircleCollider = collidorCircleAllForTerminations
+
+        circleX = [r[0] for r in usedCircleCollider]
+        circleY = [r[1] for r in usedCircleCollider]
+        circleR = np.concatenate((self.geometry.radii, [r[2] for r in usedCircleCollider]))
+
+        circlesPositions = np.concatenate((self.geometry.circles, np.array([circleX, circleY]).reshape(2, -1)), axis=1)
+
+        #rayCol = FastCollisionRay(position, self.args.number_of_rays, dir, self.radius, self.fieldOfView)
+        self.rayCol.new_scan(position, dir)
+        distances, lidarHits = (self.rayCol.lineRayIntersectionPoint(colLinesStartPoints, colLinesEndPoints, normals, circlesPositions, circleR, self.offsetSensorDist))
+
+        circleX = [r[0] for r in collidorCircleAllForTerminations]
+        circleY = [r[1] for r in collidorCircleAllForTerminations]
+        circleR = np.concatenate((self.geometry.radii, [r[2] for r in collidorCircleAllForTerminations]))
+        circlesPositionsAll = np.concatenate((self.geometry.circles, np.array([circleX, circleY]).reshape(2, -1)), axis=1)
+
+        # the clearance to the walls and circular obstacles of the level is looked up in the distance field (if used),
+        # only the distances to the dynamic colliders are calculated
+        field = self.geometry.distanceField
+        clearance = None if field is None else field.lookup(np.array([[self.getPosX(), self.getPosY()]]))
+        if clearance is not None:
+            staticLines = self.geometry.numberOfStaticLines
+            colLinesStartPoints, colLinesEndPoints = colLinesStartPoints[:, staticLines:], colLinesEndPoints[:, staticLines:]
+            circleWalls = len(self.geometry.radii)
+            circlesPositionsAll, circleR = circlesPositionsAll[:, circleWalls:], circleR[circleWalls:]
+        collisionDistances, collisionDistancesRobots = self.rayCol.shortestDistanceToCollidors([self.getPosX(), self.getPosY()], colLinesStartPoints, colLinesEndPoints, circlesPositionsAll, circleR)
+        if clearance is not None:
+            collisionDistances = np.concatenate((clearance, collisionDistances))
+
+        return distances, lidarHits, collisionDistances, collisionDistancesRobots
 
     def get_state_lidar(self, reversed = False):
-        tmp_state = copy.deepcopy(self.stateLidar)
-        if reversed:
-             tmp_state.reverse()
-        return tmp_state
-        # tmp_state = copy.deepcopy(self.stateLidar)
-        # zipstate = list(zip(*tmp_state))
-        # states = []
-        # for state in zipstate:
-        #     states.append(np.array(state))
-        # return states
+        return self.stateLidar.get_frames(reversed)
 
     def computeNextVelocityContinuous(self, dt, linVel, angVel, tarLinVel, tarAngVel):
         """
@@ -476,21 +503,9 @@ class Robot:
 
         self.netOutput = (tarLinVel, tarAngVel)
 
-        # Check if tarLinVel and tarAngVel are within bounds
-        if tarLinVel < -1 or tarLinVel > 1 or tarAngVel < -1 or tarAngVel > 1:
-            raise Exception("velocity received from neural net is out of bounds. Fix your code!")
-
-        # Map the net output range of -1 to 1 onto the velocity ranges of the robot
-        tarAngVel = tarAngVel * ((self.maxAngularVelocity - self.minAngularVelocity) * 0.5) + (
-                    (self.minAngularVelocity + self.maxAngularVelocity) * 0.5)
-        tarLinVel = tarLinVel * ((self.maxLinearVelocity - self.minLinearVelocity) * 0.5) + (
-                    (self.minLinearVelocity + self.maxLinearVelocity) * 0.5)
-
-        # Check boundaries
-        tarLinVel = max(self.minLinearVelocity, min(tarLinVel, self.maxLinearVelocity))
-        tarAngVel = max(self.minAngularVelocity, min(tarAngVel, self.maxAngularVelocity))
-
-        return np.around(tarLinVel, decimals=3), np.around(tarAngVel, decimals=3)
+        # Map the net output range of -1 to 1 onto the velocity ranges of the robot (checks the bounds)
+        linVel, angVel = self.swarm.computeNextVelocities([(tarLinVel, tarAngVel)], [self.swarmIndex])[0]
+        return linVel, angVel
 
         # # beschleunigen
         # if linVel < tarLinVel:
@@ -530,6 +545,17 @@ class Robot:
         angY = math.sin(direction)
         return [angX, angY]
 
+    def isNeighbor(self, robot):
+        """
+        Robots whose chassis is farther away than the lidar range (maxDistSim) are not used as colliders, as the lidar
+        readings beyond the range are clipped anyway (see Lidar.NeighborGrid)
+        :param robot: Robot.Robot - another robot
+        :return: Boolean - whether the chassis of the robot is within the lidar range
+        """
+        dX = robot.getPosX() - self.getPosX()
+        dY = robot.getPosY() - self.getPosY()
+        return math.sqrt(dX * dX + dY * dY) - robot.getRadius() <= self.maxDistSim
+
     def collideWithTargetStationCircular(self):
         """
         :return: Boolean
@@ -564,48 +590,46 @@ class Robot:
                          (self.getPosY() - self.getGoalY()) ** 2) < r
 
     def getPosX(self):
-        return self.state_raw[self.time_steps - 1][0]
+        return self.swarm.position[self.swarmIndex, 0]
 
     def getPosY(self):
-        return self.state_raw[self.time_steps - 1][1]
+        return self.swarm.position[self.swarmIndex, 1]
 
     def getLastPosX(self):
-        return self.state_raw[self.time_steps - 2][0]
+        return self.swarm.lastPosition[self.swarmIndex, 0]
 
     def getLastPosY(self):
-        return self.state_raw[self.time_steps - 2][1]
+        return self.swarm.lastPosition[self.swarmIndex, 1]
 
     def getDirectionX(self):
-        return self.state_raw[self.time_steps - 1][2]
+        return self.swarm.direction[self.swarmIndex, 0]
 
     def getDirectionY(self):
-        return self.state_raw[self.time_steps - 1][3]
+        return self.swarm.direction[self.swarmIndex, 1]
 
     def getLastDirectionX(self):
-        return self.state_raw[self.time_steps - 2][2]
+        return self.swarm.lastDirection[self.swarmIndex, 0]
 
     def getLastDirectionY(self):
-        return self.state_raw[self.time_steps - 2][3]
+        return self.swarm.lastDirection[self.swarmIndex, 1]
 
     def getLinearVelocity(self):
-        return np.around(self.state_raw[self.time_steps - 1][4], decimals=5)
+        return self.swarm.roundedVelocity[self.swarmIndex, 0]
 
     def getAngularVelocity(self):
-        return np.around(self.state_raw[self.time_steps - 1][5], decimals=5)
+        return self.swarm.roundedVelocity[self.swarmIndex, 1]
 
     def getLinearVelocityNorm(self):
-        return np.around((self.getLinearVelocity() - ((self.minLinearVelocity + self.maxLinearVelocity) * 0.5)) / (
-                    (self.maxLinearVelocity - self.minLinearVelocity) * 0.5), decimals=5)
+        return self.swarm.normalisedVelocity[self.swarmIndex, 0]
 
     def getAngularVelocityNorm(self):
-        return np.around((self.getAngularVelocity() - ((self.minAngularVelocity + self.maxAngularVelocity) * 0.5)) / (
-                (self.maxAngularVelocity - self.minAngularVelocity) * 0.5), decimals=5)
+        return self.swarm.normalisedVelocity[self.swarmIndex, 1]
 
     def getGoalX(self):
-        return self.state_raw[self.time_steps - 1][6]
+        return self.swarm.goal[self.swarmIndex, 0]
 
     def getGoalY(self):
-        return self.state_raw[self.time_steps - 1][7]
+        return self.swarm.goal[self.swarmIndex, 1]
 
     def getVelocity(self):
         return self.getLinearVelocity(), self.getAngularVelocity()
@@ -628,13 +652,14 @@ class Robot:
         :return: Current forward Dir in Range of 0 to 2Pi
         """
         if not last:
-            return self.state_raw[self.time_steps - 1][9]
-        return self.state_raw[self.time_steps - 2][9]
+            return self.swarm.heading[self.swarmIndex]
+        return self.swarm.lastHeading[self.swarmIndex]
 
     def setGoal(self, goal):
         goalX, goalY = goal
         self.goalX = goalX
         self.goalY = goalY
+        self.swarm.goal[self.swarmIndex] = goal
 
     def on_press(self, key):
         if key.char == 'w':
@@ -797,11 +822,20 @@ class FastCollisionRay:
 
         return [t1NearestHit, collisionPoints]
 
-    def shortestDistanceToCollidors(self, pos, lineSegments, circles, radii):
+    def shortestDistanceToCollidors(self, pos, points1, points2, circles, radii):
+        """
+
+        :param pos: (x,y) position of the robot
+        :param points1: List of starting points of collision lines - points[[x1,x2,x3...xn],[y1,y2,y3...yn]]
+        :param points2: List of ending points of collision lines - points[[x1,x2,x3...xn],[y1,y2,y3...yn]]
+        :param circles: List of all circle colliders positions as an np.array[[x0, x2, x3..xn], [y0, y2, y3..yn]]
+        :param radii: List of the radii of the circle colliders
+        :return: tuple (distances to all colliders, distances to the circle colliders)
+        """
         x1, y1 = pos  # originX and originY
 
-        x2, y2 = np.array([segment.getStart() for segment in lineSegments]).T  # lineStartXArray and lineStartYArray
-        x3, y3 = np.array([segment.getEnd() for segment in lineSegments]).T  # lineEndXArray and lineEndYArray
+        x2, y2 = points1  # lineStartXArray and lineStartYArray
+        x3, y3 = points2  # lineEndXArray and lineEndYArray
 
         t = np.clip(((x1 - x2) * (x3 - x2) + (y1 - y2) * (y3 - y2)) / ((x2 - x3) ** 2 + (y2 - y3) ** 2), 0, 1)
         dist = np.sqrt((x1 - (x2 + t * (x3 - x2))) ** 2 + (y1 - (y2 + t * (y3 - y2))) ** 2)
@@ -1,5 +1,3 @@
-from PyQt5.QtGui import QBrush, QPen, QColor
-from PyQt5.QtCore import Qt
 from Environment.Components.Border import ColliderLine
 
 class Station:
@@ -10,18 +8,23 @@ class Station:
 
         self.radius = radius
 
-        brightness = 235 - (int((color * 39) / 255) * 80)
-        brightness = 255
-        self.color = QColor.fromHsv((color * 39) % 255, 255, brightness)
-
-        self.lineColor = self.color  # Qt.red Qt.blue
-        self.fillColor = self.color  # Qt.red Qt.blue
+        # the QColor is created when the station is painted the first time, so stations can be used without PyQt5
+        self.colorIndex = color
+        self.color = None
 
         self.thickness = 2
-        self.lineStyle = Qt.SolidLine
-        self.brushStyle = Qt.SolidPattern
 
     def paint(self, painter):
+        from PyQt5.QtGui import QBrush, QPen, QColor
+        from PyQt5.QtCore import Qt
+        if self.color is None:
+            #brightness = 235 - (int((self.colorIndex * 39) / 255) * 80)
+            brightness = 255
+            self.color = QColor.fromHsv((self.colorIndex * 39) % 255, 255, brightness)
+            self.lineColor = self.color  # Qt.red Qt.blue
+            self.fillColor = self.color  # Qt.red Qt.blue
+            self.lineStyle = Qt.SolidLine
+            self.brushStyle = Qt.SolidPattern
         painter.setPen(QPen(self.lineColor, self.thickness, self.lineStyle))
         painter.setBrush(QBrush(self.fillColor, self.brushStyle))
         painter.drawEllipse((self.posX-self.radius) * self.scaleFactor, (self.posY-self.radius) * self.scaleFactor, self.radius*2 * self.scaleFactor, self.radius*2 * self.scaleFactor)
@@ -57,8 +60,5 @@ class Station:
         self.scaleFactor = scaleFactor
 
     def setColor(self, i):
-        #brightness = 235 - (int((i * 39) / 255) * 80)
-        brightness = 255
-        self.color = QColor.fromHsv((i * 39) % 255, 255, brightness)
-        self.lineColor = self.color  # Qt.red Qt.blue
-        self.fillColor = self.color  # Qt.red Qt.blue
\ No newline at end of file
+        self.colorIndex = i
+        self.color = None
\ No newline at end of file
@@ -0,0 +1,175 @@
+import numpy as np
+
+
+class SwarmState:
+    """
+    Kinematic state of the robots of a simulation as numpy arrays (one row per robot): positions, headings, direction
+    vectors, velocities and goals of the current and of the last frame. The velocities and poses of all robots are
+    integrated at once, the robots only read their row (see Robot.getPosX etc.).
+
+    The velocities are stored per time step (velocity * dt) like in the frames of the robots.
+    """
+
+    def __init__(self, robots):
+        """
+        Creates the state of the robots with their current values and binds the robots to it
+
+        :param robots: list of Robot.Robot objects
+        """
+        n = len(robots)
+        self.position = np.zeros((n, 2))
+        self.direction = np.zeros((n, 2))
+        self.heading = np.zeros(n)
+        self.velocity = np.zeros((n, 2))
+        self.goal = np.zeros((n, 2))
+        self.goalDistance = np.zeros(n)
+
+        # radii of the robots and of their goal stations (for the termination checks)
+        self.radius = np.array([robot.radius for robot in robots], dtype=float)
+        self.goalRadius = np.array([robot.station.radius for robot in robots], dtype=float)
+
+        self.lastPosition = np.zeros((n, 2))
+        self.lastDirection = np.zeros((n, 2))
+        self.lastHeading = np.zeros(n)
+        self.lastVelocity = np.zeros((n, 2))
+        self.lastGoalDistance = np.zeros(n)
+
+        # velocities rounded (and normalised) once per step instead of every time they are read
+        self.roundedVelocity = np.zeros((n, 2))
+        self.normalisedVelocity = np.zeros((n, 2))
+
+        # limits of the linear and angular velocities (min, max) of every robot
+        self.linearVelocityLimits = np.array([(robot.minLinearVelocity, robot.maxLinearVelocity) for robot in robots],
+                                             dtype=float).reshape(-1, 2)
+        self.angularVelocityLimits = np.array([(robot.minAngularVelocity, robot.maxAngularVelocity) for robot in robots],
+                                              dtype=float).reshape(-1, 2)
+
+        for i, robot in enumerate(robots):
+            if getattr(robot, 'swarm', None) is not None and len(robot.swarm.heading) > 0:
+                self.setFrame(i, robot.getFrame(last=True))
+                self.pushFrame(i, robot.getFrame())
+            robot.swarm = self
+            robot.swarmIndex = i
+
+    def setFrame(self, i, frame):
+        """
+        Sets the current and the last frame of a robot (e.g. when it is reset)
+
+        :param i: int - row of the robot
+        :param frame: list - [posX, posY, directionX, directionY, linVel * dt, angVel * dt, goalX, goalY, goalDist,
+            direction]
+        """
+        self.pushFrame(i, frame)
+        self.lastPosition[i] = self.position[i]
+        self.lastDirection[i] = self.direction[i]
+        self.lastHeading[i] = self.heading[i]
+        self.lastVelocity[i] = self.velocity[i]
+        self.lastGoalDistance[i] = self.goalDistance[i]
+
+    def pushFrame(self, i, frame):
+        """
+        Makes the current frame of a robot its last frame and sets the given frame as current frame
+
+        :param i: int - row of the robot
+        :param frame: list - see setFrame
+        """
+        self.shiftFrames(i)
+        self.position[i] = frame[0:2]
+        self.direction[i] = frame[2:4]
+        self.velocity[i] = frame[4:6]
+        self.goal[i] = frame[6:8]
+        self.goalDistance[i] = frame[8]
+        self.heading[i] = frame[9]
+        self.roundVelocities(i)
+
+    def shiftFrames(self, rows):
+        self.lastPosition[rows] = self.position[rows]
+        self.lastDirection[rows] = self.direction[rows]
+        self.lastHeading[rows] = self.heading[rows]
+        self.lastVelocity[rows] = self.velocity[rows]
+        self.lastGoalDistance[rows] = self.goalDistance[rows]
+
+    def getFrame(self, i, last=False):
+        """
+        :param i: int - row of the robot
+        :param last: bool - whether the last or the current frame is returned
+        :return: list - frame of the robot, see setFrame
+        """
+        if last:
+            return self.lastPosition[i].tolist() + self.lastDirection[i].tolist() + self.lastVelocity[i].tolist() + \
+                   self.goal[i].tolist() + [float(self.lastGoalDistance[i]), float(self.lastHeading[i])]
+        return self.position[i].tolist() + self.direction[i].tolist() + self.velocity[i].tolist() + \
+               self.goal[i].tolist() + [float(self.goalDistance[i]), float(self.heading[i])]
+
+    def roundVelocities(self, rows):
+        self.roundedVelocity[rows] = np.around(self.velocity[rows], decimals=5)
+        mid = (self.linearVelocityLimits[rows, 0] + self.linearVelocityLimits[rows, 1]) * 0.5
+        halfRange = (self.linearVelocityLimits[rows, 1] - self.linearVelocityLimits[rows, 0]) * 0.5
+        self.normalisedVelocity[rows, 0] = np.around((self.roundedVelocity[rows, 0] - mid) / halfRange, decimals=5)
+        mid = (self.angularVelocityLimits[rows, 0] + self.angularVelocityLimits[rows, 1]) * 0.5
+        halfRange = (self.angularVelocityLimits[rows, 1] - self.angularVelocityLimits[rows, 0]) * 0.5
+        self.normalisedVelocity[rows, 1] = np.around((self.roundedVelocity[rows, 1] - mid) / halfRange, decimals=5)
+
+    def computeNextVelocities(self, targetVelocities, rows):
+        """
+        Maps the net outputs onto the velocity ranges of the robots (see Robot.computeNextVelocityContinuous)
+
+        :param targetVelocities: np.array (len(rows), 2) - target linear and angular velocities (net output, -1 to 1)
+        :param rows: np.array - rows of the robots
+        :return: np.array (len(rows), 2) - linear and angular velocities
+        """
+        targetVelocities = np.asarray(targetVelocities, dtype=np.float64).reshape(-1, 2)
+        if np.any(targetVelocities < -1) or np.any(targetVelocities > 1):
+            raise Exception("velocity received from neural net is out of bounds. Fix your code!")
+
+        velocities = np.empty_like(targetVelocities)
+        for column, limits in enumerate((self.linearVelocityLimits[rows], self.angularVelocityLimits[rows])):
+            minimum, maximum = limits[:, 0], limits[:, 1]
+            velocity = targetVelocities[:, column] * ((maximum - minimum) * 0.5) + ((minimum + maximum) * 0.5)
+            velocities[:, column] = np.maximum(minimum, np.minimum(velocity, maximum))
+        return np.around(velocities, decimals=3)
+
+    def move(self, dt, velocities, rows):
+        """
+        Integrates the velocities of the robots for one time step and pushes the new frames
+
+        :param dt: float - passed (simulated) time since last call
+        :param velocities: np.array (len(rows), 2) - linear and angular velocities of the robots
+        :param rows: np.array - rows of the robots to move
+        :return: tuple (np.array (len(rows), 2) change of the positions, np.array (len(rows),) change of the headings)
+        """
+        linVel, angVel = velocities[:, 0], velocities[:, 1]
+        oldHeading = self.heading[rows]
+        heading = (oldHeading + (angVel * dt) + 2 * np.pi) % (2 * np.pi)
+        direction = np.stack((np.cos(heading), np.sin(heading)), axis=1)
+        deltaPosition = direction * linVel[:, None] * dt
+        position = self.position[rows] + deltaPosition
+        goal = self.goal[rows]
+
+        self.shiftFrames(rows)
+        self.position[rows] = position
+        self.direction[rows] = direction
+        self.heading[rows] = heading
+        self.velocity[rows] = velocities * dt
+        self.goalDistance[rows] = np.sqrt((position[:, 0] - goal[:, 0]) ** 2 + (position[:, 1] - goal[:, 1]) ** 2)
+        self.roundVelocities(rows)
+        return deltaPosition, heading - oldHeading
+
+    def terminations(self, rows, nearestCollisions, stepsLeft):
+        """
+        Checks the exit conditions of the robots (see Robot.collideWithTargetStationCircular) for all of them at once
+
+        :param rows: np.array - rows of the robots to check
+        :param nearestCollisions: np.array (len(rows)) - distance of every robot to its nearest collider
+        :param stepsLeft: int - steps left in the current episode
+        :return: tuple of np.arrays (len(rows)) of bools - collision with walls or other robots, reached goal,
+            run out of time
+        """
+        position = self.position[rows]
+        goal = self.goal[rows]
+        radius = self.radius[rows]
+        collision = nearestCollisions <= radius + 0.0
+        distanceToGoal = np.sqrt((goal[:, 0] - position[:, 0]) ** 2 + (goal[:, 1] - position[:, 1]) ** 2) + radius
+        reachedGoal = distanceToGoal < self.goalRadius[rows] * 1.2
+        runOutOfTime = np.full(len(position), stepsLeft <= 0)
+        return collision, reachedGoal, runOutOfTime
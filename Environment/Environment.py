@@ -2,7 +2,7 @@ from Environment.Simulation import Simulation
 
 import math
 import numpy as np
-from utils import is_staying_in_place
+from utils import is_staying_in_place, observedRays
 
 
 class Environment:
@@ -10,12 +10,15 @@ class Environment:
     Defines the environment of the reinforcement learning algorithm
     """
 
-    def __init__(self, app, args, timeframes, level, reward_func=None):
+    def __init__(self, app, args, timeframes, level, reward_func=None, swarm_reward_func=None):
         """
         :param app: PyQt5.QtWidgets.QApplication
         :param args: args defined in main
         :param timeframes: int -
             the amount of frames saved as a history by the robots to train the neural net
+        :param reward_func: reward function of a single robot (see perRobotReward), e.g. the one of the notebooks.
+            Is preferred over swarm_reward_func if both are given
+        :param swarm_reward_func: reward function of all robots at once (see createReward). Default: createReward
         """
 
         self.args = args
@@ -29,10 +32,13 @@ class Environment:
         self.done = False
         self.shape = np.asarray([0]).shape
         self.piFact = 1 / math.pi
-        if reward_func is None:
-            self.reward_func = self.createReward
+        if reward_func is not None:
+            self.reward_func = perRobotReward(reward_func)
+        elif swarm_reward_func is not None:
+            self.reward_func = swarm_reward_func
         else:
-            self.reward_func = reward_func
+            self.reward_func = self.createReward
+        self.rewardComponents = {}
 
     def get_observation(self, i):
         """
@@ -54,6 +60,27 @@ class Environment:
             #return np.asarray(self.simulation.robots[i].get_state_lidar(reversed))  # Sonardaten von x Frames, Winkel zum Ziel, Abstand zum Ziel
             return self.simulation.robots[i].get_state_lidar(reversed)  # Sonardaten von x Frames, Winkel zum Ziel, Abstand zum Ziel
 
+    def get_observations(self, robotIndices=None):
+        """
+        Packs the lidar states of the robots into contiguous float32 arrays (newest frame first), which can be used by
+        the neural net (torch.from_numpy) and the memory without further conversion
+
+        :param robotIndices: list of ints - robots whose observations are packed. If None all robots are used
+        :return: list of np.arrays [laser (robots x frames x rays), orientation (robots x frames x 2),
+            distance (robots x frames x 1), velocity (robots x frames x 2)]
+        """
+        robots = self.simulation.robots
+        if robotIndices is None:
+            robotIndices = range(len(robots))
+        observations = [np.empty((len(robotIndices), self.timeframs, observedRays(self.args)), dtype=np.float32),
+                        np.empty((len(robotIndices), self.timeframs, 2), dtype=np.float32),
+                        np.empty((len(robotIndices), self.timeframs, 1), dtype=np.float32),
+                        np.empty((len(robotIndices), self.timeframs, 2), dtype=np.float32)]
+        for k, i in enumerate(robotIndices):
+            for observation, channel in zip(observations, robots[i].stateLidar.get_arrays(reversed=True)):
+                observation[k] = channel
+        return observations
+
     @staticmethod
     def get_actions():
         """
@@ -100,7 +127,9 @@ class Environment:
         Executes a step in the environment and updates the simulation
 
         :param actions: list of all actions of every robot to take in this step
-        :return: returns the new state of every robot in a list called robotsDataCurrentFrame
+        :return: tuple (list of np.arrays observations of the robots (see get_observations), np.array rewards,
+            np.array dones (1 if the robot is still active, 0 if it is done), np.array of bools reached pickups).
+            The named components of the rewards are stored in rewardComponents
         """
 
         self.steps_left -= 1
@@ -108,134 +137,93 @@ class Environment:
 
         ######## Update der Simulation #######
 
-        robotsTermination = self.simulation.update(actions, self.steps_left, activations, proximity)
-
-        states = []
-        rewards = []
-        dones = []
-        reachedPickups = []
-
-        for i, termination in enumerate(robotsTermination):
-            if termination != (None, None, None):
-                state, reward, done, reachedPickup = self.extractRobotData(i, robotsTermination[i])
-                states.append(state)
-                rewards.append(reward)
-                dones.append(1 - done)
-                reachedPickups.append(reachedPickup)
-            else:
-                # set robot to inactive if it has crashed with a wall or another robot
-                pass
-
-        return states, rewards, dones, reachedPickups
+        robotIndices, collisions, reachedPickups, runOutOfTimes = \
+            self.simulation.update(actions, self.steps_left, activations, proximity)
 
-    def extractRobotData(self, i, terminations):
-        """
-        Extracts state and calculates reward for the i-th robot
-        :param i: i-th robot
-        :param terminations: tuple - terminations of a single robot
-            (Boolean collision with walls or other robots, Boolean reached PickUp, Boolean runOutOfTime)
-        :return: tuple (list next state, float reward, Boolean is robot done, Boolean has reached goal)
-        """
-        robot = self.simulation.robots[i]
-        collision, reachedPickup, runOutOfTime = terminations
-
-        ############ State Robot i ############
-        next_state = self.get_observation(i)
-
-        ############ Euklidsche Distanz und Orientierung ##############
+        ############ Euklidsche Distanz zum Ziel vor und nach dem Schritt ##############
 
-        goal_pos_x = robot.getGoalX()
-        goal_pos_y = robot.getGoalY()
-        robot_pos_old_x = robot.getLastPosX()
-        robot_pos_old_y = robot.getLastPosY()
+        swarm = self.simulation.swarm
+        distancesOld = swarm.lastGoalDistance[robotIndices]
+        distancesNew = swarm.goalDistance[robotIndices]
 
-        robot_pos_current_x = robot.getPosX()
-        robot_pos_current_y = robot.getPosY()
+        ########### REWARD CALCULATION ################
 
-        distance_old = math.sqrt((robot_pos_old_x - goal_pos_x) ** 2 +
-                                 (robot_pos_old_y - goal_pos_y) ** 2)
-        distance_new = math.sqrt(
-            (robot_pos_current_x - goal_pos_x) ** 2 +
-            (robot_pos_current_y - goal_pos_y) ** 2)
+        robots = [self.simulation.robots[i] for i in robotIndices]
+        rewards, components = self.reward_func(robots, distancesNew, distancesOld, reachedPickups, collisions,
+                                               runOutOfTimes, swarm.velocity[robotIndices, 1])
+        self.rewardComponents = components if components is not None else {'reward': rewards}
+        dones = 1 - (collisions | reachedPickups | runOutOfTimes).astype(int)
 
-        ########### REWARD CALCULATION ################
+        return self.get_observations(robotIndices), rewards, dones, reachedPickups
 
-        reward = self.reward_func(robot, distance_new, distance_old, reachedPickup, collision, runOutOfTime)
+    def createAdaptiveReward(self, robots, dist_new, dist_old, reachedPickup, collision, runOutOfTime,
+                             angularVelocity):
+        """
+        Creates a reward based on distance to goal, reaching the goal, avoiding collisions, and smooth movement.
+        All parameters are arrays with one entry per robot.
+
+        :param robots: list of the robots that are rewarded
+        :param dist_new: np.array - the new distance to the goal after the action has been taken
+        :param dist_old: np.array - the old distance to the goal before the action was taken
+        :param reachedPickup: np.array of bools - whether the robot reached its goal in this step
+        :param collision: np.array of bools - whether the robot collided with a wall or another robot
+        :param runOutOfTime: np.array of bools - whether the robot ran out of time
+        :param angularVelocity: np.array - the angular velocity of the robot (per time step)
+        :return: tuple (np.array rewards, dict of np.arrays - reward for each component)
+        """
 
-        return [next_state, reward, not robot.isActive(), reachedPickup]
-    def createAdaptiveReward(self, robot, dist_new, dist_old, reachedPickup, collision, runOutOfTime):
-    """
-    Creates a reward based on distance to goal, reaching the goal, avoiding collisions, and smooth movement.
-
-    :param robot: robot object that contains state information like angular velocity
-    :param dist_new: the new distance to the goal after the action has been taken
-    :param dist_old: the old distance to the goal before the action was taken
-    :param reachedPickup: Boolean flag indicating if the robot reached its goal in this step
-    :param collision: Boolean flag indicating if the robot collided with a wall or another robot
-    :param runOutOfTime: Boolean flag indicating if the robot ran out of time
-    :return: A dictionary of rewards for each component based on the robot's actions
-    """
-    
-    # Calculate the living factor, which is the ratio of remaining steps to total steps
-    living_factor = self.steps_left / self.steps
-    
-    # Initialize an empty dictionary to store reward components
-    reward = {}
-
-    # Set values for different reward and penalty components
-    r_arrival = 30  # Reward for reaching the goal (higher value indicates a higher reward for arrival)
-    r_collision = -20  # Penalty for collision (negative value represents a penalty)
-    r_runOutOfTime = -10  # Penalty for running out of time
-    w_close = 4  # Weight for reducing distance when the robot is close to the goal
-    w_far = 2  # Weight for reducing distance when the robot is far from the goal
-    w_angular_penalty = -0.2  # Penalty for excessive angular velocity (negative value penalizes higher angular velocity)
-    distance_threshold = 0.5  # Threshold for considering the robot close to the goal
-    angular_velocity_threshold = 0.8  # Threshold for considering the robot's angular velocity too high
-
-    # If the robot has reached the goal, assign the corresponding reward
-    if reachedPickup:
-        reward['arrival'] = r_arrival
-    # If the robot has collided, assign the corresponding penalty
-    elif collision:
-        reward['collision'] = r_collision
-    # If the robot has run out of time, assign the corresponding penalty
-    elif runOutOfTime:
-        reward['out_of_time'] = r_runOutOfTime
-    else:
-        # Proximity-based distance reward: reward the robot for reducing the distance to the goal
-        if dist_old > dist_new:  # If the robot has reduced the distance to the goal
-            if dist_new < distance_threshold:  # If the robot is close to the goal
-                reward['proximity'] = w_close * (dist_old - dist_new)  # Use close proximity weight
-            else:  # If the robot is far from the goal
-                reward['proximity'] = w_far * (dist_old - dist_new)  # Use far proximity weight
-        else:  # If the robot has increased the distance to the goal
-            reward['proximity'] = w_far * (dist_old - dist_new)  # Penalize or reward based on the distance change
+        # Set values for different reward and penalty components
+        r_arrival = 30  # Reward for reaching the goal (higher value indicates a higher reward for arrival)
+        r_collision = -20  # Penalty for collision (negative value represents a penalty)
+        r_runOutOfTime = -10  # Penalty for running out of time
+        w_close = 4  # Weight for reducing distance when the robot is close to the goal
+        w_far = 2  # Weight for reducing distance when the robot is far from the goal
+        w_angular_penalty = -0.2  # Penalty for excessive angular velocity (negative value penalizes higher angular velocity)
+        distance_threshold = 0.5  # Threshold for considering the robot close to the goal
+        angular_velocity_threshold = 0.8  # Threshold for considering the robot's angular velocity too high
+
+        # Only one of arrival, collision and running out of time is rewarded (in this order), the other robots are
+        # rewarded for their movement
+        arrival = reachedPickup
+        crashed = collision & ~arrival
+        outOfTime = runOutOfTime & ~(arrival | collision)
+        moving = ~(arrival | collision | runOutOfTime)
+
+        # Proximity-based distance reward: reward the robot for reducing the distance to the goal, with a higher
+        # weight if it is close to the goal
+        closer = (dist_old > dist_new) & (dist_new < distance_threshold)
+        proximity = np.where(closer, w_close, w_far) * (dist_old - dist_new)
 
         # Smoothness reward: penalize the robot for excessive angular velocity
-        # Assuming the robot's angular velocity is stored in the 5th index of its state_raw attribute
-        current_angular_velocity = abs(robot.state_raw[robot.time_steps - 1][5])  # Get the current angular velocity
-        if current_angular_velocity > angular_velocity_threshold:  # If angular velocity exceeds threshold
-            reward['smoothness'] = w_angular_penalty * current_angular_velocity  # Apply penalty for excessive angular velocity
+        current_angular_velocity = np.abs(angularVelocity)
+        smoothness = np.where(current_angular_velocity > angular_velocity_threshold,
+                              w_angular_penalty * current_angular_velocity, 0.0)
+
+        reward = {'arrival': np.where(arrival, float(r_arrival), 0.0),
+                  'collision': np.where(crashed, float(r_collision), 0.0),
+                  'out_of_time': np.where(outOfTime, float(r_runOutOfTime), 0.0),
+                  'proximity': np.where(moving, proximity, 0.0),
+                  'smoothness': np.where(moving, smoothness, 0.0)}
 
-    # Return the dictionary containing the rewards
-    return reward
+        return reward['arrival'] + reward['collision'] + reward['out_of_time'] + reward['proximity'] + \
+            reward['smoothness'], reward
 
 
-    def createReward(self, robot, dist_new, dist_old, reachedPickup, collision, runOutOfTime):
+    def createReward(self, robots, dist_new, dist_old, reachedPickup, collision, runOutOfTime, angularVelocity):
         """
         Creates a (sparse) reward based on the euklidian distance, if the robot has reached his goal and if the robot
-        collided with a wall or another robot.
-
-        :param robot: robot
-        :param dist_new: the new distance (after the action has been taken)
-        :param dist_old: the old distance (before the action has been taken)
-        :param reachedPickup: True if the robot reached his goal in this step
-        :param collision: True if the robot collided with a wall or another robot
-        :return: returns the result of the fitness function
+        collided with a wall or another robot. All parameters are arrays with one entry per robot.
+
+        :param robots: list of the robots that are rewarded
+        :param dist_new: np.array - the new distance (after the action has been taken)
+        :param dist_old: np.array - the old distance (before the action has been taken)
+        :param reachedPickup: np.array of bools - True if the robot reached his goal in this step
+        :param collision: np.array of bools - True if the robot collided with a wall or another robot
+        :param runOutOfTime: np.array of bools - True if the robot has run out of time
+        :param angularVelocity: np.array - angular velocity of the robot (per time step)
+        :return: tuple (np.array results of the fitness function, dict of np.arrays - reward for each component)
         """
 
-        living_factor = self.steps_left / self.steps
-        reward = {}
         r_arrival = 2500 # reward for reaching the goal
         r_collision = -2500 # Robot crashed with a wall or another robot
         r_runOutOfTime = -500 # Robot has run out of time
@@ -247,66 +235,56 @@ class Environment:
         w_p = 0.1
         a_p = 0.045 # weight for the angle, always positive
 
-        if reachedPickup:
-            reward['arrival'] = r_arrival
-        elif runOutOfTime:
-            reward['out_of_time'] = r_runOutOfTime
-        elif collision:
-            reward['collision'] = r_collision #* living_factor
-        else:
-            # Distance Reward
-            if dist_old > dist_new:
-                reward['dist'] = w_g * (dist_old - dist_new)
-            else:
-                reward['dist'] = w_gn * (dist_old - dist_new)
-
-            # Protect engine Reward
-            # currentLinVel = np.around(robot.state_raw[robot.time_steps - 1][4], decimals=5)
-            # lastLinVel = np.around(robot.state_raw[robot.time_steps - 2][4], decimals=5)
-            #
-            # currentAngVel = np.around(robot.state_raw[robot.time_steps - 1][5], decimals=5)
-            # lastAngVel = np.around(robot.state_raw[robot.time_steps - 2][5], decimals=5)
-
-            # if (np.abs(currentLinVel - lastLinVel) < 0.15) and (np.abs(currentAngVel - lastAngVel) < 0.30):
-            #     reward['motorReward'] = 0.1
-            # else:
-            #     reward['motorReward'] = -0.1
-            #
-            # # Agent stays in the same region for some time, indicating being stuck or driving in circles
-            # if is_staying_in_place(robot.last_positions):
-            #     reward['stucked'] = -10
-
-            # Stop Reward
-            # if abs(dist_old - dist_new) < 0.001:
-            #     reward['stop'] = r_stop
-
-            # Minimal distance to obstacle
-            # if np.min(robot.get_state_lidar()[0][0]) < 0.012:
-            #     reward['wall'] = w_w
-
-            # Directional reward (look at the angle between the robot and the goal)
-            # a1 = np.arctan2(robot.getGoalY() - robot.getPosY(), robot.getGoalX() - robot.getPosX())
-            # a2 = np.arctan2(robot.getDirectionY(), robot.getDirectionX())
-            # goalangle = np.abs(a1 - a2)
-            # if goalangle < np.pi/4:
-            #     alpha_norm = 1 - goalangle
-            #     reward['directional'] = a_p * alpha_norm
-
-            # Wiggle reward
-            # if currentAngVel > 0.7:
-            #     reward['wiggle'] = w_w * currentAngVel
-
-            # PUBG Reward (only gets rewarded if it gets closer to the goal than previously)
-            # if dist_new < robot.initialGoalDist:
-            #     reward['pubg'] = w_d * (robot.initialGoalDist - dist_new)
-            #     robot.initialGoalDist = dist_new
-
-        return reward
+        # Only one of arrival, running out of time and collision is rewarded (in this order)
+        arrival = reachedPickup
+        outOfTime = runOutOfTime & ~arrival
+        crashed = collision & ~(arrival | runOutOfTime)
+        moving = ~(arrival | runOutOfTime | collision)
+
+        reward = {'arrival': np.where(arrival, float(r_arrival), 0.0),
+                  'out_of_time': np.where(outOfTime, float(r_runOutOfTime), 0.0),
+                  'collision': np.where(crashed, float(r_collision), 0.0)}  #* living_factor
+
+        # Distance Reward
+        dist = np.where(dist_old > dist_new, w_g, w_gn) * (dist_old - dist_new)
+        reward['dist'] = np.where(moving, dist, 0.0)
+
+        # # Agent stays in the same region for some time, indicating being stuck or driving in circles
+        # if is_staying_in_place(robot.last_positions):
+        #     reward['stucked'] = -10
+
+        # Stop Reward
+        # if abs(dist_old - dist_new) < 0.001:
+        #     reward['stop'] = r_stop
+
+        # Minimal distance to obstacle
+        # if np.min(robot.get_state_lidar()[0][0]) < 0.012:
+        #     reward['wall'] = w_w
+
+        # Directional reward (look at the angle between the robot and the goal)
+        # a1 = np.arctan2(robot.getGoalY() - robot.getPosY(), robot.getGoalX() - robot.getPosX())
+        # a2 = np.arctan2(robot.getDirectionY(), robot.getDirectionX())
+        # goalangle = np.abs(a1 - a2)
+        # if goalangle < np.pi/4:
+        #     alpha_norm = 1 - goalangle
+        #     reward['directional'] = a_p * alpha_norm
+
+        # Wiggle reward
+        # if currentAngVel > 0.7:
+        #     reward['wiggle'] = w_w * currentAngVel
+
+        # PUBG Reward (only gets rewarded if it gets closer to the goal than previously)
+        # if dist_new < robot.initialGoalDist:
+        #     reward['pubg'] = w_d * (robot.initialGoalDist - dist_new)
+        #     robot.initialGoalDist = dist_new
+
+        return reward['arrival'] + reward['out_of_time'] + reward['collision'] + reward['dist'], reward
 
     def reset(self, level=None):
         """
         Resets the simulation after each epoch
         :param level: int - defines the reset level
+        :return: list of np.arrays - observations of all robots (see get_observations)
         """
         if level is None:
             level = self.level
@@ -317,8 +295,7 @@ class Environment:
         self.total_reward = 0.0
         self.done = False
 
-        states = [self.get_observation(i) for i in range(self.simulation.getCurrentNumberOfRobots())]
-        return states
+        return self.get_observations()
 
     def setUISaveListener(self, observer, checkpoint_folder, env_name):
         """
@@ -337,3 +314,27 @@ class Environment:
 
     def updateTrainingCounter(self, counter):
         self.simulation.updateTrainingCounter(counter)
+
+
+def perRobotReward(reward_func):
+    """
+    Adapts a reward function of a single robot to the reward arrays of the environment (see Environment.createReward)
+
+    :param reward_func: function (robot, dist_new, dist_old, reachedPickup, collision, runOutOfTime) - returns a dict
+        with the reward for each component of a single robot
+    :return: function - reward function of all robots, the components which are missing in the dict of a robot are 0
+    """
+    def rewards(robots, dist_new, dist_old, reachedPickup, collision, runOutOfTime, angularVelocity):
+        # the reward function gets python scalars
+        robotRewards = [reward_func(robot, *values) for robot, values in
+                        zip(robots, zip(dist_new.tolist(), dist_old.tolist(), reachedPickup.tolist(),
+                                        collision.tolist(), runOutOfTime.tolist()))]
+        components = {}
+        for i, robotReward in enumerate(robotRewards):
+            for key, value in robotReward.items():
+                if key not in components:
+                    components[key] = np.zeros(len(robots))
+                components[key][i] = value
+        return np.array([sum(robotReward.values()) for robotReward in robotRewards], dtype=float), components
+
+    return rewards
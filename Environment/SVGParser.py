@@ -1,19 +1,91 @@
 import copy
 
 import math
+import os
 import xml.etree.ElementTree as ET
 import random
+import numpy as np
 
 import Environment.Components.Border as Borders
 import Environment.Components.Station as Station
 import Environment.Components.Robot as Robot
-
-class SVGLevelParser:
-
-    def __init__(self, filename, args):
+from Environment.Components.Lidar import DistanceField
+
+# compiled levels of this process by level file, see compileLevel
+compiledLevels = {}
+
+# folder of the binary levels written by compileLevels.py
+COMPILED_FOLDER = os.path.join('svg', 'compiled')
+COMPILED_VERSION = 1
+# header of a binary level: version, arena width and height and the number of rows of the sections
+COMPILED_HEADER = ('version', 'width', 'height', 'lines', 'circles', 'starts', 'goals', 'candidates')
+# columns of the sections: walls (x1, y1, x2, y2, xn, yn), circles (x, y, r), starts (x, y), goals and candidates
+# (x, y, r)
+COMPILED_COLUMNS = (6, 3, 2, 3, 3)
+
+
+def compiledLevelPath(filename):
+    """
+    :param filename: string - name of the level file in svg/
+    :return: string - path of the binary level of the level file
+    """
+    return os.path.join(COMPILED_FOLDER, filename + '.npy')
+
+
+def compileLevel(filename):
+    """
+    Returns the compiled level of a level file. Every level file is loaded only once per process, the compiled level
+    is shared by all simulations of the process. If the level was compiled with compileLevels.py (and the svg has not
+    been changed since), the binary level is loaded instead of parsing the svg.
+
+    :param filename: string - name of the level file in svg/
+    :return: CompiledLevel
+    """
+    if filename not in compiledLevels:
+        path = compiledLevelPath(filename)
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(os.path.join('svg', filename)):
+            compiledLevels[filename] = CompiledLevel.load(path)
+        else:
+            compiledLevels[filename] = CompiledLevel.parse(filename)
+    return compiledLevels[filename]
+
+
+class CompiledLevel:
+    """
+    Parsed content of a level file: the walls and circular obstacles (which are static and can be shared), the size
+    of the arena and the starts and goals of the robots. Levels with orange circles define candidates which are
+    sampled as starts and goals with sample.
+    """
+
+    def __init__(self, arenaSize, lines, circles, robotsData, stationsData, startAndGoalCircles):
+        """
+        :param arenaSize: list [float, float] - width and height of the arena
+        :param lines: list of Borders.ColliderLines - walls of the level
+        :param circles: list of Borders.CircleWalls - circular obstacles of the level
+        :param robotsData: list of tuples (x, y) - starts defined by an ID
+        :param stationsData: list of tuples (x, y, radius) - goals defined by an ID
+        :param startAndGoalCircles: list of tuples (x, y, radius) - candidates for the starts and goals (orange circles)
+        """
+        self.arenaSize = arenaSize
+        self.lines = lines
+        self.circles = circles
+        self.robotsData = robotsData
+        self.stationsData = stationsData
+        self.startAndGoalCircles = startAndGoalCircles
+        # distance fields of the walls by cell size, see getDistanceField
+        self.distanceFields = {}
+
+    @classmethod
+    def parse(cls, filename):
+        """
+        Parses a level file with ElementTree
+
+        :param filename: string - name of the level file in svg/
+        :return: CompiledLevel
+        """
 
         file = 'svg/'+filename
-        self.stations, self.robots, self.lines, self.circles = [], [], [], []
+        walls, circleWalls = [], []
 
         dpiFactor = 1/28.35 #72 dotsPerInch converted  into DotsPerCentimeter
         #dpiFactor /= 10
@@ -30,8 +102,8 @@ class SVGLevelParser:
 
         tareq = 'tareq' in filename
 
-        self.arenaSize = svg.attrib['viewBox'].split(' ')[2:]
-        self.arenaSize = [float(self.arenaSize[0])*dpiFactor, float(self.arenaSize[1])*dpiFactor]
+        arenaSize = svg.attrib['viewBox'].split(' ')[2:]
+        arenaSize = [float(arenaSize[0])*dpiFactor, float(arenaSize[1])*dpiFactor]
 
 
         for rect in rects:
@@ -53,10 +125,10 @@ class SVGLevelParser:
                     transform = transform[0].split()
                     rectWall.rotate(float(transform[0]), float(transform[1]), float(transform[2]), float(transform[3]))
 
-                    self.lines += rectWall.getBorders()
+                    walls += rectWall.getBorders()
 
                 else:
-                    self.lines += Borders.SquareWall(x, y, width, height).getBorders()
+                    walls += Borders.SquareWall(x, y, width, height).getBorders()
 
         for polyline in polylines:
             attributes = polyline.attrib
@@ -77,7 +149,7 @@ class SVGLevelParser:
                     x2 = float(points[(i+1)][0]) * dpiFactor
                     y2 = float(points[(i+1)][1]) * dpiFactor
 
-                    self.lines += [Borders.ColliderLine(x1, y1, x2, y2)]
+                    walls += [Borders.ColliderLine(x1, y1, x2, y2)]
 
         for polygon in polygons:
             attributes = polygon.attrib
@@ -98,7 +170,7 @@ class SVGLevelParser:
                     x2 = float(points[(i-1) % pointsLen][0]) * dpiFactor
                     y2 = float(points[(i-1) % pointsLen][1]) * dpiFactor
 
-                    self.lines += [Borders.ColliderLine(x1, y1, x2, y2)]
+                    walls += [Borders.ColliderLine(x1, y1, x2, y2)]
         for path in paths:
 
             points = path.attrib['d']
@@ -120,7 +192,7 @@ class SVGLevelParser:
                 y2 = float(points[(i + 1)][1]) * dpiFactor + float(offset[1])
                 offset = [x2, y2]
 
-                self.lines += [Borders.ColliderLine(x1, y1, x2, y2)]
+                walls += [Borders.ColliderLine(x1, y1, x2, y2)]
 
         for line in lines:
             attributes = line.attrib
@@ -137,12 +209,12 @@ class SVGLevelParser:
                 y2 = float(line.attrib['y2']) * dpiFactor
 
                 if tareq:
-                    self.lines += [Borders.ColliderLine(x2, y2, x1, y1)]
+                    walls += [Borders.ColliderLine(x2, y2, x1, y1)]
                 else:
-                    self.lines += [Borders.ColliderLine(x1, y1, x2, y2)]
+                    walls += [Borders.ColliderLine(x1, y1, x2, y2)]
 
         stationsData = []
-        self.robotsData = []
+        robotsData = []
         startAndGoalCircles = [] # only used if circles are not defined as start and goal by an ID
 
         for circle in circles:
@@ -160,7 +232,7 @@ class SVGLevelParser:
                     id = circle.attrib['id']
 
                     if 'start' in id:
-                        self.robotsData += [(cx, cy)]
+                        robotsData += [(cx, cy)]
 
                     elif 'goal' in circle.attrib['id']:
                         stationsData += [(cx, cy, r)]
@@ -169,29 +241,131 @@ class SVGLevelParser:
                     if circle.attrib['stroke'] == 'orange':
                         startAndGoalCircles += [(cx, cy, r)]
                     else:
-                        self.circles += [Borders.CircleWall(cx, cy, r)]
+                        circleWalls += [Borders.CircleWall(cx, cy, r)]
                 else:
-                    self.circles += [Borders.CircleWall(cx, cy, r)]
+                    circleWalls += [Borders.CircleWall(cx, cy, r)]
+
+        return cls(arenaSize, walls, circleWalls, robotsData, stationsData, startAndGoalCircles)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a level written by save
+
+        :param path: string - path of the compiled level
+        :return: CompiledLevel
+        """
+        data = np.load(path)
+        header = data[:len(COMPILED_HEADER)]
+        if header[0] != COMPILED_VERSION:
+            raise ValueError("Compiled level {} has version {}, expected {}. Compile the levels again with "
+                             "compileLevels.py".format(path, int(header[0]), COMPILED_VERSION))
+        sizes = [int(size) for size in header[3:]]
+        sections = np.split(data[len(COMPILED_HEADER):],
+                            np.cumsum([size * columns for size, columns in zip(sizes, COMPILED_COLUMNS)])[:-1])
+        lines, circles, robots, stations, candidates = (section.reshape(-1, columns).tolist()
+                                                        for section, columns in zip(sections, COMPILED_COLUMNS))
+        return cls([float(header[1]), float(header[2])],
+                   [Borders.ColliderLine(x1, y1, x2, y2, xn, yn) for x1, y1, x2, y2, xn, yn in lines],
+                   [Borders.CircleWall(cx, cy, r) for cx, cy, r in circles],
+                   [tuple(robot) for robot in robots], [tuple(station) for station in stations],
+                   [tuple(candidate) for candidate in candidates])
+
+    def save(self, path):
+        """
+        Writes the level as one float64 array: a header (see COMPILED_HEADER) followed by the walls (start, end and
+        normal), the circular obstacles, the starts, the goals and the start and goal candidates
+
+        :param path: string - path of the compiled level (.npy)
+        """
+        lines = [line.getStart() + line.getEnd() + line.getN() for line in self.lines]
+        circles = [(circle.getPosX(), circle.getPosY(), circle.getRadius()) for circle in self.circles]
+        sections = [lines, circles, self.robotsData, self.stationsData, self.startAndGoalCircles]
+        header = [COMPILED_VERSION, self.arenaSize[0], self.arenaSize[1]] + [len(section) for section in sections]
+        data = [np.asarray(header, dtype=np.float64)]
+        data += [np.asarray(section, dtype=np.float64).reshape(-1, columns).ravel()
+                 for section, columns in zip(sections, COMPILED_COLUMNS)]
+        np.save(path, np.concatenate(data))
+
+    def sample(self):
+        """
+        Samples the starts and goals of 4 robots from the orange circles of the level (if there are any) in addition
+        to the starts and goals defined by an ID
+
+        :return: tuple (list, list) - start positions (x, y) and goals (x, y, radius) of the robots
+        """
+        robotsData = list(self.robotsData)
+        stationsData = list(self.stationsData)
+        startAndGoalCircles = list(self.startAndGoalCircles)
 
         #create goals and starts for 4 roboters by randomly sampling a position defined by the level svg file
         for i in range(4):
             if len(startAndGoalCircles) > 2:
                 startIndex = random.randint(0, len(startAndGoalCircles)-1)
                 startR = startAndGoalCircles.pop(startIndex)
-                self.robotsData += [(startR[0], startR[1])]
+                robotsData += [(startR[0], startR[1])]
 
                 goalIndex = random.randint(0, len(startAndGoalCircles)-1)
                 goal = startAndGoalCircles.pop(goalIndex)
                 stationsData += [goal]
+        return robotsData, stationsData
+
+    def getDistanceField(self, cellSize):
+        """
+        Returns the distance field of the walls and circular obstacles of the level. A field is only built once per
+        cell size and shared by all simulations of the process, like the level itself.
+
+        :param cellSize: float - distance between two nodes of the field in meters
+        :return: Lidar.DistanceField - None if the level has neither walls nor circular obstacles
+        """
+        if cellSize not in self.distanceFields:
+            field = None
+            if len(self.lines) + len(self.circles) > 0:
+                lines = np.array([line.getStart() + line.getEnd() for line in self.lines], dtype=float).reshape(-1, 4)
+                circles = np.array([(circle.getPosX(), circle.getPosY(), circle.getRadius()) for circle in self.circles],
+                                   dtype=float).reshape(-1, 3)
+                field = DistanceField(lines[:, :2].T, lines[:, 2:].T, circles[:, :2].T, circles[:, 2], cellSize)
+            self.distanceFields[cellSize] = field
+        return self.distanceFields[cellSize]
+
+    def getNumberOfRobots(self):
+        candidates = len(self.startAndGoalCircles)
+        sampled = 0
+        for i in range(4):
+            if candidates > 2:
+                candidates -= 2
+                sampled += 1
+        return len(self.robotsData) + sampled
 
-        for i, data in enumerate(stationsData):
-            self.stations += [Station.Station(data[0], data[1], data[2], i, args.scale_factor)]
 
-        self.stationsData = [stationsData[i][:-1] for i in range(0,len(stationsData))]
+class SVGLevelParser:
+    """
+    Creates the robots and stations of a level. The level file itself is parsed only once per process (see
+    compileLevel), so creating the parser again or sampling new starts and goals is cheap.
+    """
+
+    def __init__(self, filename, args):
+        self.level = compileLevel(filename)
+        self.lines, self.circles = self.level.lines, self.level.circles
+        self.arenaSize = self.level.arenaSize
+        self.stations, self.robots = [], []
+
+        self.sampleStartsAndGoals()
+
+        for i, data in enumerate(self.stationsData):
+            self.stations += [Station.Station(data[0], data[1], self.stationsRadii[i], i, args.scale_factor)]
 
         for i, data in enumerate(self.robotsData):
             self.robots += [Robot.Robot(i, (data[0], data[1]), 0, self.stations[i], args, self.lines, self.stations, self.circles)]
 
+    def sampleStartsAndGoals(self):
+        """
+        Samples new starts and goals of the robots from the start and goal candidates of the level
+        """
+        self.robotsData, stationsData = self.level.sample()
+        self.stationsData = [stationsData[i][:-1] for i in range(0,len(stationsData))]
+        self.stationsRadii = [stationsData[i][-1] for i in range(0,len(stationsData))]
+
     def getRobots(self):
         return self.robots
 
@@ -213,6 +387,9 @@ class SVGLevelParser:
     def getStatsPos(self):
         return self.stationsData
 
+    def getDistanceField(self, cellSize):
+        return self.level.getDistanceField(cellSize)
+
     def getArenaSize(self):
         return self.arenaSize
 
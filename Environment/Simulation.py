@@ -1,5 +1,6 @@
 import Environment.SVGParser as SVGParser
-import Visualization.EnvironmentWindow as SimulationWindow
+from Environment.Components.Lidar import SwarmCollisionRay, LevelGeometry
+from Environment.Components.SwarmState import SwarmState
 
 import math, random
 import numpy as np
@@ -31,18 +32,21 @@ class Simulation:
         self.steps = args.steps
         self.hasUI = app is not None
         self.episode = 0
+        self.swarmRayCol = SwarmCollisionRay(args)
 
         # Parameter width & length über args
 
         self.simulationWindow = None
+        self.observationBuffer = None
+        self.observationFirstRow = 0
+        # robots, stations and geometry of the levels loaded by this simulation, see loadLevel
+        self.loadedLevels = {}
         self.loadLevel(level)
 
         self.reset(level)
 
         if self.hasUI:
-            self.simulationWindow = SimulationWindow.SimulationWindow(app, self.robots, self.stations, args, self.walls,
-                                                                      self.circleWalls, self.arenaSize)
-            self.simulationWindow.show()
+            self.createWindow(app)
 
         self.simTime = 0  # s
         self.simTimestep = args.sim_time_step  # s
@@ -69,6 +73,7 @@ class Simulation:
         for i, r in enumerate(self.robots):
             # r.reset(self.stations, self.level[level][0][i], self.level[level][1][i]+(random.uniform(0, math.pi)*self.noiseStrength[level]), self.level[level][3])
             r.reset(self.stations, random_pos[i], self.level[1][i] + (random.uniform(0, math.pi)), self.level[3], goalStation=self.stations[i])
+        self.geometry.updateDynamicLines()
 
         #print("Resetting the simulation ", end='')
         for robot in self.robots:
@@ -124,58 +129,43 @@ class Simulation:
         updates the robots and checks the exit conditions of the current epoch
         :param robotsTarVels: List of tuples of target linear and angular velocity for each robot
         :param stepsLeft: steps left in current epoch
-        :return: list of tuples for each robot -
-            (Boolean collision with walls or other robots, Boolean reached PickUp, Boolean runOutOfTime)
+        :return: tuple of np.arrays (rows of the robots which were active in this step, and for each of them
+            Boolean collision with walls or other robots, Boolean reached PickUp, Boolean runOutOfTime)
         """
 
         # self.plotterWindow.plot(self.robot.getLinearVelocity(), self.simTime)
         # self.plotterWindow.plot(self.robot.getAngularVelocity(), self.simTime)
         self.simTime += self.simTimestep
         #time.sleep(self.simTimestep)
-        # schöner ??!
-        relativeIndices = []
-        missing = 0
-        for i, robot in enumerate(self.robots):
-            if robot.isActive():
-                relativeIndices.append(i - missing)
-            else:
-                missing += 1
-                relativeIndices.append(None)
-        ####
-
-        for i, robot in enumerate(self.robots):
-            if robot.isActive():
-                tarLinVel, tarAngVel = robotsTarVels[relativeIndices[i]]
-                self.robots[i].update(self.simTimestep, tarLinVel, tarAngVel)
-
-        for i, robot in enumerate(self.robots):
-            # watch this ?!
-            if robot.isActive():
-                robot.lidarReading(self.robots, stepsLeft, self.steps)
-
-        robotsTerminations = []
-        for robot in self.robots:
-            if robot.isActive():
-                collision = False
-                reachedPickUp = False
-                runOutOfTime = False
 
-                if stepsLeft <= 0:
-                    runOutOfTime = True
-
-                if (np.min(robot.collisionDistances) <= robot.radius + 0.0):
-                    collision = True
-
-                if robot.collideWithTargetStationCircular():
-                    reachedPickUp = True
-
-                if collision or reachedPickUp or runOutOfTime:
-                    robot.deactivate()
-
-                robotsTerminations.append((collision, reachedPickUp, runOutOfTime))
-
-            else:
-                robotsTerminations.append((None, None, None))
+        # the target velocities are given for the active robots (in their order), all of them are moved at once
+        rows = np.array([i for i, robot in enumerate(self.robots) if robot.isActive()], dtype=int)
+        if len(rows) > 0:
+            targetVelocities = np.asarray(robotsTarVels, dtype=float).reshape(-1, 2)[:len(rows)]
+            velocities = self.swarm.computeNextVelocities(targetVelocities, rows)
+            for k, i in enumerate(rows):
+                robot = self.robots[i]
+                if robot.manuell:
+                    velocities[k] = (robot.linTast, robot.angTast)
+                else:
+                    robot.netOutput = tuple(robotsTarVels[k])
+            deltaPositions, deltaDirections = self.swarm.move(self.simTimestep, velocities, rows)
+            for k, i in enumerate(rows):
+                self.robots[i].moved(deltaPositions[k], deltaDirections[k])
+        self.geometry.updateDynamicLines()
+
+        # the laser scans of all active robots are casted at once
+        activeRobots = [self.robots[i] for i in rows]
+        distances, lidarHits, collisionDistances, collisionDistancesRobots, nearestCollisions = \
+            self.swarmRayCol.scan(activeRobots, self.robots, self.geometry, self.stations)
+        for i, robot in enumerate(activeRobots):
+            robot.lidarReading(self.robots, stepsLeft, self.steps,
+                               (distances[i], lidarHits[i], collisionDistances[i], collisionDistancesRobots[i]))
+
+        # the exit conditions of all active robots are checked at once
+        collision, reachedPickUp, runOutOfTime = self.swarm.terminations(rows, nearestCollisions, stepsLeft)
+        for i in rows[collision | reachedPickUp | runOutOfTime]:
+            self.robots[i].deactivate()
 
         if self.hasUI:
             if self.simulationWindow != None:
@@ -185,15 +175,24 @@ class Simulation:
                 self.simulationWindow.updateTrafficLights(proximity)
                 self.simulationWindow.paintUpdates()
                 self.simulationWindow.updateInfotext(self.steps - stepsLeft, self.episode)
-        return robotsTerminations
+        return rows, collision, reachedPickUp, runOutOfTime
 
     def showWindow(self, app):
         if not self.hasUI:
-            self.simulationWindow = SimulationWindow.SimulationWindow(app, self.robots, self.stations, self.args,
-                                                                      self.walls, self.circleWalls, self.arenaSize)
-            self.simulationWindow.show()
+            self.createWindow(app)
             self.hasUI = True
 
+    def createWindow(self, app):
+        """
+        Creates and shows the simulation window. The visualization (and PyQt5) is only imported here, so a simulation
+        without window runs on machines without PyQt5 or X server
+        :param app: PyQt5.QtWidgets.QApplication
+        """
+        import Visualization.EnvironmentWindow as SimulationWindow
+        self.simulationWindow = SimulationWindow.SimulationWindow(app, self.robots, self.stations, self.args,
+                                                                  self.walls, self.circleWalls, self.arenaSize)
+        self.simulationWindow.show()
+
     def closeWindow(self):
         if self.hasUI:
             self.simulationWindow.close()
@@ -204,22 +203,60 @@ class Simulation:
         return len(self.robots)
 
     def loadLevel(self, levelID):
+        """
+        Loads a level. The robots, stations and the geometry of a level are only created the first time the level is
+        loaded and are reused afterwards (the robots are reset at the beginning of every episode anyway), only the
+        starts and goals are sampled again. The level file itself is parsed once per process (SVGParser.compileLevel).
+        :param levelID: int - index of the level in the level files
+        """
         # print("LevelID: ", levelID)
         # print("Loading ", self.levelFiles[levelID])
-        selectedLevel = SVGParser.SVGLevelParser(self.levelFiles[levelID], self.args)
-        self.robots = selectedLevel.getRobots()
-        if self.args.manually:
-            self.robots = self.robots[0]
+        if levelID in self.loadedLevels:
+            selectedLevel, self.robots, self.geometry, self.swarm = self.loadedLevels[levelID]
+            selectedLevel.sampleStartsAndGoals()
+        else:
+            selectedLevel = SVGParser.SVGLevelParser(self.levelFiles[levelID], self.args)
+            self.robots = selectedLevel.getRobots()
+            if self.args.manually:
+                self.robots = self.robots[0]
+            # the walls are compiled once per level, only the pie slices of the robots are updated every step
+            distanceField = None
+            if self.args.distance_field_cell_size > 0:
+                distanceField = selectedLevel.getDistanceField(self.args.distance_field_cell_size)
+            self.geometry = LevelGeometry(selectedLevel.getWalls(), selectedLevel.getCircleWalls(), self.robots,
+                                          self.args.lidar_grid_cell_size, distanceField)
+            for robot in self.robots:
+                robot.geometry = self.geometry
+            # poses and velocities of all robots of the level, they are moved at once
+            self.swarm = SwarmState(self.robots)
+            self.loadedLevels[levelID] = (selectedLevel, self.robots, self.geometry, self.swarm)
 
         self.stations = selectedLevel.getStations()
         self.walls = selectedLevel.getWalls()
         self.circleWalls = selectedLevel.getCircleWalls()
+        self.assignObservationRows()
         self.level = (
         selectedLevel.getRobsPos(), selectedLevel.getRobsOrient(), selectedLevel.getStatsPos(), self.walls,
         self.circleWalls)
         self.levelID = levelID
         self.arenaSize = selectedLevel.getArenaSize()
 
+    def setObservationBuffer(self, observationBuffer, firstRow):
+        """
+        Lets the robots write their observations directly into a shared block of memory
+
+        :param observationBuffer: VectorEnvironment.SharedObservations
+        :param firstRow: int - row of the first robot of this simulation in the block
+        """
+        self.observationBuffer = observationBuffer
+        self.observationFirstRow = firstRow
+        self.assignObservationRows()
+
+    def assignObservationRows(self):
+        for i, robot in enumerate(self.robots):
+            robot.observationBuffer = self.observationBuffer
+            robot.observationRow = self.observationFirstRow + i
+
     def getLevelName(self):
         levelNameSVG = self.levelFiles[self.levelID]
         levelName = levelNameSVG.split('.', 1)[0]
@@ -0,0 +1,244 @@
+from Environment.Environment import Environment
+import Environment.SVGParser as SVGParser
+from utils import observedRays
+
+import copy
+import random
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class SharedObservations:
+    """
+    Observations and actions of the robots of all environments in one block of shared memory. The robots write their
+    frames directly into their row (see Robot.lidarReading), so the states never have to be pickled to be sent
+    between the worker processes and the main process.
+    The observations have the same layout as the ones created by Environment.get_observations
+    (newest frame first), so the learner can use them as tensors without copying (torch.from_numpy).
+    """
+
+    def __init__(self, rows, timeframes, numberOfRays, name=None):
+        """
+        :param rows: int - number of robots of all environments (maximal number of robots per environment for each
+            environment)
+        :param timeframes: int - the amount of frames saved as a history by the robots
+        :param numberOfRays: int - number of laser values of an observation (see utils.observedRays)
+        :param name: string - name of an existing block to attach to. If None a new block is created
+        """
+        self.shapes = [(rows, timeframes, numberOfRays), (rows, timeframes, 2), (rows, timeframes, 1),
+                       (rows, timeframes, 2)]
+        actionShape = (rows, 2)
+        sizes = [int(np.prod(shape)) * np.dtype(np.float32).itemsize for shape in self.shapes]
+        size = sum(sizes) + int(np.prod(actionShape)) * np.dtype(np.float64).itemsize
+
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+
+        self.observations = []
+        offset = 0
+        for shape, nbytes in zip(self.shapes, sizes):
+            self.observations.append(np.ndarray(shape, dtype=np.float32, buffer=self.memory.buf, offset=offset))
+            offset += nbytes
+        self.actions = np.ndarray(actionShape, dtype=np.float64, buffer=self.memory.buf, offset=offset)
+
+    def pushFrame(self, row, frame):
+        """
+        Adds a frame to the observations of a robot. The older frames are moved back by one, the oldest is dropped.
+
+        :param row: int - row of the robot
+        :param frame: list - [laser, orientation, distance, velocity, timestep] as created by Robot.lidarReading
+        """
+        for observation, value in zip(self.observations, frame):
+            observation[row, 1:] = observation[row, :-1]
+            observation[row, 0] = value
+
+    def read(self, rows):
+        """
+        :param rows: np.array - rows of the robots to read
+        :return: list of np.arrays [laser, orientation, distance, velocity] of the robots. If the rows are a
+            contiguous range the arrays are views of the shared memory, otherwise copies
+        """
+        if len(rows) > 0 and rows[-1] - rows[0] == len(rows) - 1:
+            return [observation[rows[0]:rows[-1] + 1] for observation in self.observations]
+        return [observation[rows] for observation in self.observations]
+
+    def close(self):
+        self.observations, self.actions = None, None
+        self.memory.close()
+
+
+def worker(pipe, args, timeframes, level, levelStep, memoryName, rows, firstRow, reward_func, swarm_reward_func):
+    """
+    Runs an environment in a worker process. Actions and observations are exchanged through the shared memory,
+    only the commands, rewards and terminations are sent through the pipe.
+
+    :param pipe: multiprocessing.connection.Connection - connection to the VectorEnvironment
+    :param level: int - first level of this environment
+    :param levelStep: int - number of levels the environment advances after each episode
+    :param memoryName: string - name of the shared memory block
+    :param rows: int - number of rows of the shared memory block
+    :param firstRow: int - row of the first robot of this environment
+    """
+    # forked workers would otherwise share the random state of the main process
+    random.seed()
+    np.random.seed()
+
+    buffers = SharedObservations(rows, timeframes, observedRays(args), memoryName)
+    env = Environment(None, args, timeframes, level, reward_func=reward_func, swarm_reward_func=swarm_reward_func)
+    env.simulation.setObservationBuffer(buffers, firstRow)
+    numberOfLevels = len(args.level_files)
+    numberOfRobots = 0
+    try:
+        while True:
+            command, data = pipe.recv()
+            if command == 'reset':
+                if data is not None:
+                    level = data
+                env.reset(level)
+                numberOfRobots = env.getNumberOfRobots()
+                pipe.send(numberOfRobots)
+            elif command == 'step':
+                actions = buffers.actions[firstRow:firstRow + numberOfRobots].copy()
+                _, rewards, dones, reachedPickups = env.step(actions)
+                rewardComponents = env.rewardComponents
+                episodeDone = env.is_done()
+                if episodeDone:
+                    # the next episode is started right away, so the main process never has to wait for a reset
+                    level = (level + levelStep) % numberOfLevels
+                    env.reset(level)
+                numberOfRobots = env.getNumberOfRobots()
+                pipe.send((numberOfRobots, rewards, rewardComponents, dones, reachedPickups, episodeDone))
+            elif command == 'close':
+                break
+    finally:
+        env.simulation.setObservationBuffer(None, 0)
+        buffers.close()
+        pipe.close()
+
+
+class VectorEnvironment:
+    """
+    Runs several environments in worker processes and steps them together. Every environment starts on a different
+    level of the level files, finished environments are reset to their next level by the workers themselves.
+    Observations are returned stacked over the robots of all environments (in the order of the environments).
+    """
+
+    def __init__(self, args, timeframes, numberOfEnvironments, reward_func=None, swarm_reward_func=None):
+        """
+        :param args: args defined in main
+        :param timeframes: int -
+            the amount of frames saved as a history by the robots to train the neural net
+        :param numberOfEnvironments: int - number of environments (and worker processes)
+        :param reward_func: reward function of a single robot (see Environment.Environment)
+        :param swarm_reward_func: reward function of all robots at once (see Environment.Environment)
+        """
+        # the workers don't show a visualization
+        args = copy.copy(args)
+        args.visualization = 'none'
+        self.args = args
+        self.levelFiles = args.level_files
+        self.numberOfEnvironments = numberOfEnvironments
+        self.maxRobots = max(SVGParser.compileLevel(levelFile).getNumberOfRobots() for levelFile in self.levelFiles)
+        if args.distance_field_cell_size > 0:
+            # built before the workers are started, so forked workers share the distance fields
+            for levelFile in self.levelFiles:
+                SVGParser.compileLevel(levelFile).getDistanceField(args.distance_field_cell_size)
+
+        self.buffers = SharedObservations(numberOfEnvironments * self.maxRobots, timeframes, observedRays(args))
+        self.pipes, self.processes = [], []
+        for i in range(numberOfEnvironments):
+            pipe, workerPipe = mp.Pipe()
+            process = mp.Process(target=worker, daemon=True,
+                                 args=(workerPipe, args, timeframes, i % len(self.levelFiles), numberOfEnvironments,
+                                       self.buffers.name, numberOfEnvironments * self.maxRobots, i * self.maxRobots,
+                                       reward_func, swarm_reward_func))
+            process.start()
+            workerPipe.close()
+            self.pipes.append(pipe)
+            self.processes.append(process)
+
+        self.robotCounts = [0] * numberOfEnvironments
+        self.rewardComponents = {}
+        self.closed = False
+
+    def reset(self, levels=None):
+        """
+        Resets all environments
+
+        :param levels: list of ints - level of each environment. If None every environment resets its current level
+        :return: list of np.arrays [laser, orientation, distance, velocity] - stacked observations of all robots
+            (see getObservations)
+        """
+        for i, pipe in enumerate(self.pipes):
+            pipe.send(('reset', None if levels is None else levels[i]))
+        self.robotCounts = [pipe.recv() for pipe in self.pipes]
+        return self.getObservations()
+
+    def step(self, actions):
+        """
+        Executes a step in all environments
+
+        :param actions: np.array (robots x 2) - actions of the robots of all environments
+        :return: tuple (list of np.arrays stacked observations, np.array rewards, np.array dones,
+            np.array reached pickups, np.array of Booleans whether the episode of each environment is done).
+            Rewards, dones and reached pickups belong to the robots which executed the actions, the observations
+            of environments which are done are the first observations of their next episode. The named components
+            of the rewards are stored in rewardComponents
+        """
+        self.buffers.actions[self.getRows()] = actions
+        for pipe in self.pipes:
+            pipe.send(('step', None))
+
+        rewards, rewardComponents, dones, reachedPickups, episodeDones = [], [], [], [], []
+        for i, pipe in enumerate(self.pipes):
+            self.robotCounts[i], rewardsEnv, componentsEnv, donesEnv, reachedPickupsEnv, episodeDone = pipe.recv()
+            rewards.append(rewardsEnv)
+            rewardComponents.append(componentsEnv)
+            dones.append(donesEnv)
+            reachedPickups.append(reachedPickupsEnv)
+            episodeDones.append(episodeDone)
+
+        # components which are missing in an environment are 0 for its robots
+        self.rewardComponents = {}
+        for key in {key: None for components in rewardComponents for key in components}:
+            self.rewardComponents[key] = np.concatenate([components.get(key, np.zeros(len(rewardsEnv)))
+                                                         for components, rewardsEnv in zip(rewardComponents, rewards)])
+
+        return self.getObservations(), np.concatenate(rewards), np.concatenate(dones), \
+            np.concatenate(reachedPickups), np.array(episodeDones)
+
+    def getRows(self):
+        """
+        :return: np.array - rows of the robots of all environments in the shared memory block
+        """
+        return np.concatenate([np.arange(i * self.maxRobots, i * self.maxRobots + count)
+                               for i, count in enumerate(self.robotCounts)])
+
+    def getObservations(self):
+        """
+        :return: list of np.arrays [laser, orientation, distance, velocity] - observations of all robots. If all
+            environments (except the last) have the maximal number of robots, these are views of the shared memory
+            which are overwritten by the next step.
+        """
+        return self.buffers.read(self.getRows())
+
+    def close(self):
+        if self.closed:
+            return
+        for pipe in self.pipes:
+            pipe.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.buffers.close()
+        self.buffers.memory.unlink()
+        self.closed = True
+
+    def getNumberOfRobots(self):
+        return sum(self.robotCounts)
+
+    def getLevelFiles(self):
+        return self.levelFiles
@@ -8,11 +8,26 @@ from utils import initialize_output_weights, RunningMeanStd
 from torch.utils.data.sampler import BatchSampler, SubsetRandomSampler
 from PPO.BigInput import BigInput
 from PPO.SmallInput import SmallInput
+from PPO.RolloutPolicy import RolloutPolicy
 
 from utils import statesToObservationsTensor, normalize
 
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
+def create_inputspace(scan_size, inputspace):
+    """
+    Creates the network which encodes the observations (lidar scan, orientation to goal, distance to goal and
+    velocity) into a feature vector of 128 features.
+
+    :param scan_size: The number of lidar scans in the input lidar scan.
+    :param inputspace: 'big' or 'small'
+    """
+    if inputspace == 'big':
+        return BigInput(scan_size)
+    elif inputspace == 'small':
+        return SmallInput(scan_size)
+
+
 class Actor(nn.Module):
     """
     A PyTorch Module that represents the actor network of a PPO agent.
@@ -22,13 +37,13 @@ class Actor(nn.Module):
     to produce a flattened feature vector that can be fed into a downstream neural network.
 
     :param scan_size: The number of lidar scans in the input lidar scan.
+    :param has_inputspace: Whether the actor has its own input network. If False only the head is created and the
+        features have to be passed to head (shared trunk of the ActorCritic).
     """
-    def __init__(self, scan_size, inputspace):
+    def __init__(self, scan_size, inputspace, has_inputspace=True):
         super(Actor, self).__init__()
-        if inputspace == 'big':
-            self.Inputspace = BigInput(scan_size)
-        elif inputspace == 'small':
-            self.Inputspace = SmallInput(scan_size)
+        if has_inputspace:
+            self.Inputspace = create_inputspace(scan_size, inputspace)
 
         # Mu
         self.mu = nn.Linear(in_features=128, out_features=2)
@@ -38,6 +53,9 @@ class Actor(nn.Module):
 
     def forward(self, laser, orientation_to_goal, distance_to_goal, velocity):
         x = self.Inputspace(laser.to(device), orientation_to_goal.to(device), distance_to_goal.to(device), velocity.to(device))
+        return self.head(x)
+
+    def head(self, x):
         mu = torch.tanh(self.mu(x))
         std = torch.exp(self.log_std)
         var = torch.pow(std, 2)
@@ -54,13 +72,13 @@ class Critic(nn.Module):
     to produce a flattened feature vector that can be fed into a downstream neural network.
 
     :param scan_size: The number of lidar scans in the input lidar scan.
+    :param has_inputspace: Whether the critic has its own input network. If False only the head is created and the
+        features have to be passed to head (shared trunk of the ActorCritic).
     """
-    def __init__(self, scan_size, inputspace):
+    def __init__(self, scan_size, inputspace, has_inputspace=True):
         super(Critic, self).__init__()
-        if inputspace == 'big':
-            self.Inputspace = BigInput(scan_size)
-        elif inputspace == 'small':
-            self.Inputspace = SmallInput(scan_size)
+        if has_inputspace:
+            self.Inputspace = create_inputspace(scan_size, inputspace)
 
         # Value
         self.value = nn.Linear(in_features=128, out_features=1)
@@ -68,6 +86,9 @@ class Critic(nn.Module):
 
     def forward(self, laser, orientation_to_goal, distance_to_goal, velocity):
         x = self.Inputspace(laser, orientation_to_goal, distance_to_goal, velocity)
+        return self.head(x)
+
+    def head(self, x):
         value = self.value(x)
         return value
 
@@ -79,21 +100,76 @@ class ActorCritic(nn.Module):
     This module takes in four inputs: a lidar scan, orientation to goal, distance to goal, and velocity.
     It then applies convolutional and dense layers to each input separately and concatenates the outputs
     to produce a flattened feature vector that can be fed into a downstream neural network.
+
+    :param shared_trunk: If True actor and critic share one input network (trunk) and only have separate heads, so
+        the observations are only encoded once per evaluation. Otherwise actor and critic have their own input network.
     """
-    def __init__(self, scan_size, inputspace, logger):
+    def __init__(self, scan_size, inputspace, logger, shared_trunk=False):
         super(ActorCritic, self).__init__()
         action_dim = 2
         self.actor_cnt = 0
         self.critic_cnt = 0
         self.logger = logger
+        self.shared_trunk = shared_trunk
         self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-        self.actor = Actor(scan_size, inputspace)
-        self.critic = Critic(scan_size, inputspace)
+        if shared_trunk:
+            self.trunk = create_inputspace(scan_size, inputspace)
+        self.actor = Actor(scan_size, inputspace, has_inputspace=not shared_trunk)
+        self.critic = Critic(scan_size, inputspace, has_inputspace=not shared_trunk)
 
         # TODO statische var testen
         #self.logstds_param = nn.Parameter(torch.full((n_actions,), 0.1))
         #self.action_var = torch.full((action_dim, ), action_std * action_std).to(device)
 
+    def features(self, laser, orientation, distance, velocity):
+        """
+        Encodes the observations with the shared trunk.
+
+        :return: The feature vectors of the observations.
+        """
+        return self.trunk(laser.to(device), orientation.to(device), distance.to(device), velocity.to(device))
+
+    def actor_output(self, laser, orientation, distance, velocity):
+        """
+        :return: A tuple of the mean and the variance of the action distribution.
+        """
+        if self.shared_trunk:
+            return self.actor.head(self.features(laser, orientation, distance, velocity))
+        return self.actor(laser, orientation, distance, velocity)
+
+    def value(self, laser, orientation, distance, velocity):
+        """
+        :return: The values of the states.
+        """
+        if self.shared_trunk:
+            return self.critic.head(self.features(laser, orientation, distance, velocity))
+        return self.critic(laser, orientation, distance, velocity)
+
+    def convert_state_dict(self, state_dict):
+        """
+        Converts a state dict saved with the other layout (split or shared trunk) to the layout of this network.
+        A split checkpoint loaded into a shared trunk uses the input network of the actor as trunk, a shared
+        checkpoint loaded into a split network uses the trunk for the actor and the critic.
+
+        :param state_dict: The state dict of a checkpoint.
+        :return: The state dict in the layout of this network.
+        """
+        is_shared = any(key.startswith('trunk.') for key in state_dict)
+        if is_shared == self.shared_trunk:
+            return state_dict
+        converted = {}
+        for key, value in state_dict.items():
+            if self.shared_trunk and key.startswith('actor.Inputspace.'):
+                converted['trunk.' + key[len('actor.Inputspace.'):]] = value
+            elif self.shared_trunk and key.startswith('critic.Inputspace.'):
+                continue
+            elif not self.shared_trunk and key.startswith('trunk.'):
+                converted['actor.Inputspace.' + key[len('trunk.'):]] = value
+                converted['critic.Inputspace.' + key[len('trunk.'):]] = value.clone()
+            else:
+                converted[key] = value
+        return converted
+
     def act(self, states):
         """
         Returns an action sampled from the actor's distribution and the log probability of that action.
@@ -105,7 +181,7 @@ class ActorCritic(nn.Module):
             laser, orientation, distance, velocity = states
             # TODO: check if normalization of states is necessary
             # was suggested in: Implementation_Matters in Deep RL: A Case Study on PPO and TRPO
-            action_mean, action_var = self.actor(laser, orientation, distance, velocity)
+            action_mean, action_var = self.actor_output(laser, orientation, distance, velocity)
 
             cov_mat = torch.diag(action_var)
             dist = MultivariateNormal(action_mean, cov_mat)
@@ -127,7 +203,7 @@ class ActorCritic(nn.Module):
         """
         with torch.no_grad():
             laser, orientation, distance, velocity = states
-            action, _ = self.actor(laser, orientation, distance, velocity)
+            action, _ = self.actor_output(laser, orientation, distance, velocity)
 
         return action
 
@@ -142,9 +218,14 @@ class ActorCritic(nn.Module):
         actor's distribution.
         """
         laser, orientation, distance, velocity = state
-        state_value = self.critic(laser, orientation, distance, velocity)
-
-        action_mean, action_var = self.actor(laser, orientation, distance, velocity)
+        if self.shared_trunk:
+            # the observations are only encoded once for both heads
+            x = self.features(laser, orientation, distance, velocity)
+            state_value = self.critic.head(x)
+            action_mean, action_var = self.actor.head(x)
+        else:
+            state_value = self.critic(laser, orientation, distance, velocity)
+            action_mean, action_var = self.actor(laser, orientation, distance, velocity)
 
         cov_mat = torch.diag(action_var.to(device))
         dist = MultivariateNormal(action_mean.to(device), cov_mat)
@@ -169,9 +250,14 @@ class PPO:
     :param logger: The logger to log data to.
     :param restore: Whether to restore the network from a checkpoint.
     :param ckpt: The checkpoint to restore from.
+    :param shared_trunk: Whether actor and critic share their input network. The networks are then trained with one
+        optimizer on the sum of the actor and the critic loss.
+    :param rollout_threads: Number of CPU threads used to select the actions (0 keeps the number of threads of torch).
+    :param trace_rollout: Whether the actor used to select the actions is traced with TorchScript.
     """
 
-    def __init__(self, scan_size, inputspace, lr, betas, gamma, _lambda, K_epochs, eps_clip, logger, restore=False, ckpt=None, advantages_func=None):
+    def __init__(self, scan_size, inputspace, lr, betas, gamma, _lambda, K_epochs, eps_clip, logger, restore=False, ckpt=None, advantages_func=None, shared_trunk=False,
+                 rollout_threads=0, trace_rollout=True):
         # Algorithm parameters
         self.lr = lr
         self.betas = betas
@@ -191,37 +277,45 @@ class PPO:
         self.model_path = Path(ckpt)
 
         # Current Policy
-        self.policy = ActorCritic(scan_size, inputspace, logger).to(device)
+        self.policy = ActorCritic(scan_size, inputspace, logger, shared_trunk=shared_trunk).to(device)
         if restore:
             self.load_model(Path(ckpt))
+        # Policy used to select the actions, synced with the current policy after every update
+        self.rollout_policy = RolloutPolicy(self.policy, logger, num_threads=rollout_threads, trace=trace_rollout)
 
-        self.optimizer_a = torch.optim.Adam(self.policy.actor.parameters(), lr=lr, betas=betas, eps=1e-5)
-        self.optimizer_c = torch.optim.Adam(self.policy.critic.parameters(), lr=lr, betas=betas, eps=1e-5)
+        if shared_trunk:
+            self.optimizer = torch.optim.Adam(self.policy.parameters(), lr=lr, betas=betas, eps=1e-5)
+        else:
+            self.optimizer_a = torch.optim.Adam(self.policy.actor.parameters(), lr=lr, betas=betas, eps=1e-5)
+            self.optimizer_c = torch.optim.Adam(self.policy.critic.parameters(), lr=lr, betas=betas, eps=1e-5)
 
         self.MSE_loss = nn.MSELoss()
         self.running_reward_std = RunningMeanStd()
-        if advantages_func is not None:
-            self.advantage_func = advantages_func
-        else:
-            self.advantage_func = self.get_advantages
+        # optional function (gamma, _lambda, values, masks, rewards) computing the advantages of one episode segment,
+        # if None the advantages of all segments are computed at once by get_advantages_batched
+        self.advantage_func = advantages_func
 
 
     def set_eval(self):
         self.policy.eval()
+        self.rollout_policy.sync(self.policy)
 
     def load_model(self, path):
         try:
-            self.policy.load_state_dict(torch.load(path, map_location=lambda storage, loc: storage))
+            state_dict = torch.load(path, map_location=lambda storage, loc: storage)
+            self.policy.load_state_dict(self.policy.convert_state_dict(state_dict))
+            if hasattr(self, 'rollout_policy'):
+                self.rollout_policy.sync(self.policy)
             return True
         except FileNotFoundError:
             warnings.warn(f"Could not restore model from {path}. Falling back to train mode.")
             return False
 
     def select_action(self, observations):
-        return self.policy.act(observations)
+        return self.rollout_policy.act(observations)
 
     def select_action_certain(self, observations):
-        return self.policy.act_certain(observations)
+        return self.rollout_policy.act_certain(observations)
 
     def saveCurrentWeights(self, name):
         print('Saving current weights to ' + str(self.model_path.parent) + '/PPO_continuous_{}.pth'.format(name))
@@ -229,12 +323,13 @@ class PPO:
 
     def calculate_returns(self, rewards, normalize=False):
 
-        returns = []
+        rewards = np.asarray(rewards, dtype=np.float64)
+        returns = np.empty_like(rewards)
         return_ = 0
 
-        for r in reversed(rewards):
-            return_ = r + return_ * self.gamma
-            returns.insert(0, return_)
+        for i in reversed(range(len(rewards))):
+            return_ = rewards[i] + return_ * self.gamma
+            returns[i] = return_
 
         returns = torch.tensor(returns, dtype=torch.float32)
 
@@ -252,24 +347,49 @@ class PPO:
         :param rewards: The rewards of the states.
         :return: The advantages of the states.
         """
-        advantages = []
-        returns = []
-        gae = 0
+        return self.get_advantages_batched([values], [masks], [rewards])
 
-        for i in reversed(range(len(rewards))):
-            delta = rewards[i] - values[i]
-            if masks[i] == 1:
-                delta = delta + self.gamma * values[i + 1]
-            gae = delta + self.gamma * self._lambda * masks[i] * gae
-            advantages.insert(0, gae)
-            returns.insert(0, gae + values[i])
-
-        advantages = torch.FloatTensor(advantages).to(device)
-        norm_adv = (advantages - advantages.mean()) / (advantages.std() + 1e-10)
-
-        returns = torch.FloatTensor(returns).to(device)
-
-        return norm_adv, returns
+    def get_advantages_batched(self, values, masks, rewards):
+        """
+        Computes the advantages and returns of several episode segments at once. The segments are padded to the
+        length of the longest one, so the generalized advantage estimation is a single reverse scan over the time
+        steps of all segments. The advantages are normalized per segment like in get_advantages.
+
+        :param values: list of the values of the states of every segment, with the bootstrapped value of the next
+            state appended if the last mask of the segment is 1.
+        :param masks: list of the masks of the states of every segment.
+        :param rewards: list of the rewards of the states of every segment.
+        :return: tuple (advantages, returns) - the advantages and returns of all segments concatenated.
+        """
+        lengths = torch.tensor([len(reward) for reward in rewards], device=device)
+        steps = int(lengths.max())
+        valid = torch.arange(steps, device=device) < lengths.unsqueeze(1)
+
+        # padded steps have a mask and a delta of 0, so the scan of every segment starts with gae = 0 at its last step
+        rewards_ = torch.zeros((len(rewards), steps), device=device)
+        masks_ = torch.zeros((len(rewards), steps), device=device)
+        values_ = torch.zeros((len(rewards), steps + 1), device=device)
+        for i in range(len(rewards)):
+            rewards_[i, :len(rewards[i])] = rewards[i]
+            masks_[i, :len(masks[i])] = masks[i]
+            values_[i, :len(values[i])] = values[i]
+
+        deltas = rewards_ - values_[:, :-1] + self.gamma * (masks_ * values_[:, 1:])
+        deltas = torch.where(valid, deltas, torch.zeros_like(deltas))
+        advantages = torch.zeros_like(rewards_)
+        gae = torch.zeros(len(rewards), device=device)
+        for i in reversed(range(steps)):
+            gae = deltas[:, i] + self.gamma * self._lambda * masks_[:, i] * gae
+            advantages[:, i] = gae
+        returns = advantages + values_[:, :-1]
+
+        # normalization per segment (std with Bessel's correction like torch.std)
+        lengths = lengths.unsqueeze(1).float()
+        mean = (advantages * valid).sum(dim=1, keepdim=True) / lengths
+        std = torch.sqrt((((advantages - mean) * valid) ** 2).sum(dim=1, keepdim=True) / (lengths - 1))
+        norm_adv = (advantages - mean) / (std + 1e-10)
+
+        return norm_adv[valid], returns[valid]
 
     # def get_advantages_returns(self, states, actions, masks, rewards):
     #     # Advantages
@@ -288,6 +408,21 @@ class PPO:
     #
     #     return advantages, returns
 
+    def get_values(self, states, batch_size):
+        """
+        Computes the values of the given states with the critic.
+
+        :param states: A tuple of the lidar scans, orientations to goal, distances to goal, and velocities.
+        :param batch_size: The number of states passed through the critic at once.
+        :return: The values of the states.
+        """
+        batch_size = max(batch_size, 1)
+        values = []
+        for start in range(0, len(states[0]), batch_size):
+            laser, orientation, distance, velocity = (state[start:start + batch_size].to(self.device) for state in states)
+            values.append(self.policy.value(laser, orientation, distance, velocity).detach())
+        return torch.cat(values).view(-1)
+
     def update(self, memory, batches, next_obs):
         """
         This function implements the update step of the Proximal Policy Optimization (PPO) algorithm for a swarm of
@@ -317,24 +452,8 @@ class PPO:
 
         states, actions, old_logprobs, rewards, masks = memory.to_tensor()
 
-        # Advantages
-        with torch.no_grad():
-            advantages = []
-            returns = []
-            for i in range(len(states)):
-                _, values_, _ = self.policy.evaluate(states[i], actions[i])
-                if masks[i][-1] == 1:
-                    laser, orientation, distance, velocity = next_obs
-                    bootstrapped_value = self.policy.critic(laser.to(self.device), orientation.to(self.device), distance.to(self.device), velocity.to(self.device)).detach()
-                    # TODO hier nochmal guckne next_obs ist wahrscheinlich quatsch
-                    values_ = torch.cat((values_, bootstrapped_value[0]), dim=0)
-                adv, ret = self.get_advantages(values_.detach(), masks[i], rewards[i].detach())
-                advantages.append(adv)
-                returns.append(ret)
-
         # Merge all agent states, actions, rewards etc.
-        advantages = torch.cat(advantages)
-        returns = torch.cat(returns)
+        lengths = [len(reward) for reward in rewards]
         actions = torch.cat(actions)
         old_logprobs = torch.cat(old_logprobs)
         states_ = tuple()
@@ -342,6 +461,29 @@ class PPO:
             states_ += (torch.cat([states[k][i] for k in range(len(states))]),)
         states = states_
 
+        # Advantages
+        with torch.no_grad():
+            # values of all states in a few large batches, only the critic is needed
+            values = torch.split(self.get_values(states, mini_batch_size), lengths)
+            if any(mask[-1] == 1 for mask in masks):
+                laser, orientation, distance, velocity = next_obs
+                bootstrapped_value = self.policy.value(laser.to(self.device), orientation.to(self.device), distance.to(self.device), velocity.to(self.device)).detach()
+                # TODO hier nochmal guckne next_obs ist wahrscheinlich quatsch
+                values = [torch.cat((values_, bootstrapped_value[0]), dim=0) if mask[-1] == 1 else values_
+                          for values_, mask in zip(values, masks)]
+
+            if self.advantage_func is not None:
+                advantages = []
+                returns = []
+                for i in range(len(rewards)):
+                    adv, ret = self.advantage_func(self.gamma, self._lambda, values[i], masks[i], rewards[i].detach())
+                    advantages.append(adv)
+                    returns.append(ret)
+                advantages = torch.cat(advantages)
+                returns = torch.cat(returns)
+            else:
+                advantages, returns = self.get_advantages_batched(values, masks, [reward.detach() for reward in rewards])
+
         # Logger
         log_values = []
         #TODO logger?
@@ -396,21 +538,31 @@ class PPO:
                 assert not torch.isinf(critic_loss).any()
                 assert not torch.isinf(actor_loss).any()
                 # Backward gradients
-                self.optimizer_a.zero_grad()
-                actor_loss.backward(retain_graph=True)
-                # Global gradient norm clipping https://vitalab.github.io/article/2020/01/14/Implementation_Matters.html
-                torch.nn.utils.clip_grad_norm_(self.policy.actor.parameters(), max_norm=0.5)
-                self.optimizer_a.step()
-
-                self.optimizer_c.zero_grad()
-                critic_loss.backward()
-                # Global gradient norm clipping https://vitalab.github.io/article/2020/01/14/Implementation_Matters.html
-                torch.nn.utils.clip_grad_norm_(self.policy.critic.parameters(), max_norm=0.5)
-                self.optimizer_c.step()
+                if self.policy.shared_trunk:
+                    # the trunk gets the gradients of both heads, so both losses are minimized together
+                    self.optimizer.zero_grad()
+                    (actor_loss + critic_loss).backward()
+                    # Global gradient norm clipping https://vitalab.github.io/article/2020/01/14/Implementation_Matters.html
+                    torch.nn.utils.clip_grad_norm_(self.policy.parameters(), max_norm=0.5)
+                    self.optimizer.step()
+                else:
+                    self.optimizer_a.zero_grad()
+                    actor_loss.backward(retain_graph=True)
+                    # Global gradient norm clipping https://vitalab.github.io/article/2020/01/14/Implementation_Matters.html
+                    torch.nn.utils.clip_grad_norm_(self.policy.actor.parameters(), max_norm=0.5)
+                    self.optimizer_a.step()
+
+                    self.optimizer_c.zero_grad()
+                    critic_loss.backward()
+                    # Global gradient norm clipping https://vitalab.github.io/article/2020/01/14/Implementation_Matters.html
+                    torch.nn.utils.clip_grad_norm_(self.policy.critic.parameters(), max_norm=0.5)
+                    self.optimizer_c.step()
                 # # Global gradient norm clipping https://vitalab.github.io/article/2020/01/14/Implementation_Matters.html
                 # torch.nn.utils.clip_grad_norm_(self.policy.ac.parameters(), max_norm=0.5)
 
         #logger.add_value([np.array(log_values).mean()])
 
+        self.rollout_policy.sync(self.policy)
+
         # Clear memory
         memory.clear_memory()
\ No newline at end of file
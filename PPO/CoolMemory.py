@@ -1,122 +1,156 @@
 import torch
 import numpy as np
-import copy
+
 
 class SwarmMemory(object):
-    def __init__(self, num_agents=2, action_dim=2, max_size=int(1e5)):
+    """
+    Rollout storage of a swarm. The experiences of all robots are stored in preallocated contiguous arrays, one row per
+    experience. Every row is marked with the episode segment (one robot in one episode) it belongs to, so unrolling an
+    episode is only bookkeeping and the memory does not grow with the number of episodes.
+
+    :param num_agents: number of robots of the current episode
+    :param action_dim: dimension of the actions
+    :param capacity: number of experiences the arrays are allocated for (usually update_experience). If more
+        experiences are added the arrays are enlarged once.
+    """
+    def __init__(self, num_agents=2, action_dim=2, capacity=4096):
         self.action_dim = action_dim
-        self.max_size = max_size
+        self.capacity = capacity
         self.num_agents = num_agents
-        self.memory = [Memory(action_dim=action_dim, max_size=max_size) for _ in range(num_agents)]
-        self.past_memories = []
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+        self.states = None  # allocated with the first experience, when the shapes of the observations are known
+        self.action = np.zeros((capacity, action_dim), dtype=np.float32)
+        self.logprobs = np.zeros((capacity,), dtype=np.float32)
+        self.reward = np.zeros((capacity,), dtype=np.float32)
+        self.not_done = np.zeros((capacity,), dtype=np.float32)
+        self.segment = np.zeros((capacity,), dtype=np.int64)
+
+        self.size = 0
+        # segment of the first robot of the current episode
+        self.first_segment = 0
 
     def unroll_last_episode(self, num_robots):
-        if len(self) > 0:
-            self.past_memories.append(copy.deepcopy(self.memory))
-            for i in range(self.num_agents):
-                self.memory[i].clear_memory()
+        self.first_segment += self.num_agents
         self.num_agents = num_robots
-        self.memory = [Memory(action_dim=self.action_dim, max_size=self.max_size) for _ in range(self.num_agents)]
-
-    def get_agent_state(self, state, agent_id):
-        tuple_state = tuple()
-        for state_ in state:
-            if isinstance(state_[agent_id], np.ndarray):
-                tuple_state += (np.expand_dims(state_[agent_id], axis=0),)
-            elif isinstance(state_[agent_id], torch.Tensor):
-                tuple_state += (state_[agent_id].unsqueeze(0),)
-            else:
-                import warnings
-                warnings.warn("State type not recognized")
-        return tuple_state
+
+    def allocate(self, capacity, state=None):
+        """
+        Allocates the arrays for the given capacity and keeps the stored experiences
+
+        :param state: observations of a step, used for the shapes if the states are not allocated yet
+        """
+        if self.states is None and state is not None:
+            self.states = tuple(np.zeros((capacity,) + state_.shape[1:], dtype=np.float32) for state_ in state)
+        elif self.states is not None:
+            self.states = tuple(self.resize(state_, capacity) for state_ in self.states)
+        self.action = self.resize(self.action, capacity)
+        self.logprobs = self.resize(self.logprobs, capacity)
+        self.reward = self.resize(self.reward, capacity)
+        self.not_done = self.resize(self.not_done, capacity)
+        self.segment = self.resize(self.segment, capacity)
+        self.capacity = capacity
+
+    def resize(self, array, capacity):
+        if len(array) == capacity:
+            return array
+        resized = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        resized[:self.size] = array[:self.size]
+        return resized
 
     def add(self, state, action, action_logprobs, reward, done):
-        for i in range(self.num_agents):
-            self.memory[i].add(self.get_agent_state(state, agent_id=i), action[i], action_logprobs[i], reward[i], done[i])
+        """
+        Adds the experiences of the robots of one step
+
+        :param state: list of np.arrays [laser, orientation, distance, velocity] of the robots
+        :param action: actions of the robots
+        :param action_logprobs: log probabilities of the actions
+        :param reward: list of the rewards of the robots
+        :param done: list of the dones of the robots
+        """
+        n = self.num_agents
+        if n == 0:
+            return
+        if self.states is None:
+            self.allocate(self.capacity, state)
+        if self.size + n > self.capacity:
+            self.allocate(2 * (self.size + n))
+        rows = slice(self.size, self.size + n)
+        for state_, stored in zip(state, self.states):
+            stored[rows] = state_[:n]
+        self.action[rows] = np.asarray(action[:n])
+        self.logprobs[rows] = np.asarray(action_logprobs[:n])
+        self.reward[rows] = reward[:n]
+        self.not_done[rows] = 1. - np.asarray(done[:n], dtype=np.float64)
+        self.segment[rows] = np.arange(self.first_segment, self.first_segment + n)
+        self.size += n
 
     def __len__(self):
-        length = 0
-        for memories in self.past_memories:
-            for memory in memories:
-                length += len(memory)
-        for i in range(self.num_agents):
-            length += len(self.memory[i])
-        return length
+        return self.size
 
     def to_tensor(self):
-        states, actions, logprobs, rewards, not_dones = [], [], [], [], []
-        for memories in self.past_memories:
-            for memory in memories:
-                state, action, logprob, reward, not_done = memory.to_tensor()
-                states.append(state)
-                actions.append(action)
-                logprobs.append(logprob)
-                rewards.append(reward)
-                not_dones.append(not_done)
-        return states, actions, logprobs, rewards, not_dones
+        """
+        :return: tuple (states, actions, logprobs, rewards, not_dones) - lists with the tensors of every episode
+            segment (one robot in one episode) in the order of the episodes and robots
+        """
+        order = np.argsort(self.segment[:self.size], kind='stable')
+        lengths = np.unique(self.segment[:self.size], return_counts=True)[1].tolist()
 
-    def change_horizon(self, new_horizon):
-        for i in range(self.num_agents):
-            self.memory[i].change_horizon(new_horizon)
+        def split(array):
+            return torch.split(torch.from_numpy(array[order]).to(self.device), lengths)
 
-    def clear_memory(self):
-        self.past_memories = []
-        for i in range(self.num_agents):
-            self.memory[i].clear_memory()
+        states = list(zip(*(split(state_[:self.size]) for state_ in self.states))) if self.size > 0 else []
+        return states, list(split(self.action[:self.size])), list(split(self.logprobs[:self.size])), \
+               list(split(self.reward[:self.size])), list(split(self.not_done[:self.size]))
 
+    def change_horizon(self, new_horizon):
+        self.clear_memory()
+        self.allocate(new_horizon)
 
-class Memory(object):
-    def __init__(self, action_dim=3, max_size=int(1e5)):
-        self.max_size = max_size
-        self.action_dim = action_dim
-        self.ptr = 0
-        self.batch_ptr = 0
+    def clear_memory(self):
         self.size = 0
+        self.first_segment = 0
 
-        self.state = [0 for _ in range(max_size)]
-        self.action = np.zeros((max_size, action_dim))
-        self.logprobs = np.zeros((max_size,))
-        self.reward = np.zeros((max_size,))
-        self.not_done = np.zeros((max_size,))
 
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+class VectorSwarmMemory(object):
+    """
+    Memory of the environments of a VectorEnvironment. Every environment has its own SwarmMemory, so the episodes of
+    the robots of different environments are kept apart.
+    """
+    def __init__(self, robot_counts, action_dim=2, capacity=4096):
+        capacity = -(-capacity // len(robot_counts))
+        self.memories = [SwarmMemory(num_robots, action_dim=action_dim, capacity=capacity) for num_robots in robot_counts]
 
-    def __len__(self):
-        return self.size
+    def unroll_episode(self, env_id, num_robots):
+        self.memories[env_id].unroll_last_episode(num_robots)
 
-    def add(self, state, action, action_logprobs, reward, done):
-        self.state[self.ptr] = tuple(s for s in state)
-        self.action[self.ptr] = action
-        self.logprobs[self.ptr] = action_logprobs
-        self.reward[self.ptr] = reward
-        self.not_done[self.ptr] = 1. - float(done)
+    def unroll_last_episode(self, num_robots):
+        # like SwarmMemory, the rest of the running episodes is not recorded after an update (num_robots = 0)
+        # until unroll_episode is called at the end of the episode of the environment
+        for memory in self.memories:
+            memory.unroll_last_episode(num_robots)
+
+    def add(self, state, action, action_logprobs, reward, done, robot_counts):
+        offsets = np.cumsum([0] + list(robot_counts))
+        for i, memory in enumerate(self.memories):
+            robots = slice(offsets[i], offsets[i + 1])
+            memory.add(tuple(state_[robots] for state_ in state), action[robots], action_logprobs[robots],
+                       reward[robots], done[robots])
 
-        self.ptr = (self.ptr + 1) % self.max_size
-        self.size = min(self.size + 1, self.max_size)
+    def __len__(self):
+        return sum(len(memory) for memory in self.memories)
 
     def to_tensor(self):
-        return tuple(torch.FloatTensor(np.array(state)).squeeze(1).to(self.device) for state in zip(*self.state[:self.size])), \
-               torch.FloatTensor(self.action[:self.size]).to(self.device), \
-               torch.FloatTensor(self.logprobs[:self.size]).to(self.device), \
-               torch.FloatTensor(self.reward[:self.size]).to(self.device), \
-               torch.FloatTensor(self.not_done[:self.size]).to(self.device)
-
-    def change_horizon(self, new_horizon):
-        self.max_size = new_horizon
-        self.state = [0 for _ in range(self.max_size)]
-        self.action = np.zeros((self.max_size, self.action_dim))
-        self.logprobs = np.zeros((self.max_size,))
-        self.reward = np.zeros((self.max_size,))
-        self.not_done = np.zeros((self.max_size,))
-        self.clear_memory()
+        states, actions, logprobs, rewards, not_dones = [], [], [], [], []
+        for memory in self.memories:
+            state, action, logprob, reward, not_done = memory.to_tensor()
+            states += state
+            actions += action
+            logprobs += logprob
+            rewards += reward
+            not_dones += not_done
+        return states, actions, logprobs, rewards, not_dones
 
     def clear_memory(self):
-        self.ptr = 0
-        self.batch_ptr = 0
-        self.size = 0
-
-        self.state = [0 for _ in range(self.max_size)]
-        self.action.fill(0)
-        self.logprobs.fill(0)
-        self.reward.fill(0)
-        self.not_done.fill(0)
\ No newline at end of file
+        for memory in self.memories:
+            memory.clear_memory()
@@ -1,17 +1,21 @@
 from PPO.Algorithm import PPO
 from PPO.SwarmMemory import SwarmMemory
 from PPO.CoolMemory import SwarmMemory as CoolSwarmMemory
+from PPO.CoolMemory import VectorSwarmMemory
+from PPO.RolloutPolicy import RolloutPolicy, export_quantized_actor
 from utils import Logger
 import numpy as np
 import torch
 import time
-from utils import statesToObservationsTensor,statesToObservationsNumpy, torchToNumpy
+import os
+from utils import observationsToTensor, torchToNumpy
 
 
 def train(env_name, env, solved_percentage, inputspace, max_episodes, max_timesteps,
           update_experience, _lambda, K_epochs, eps_clip, gamma, lr,
           betas, ckpt_folder, restore, tensorboard, scan_size=121, log_interval=10,
-          batches=1, advantages_func=None):
+          batches=1, advantages_func=None, shared_trunk=False,
+          rollout_threads=0, trace_rollout=True):
 
     # Tensorboard
     logger = Logger(ckpt_folder, log_interval)
@@ -20,13 +24,14 @@ def train(env_name, env, solved_percentage, inputspace, max_episodes, max_timest
     best_objective_reached = 0
 
     #memory = SwarmMemory(env.getNumberOfRobots())
-    memory = CoolSwarmMemory(env.getNumberOfRobots())
+    memory = CoolSwarmMemory(env.getNumberOfRobots(), capacity=update_experience)
 
     ckpt = ckpt_folder+'/PPO_continuous_'+env_name+'.pth'
 
     ppo = PPO(scan_size=scan_size, inputspace=inputspace, lr=lr,
               betas=betas, gamma=gamma, _lambda=_lambda, K_epochs=K_epochs, eps_clip=eps_clip,
-              logger=logger, restore=restore, ckpt=ckpt, advantages_func=advantages_func)
+              logger=logger, restore=restore, ckpt=ckpt, advantages_func=advantages_func,
+              shared_trunk=shared_trunk, rollout_threads=rollout_threads, trace_rollout=trace_rollout)
 
     env.setUISaveListener(ppo, ckpt_folder, env_name)
 
@@ -52,28 +57,27 @@ def train(env_name, env, solved_percentage, inputspace, max_episodes, max_timest
         for t in range(max_timesteps):
             observations = states
             # Run old policy
-            actions, action_logprob = ppo.select_action(statesToObservationsTensor(states))
+            actions, action_logprob = ppo.select_action(observationsToTensor(observations))
 
             states, rewards, dones, reachedGoals = env.step(torchToNumpy(actions))
 
             # memory.insertObservations(o_laser, o_orientation, o_distance, o_velocity)
-            unrolled_rewards = [sum([value for value in reward.values()]) for reward in rewards]
             # TODO Occasional error here, investigate
             # memory.insertReward(unrolled_rewards)
             # memory.insertAction(actions)
             # memory.insertLogProb(action_logprob)
             # memory.insertIsTerminal(dones)
-            memory.add(statesToObservationsNumpy(observations), actions, action_logprob, unrolled_rewards, dones)
+            memory.add(observations, actions, action_logprob, rewards, dones)
 
             logger.add_objective(reachedGoals)
-            logger.add_reward(rewards)
+            logger.add_reward(env.rewardComponents)
             logger.add_step_agents(len(rewards))
 
             if len(memory) >= update_experience:
                 
                 print('{}. training with {} experiences'.format(training_counter, len(memory)), flush=True)
                 # memory.copyMemory()
-                ppo.update(memory, batches, next_obs=statesToObservationsTensor(states))
+                ppo.update(memory, batches, next_obs=observationsToTensor(states))
                 print('Time: {}'.format(time.time() - starttime), flush=True)
                 starttime = time.time()
                 training_counter += 1
@@ -112,16 +116,125 @@ def train(env_name, env, solved_percentage, inputspace, max_episodes, max_timest
         logger.close()
 
 
+def train_vector(env_name, env, solved_percentage, inputspace, max_episodes, update_experience, _lambda, K_epochs,
+                 eps_clip, gamma, lr, betas, ckpt_folder, restore, tensorboard, scan_size=121, log_interval=10,
+                 batches=1, advantages_func=None, shared_trunk=False,
+                 rollout_threads=0, trace_rollout=True):
+    """
+    Same as train, but the experiences are collected from a VectorEnvironment which steps several environments in
+    worker processes. Environments which are done are reset to their next level by the workers, so every step collects
+    experiences of all environments. The length of the episodes is given by the steps of the environments.
+    """
+
+    # Tensorboard
+    logger = Logger(ckpt_folder, log_interval)
+    logger.set_logging(tensorboard)
+    best_objective_reached = 0
+
+    ckpt = ckpt_folder+'/PPO_continuous_'+env_name+'.pth'
+
+    ppo = PPO(scan_size=scan_size, inputspace=inputspace, lr=lr,
+              betas=betas, gamma=gamma, _lambda=_lambda, K_epochs=K_epochs, eps_clip=eps_clip,
+              logger=logger, restore=restore, ckpt=ckpt, advantages_func=advantages_func,
+              shared_trunk=shared_trunk, rollout_threads=rollout_threads, trace_rollout=trace_rollout)
+
+    training_counter = 0
+    i_episode = 1
+    solved = False
+    starttime = time.time()
+
+    observations = env.reset()
+    robot_counts = list(env.robotCounts)
+    memory = VectorSwarmMemory(robot_counts, capacity=update_experience)
+
+    # training loop
+    while i_episode < (max_episodes + 1) and not solved:
+        logger.episode = i_episode
+        # Run old policy
+        actions, action_logprob = ppo.select_action(observationsToTensor(observations))
+        # the observations can be views of the shared memory of the environments, which is overwritten by the step
+        observations = [o.copy() for o in observations]
+
+        next_observations, rewards, dones, reachedGoals, episode_dones = env.step(torchToNumpy(actions))
+
+        memory.add(observations, actions, action_logprob, rewards, dones, robot_counts)
+        observations = next_observations
+
+        offsets = np.cumsum([0] + robot_counts)
+        for i in range(len(robot_counts)):
+            logger.set_number_of_agents(robot_counts[i])
+            logger.add_objective(reachedGoals[offsets[i]:offsets[i + 1]])
+        logger.add_reward(env.rewardComponents)
+        logger.add_step_agents(len(rewards))
+
+        if len(memory) >= update_experience:
+            print('{}. training with {} experiences'.format(training_counter, len(memory)), flush=True)
+            ppo.update(memory, batches, next_obs=observationsToTensor(observations))
+            print('Time: {}'.format(time.time() - starttime), flush=True)
+            starttime = time.time()
+            training_counter += 1
+
+        robot_counts = list(env.robotCounts)
+        for i in np.flatnonzero(episode_dones):
+            memory.unroll_episode(i, robot_counts[i])
+            logger.episode = i_episode
+
+            if i_episode % log_interval == 0:
+                running_reward, objective_reached = logger.log()
+                print(f'Percentage of objective reached: {objective_reached:.4f}', flush=True)
+                if objective_reached >= solved_percentage:
+                    print(f"\nPercentage of: {objective_reached:.2f} reached!", flush=True)
+                    ppo.saveCurrentWeights(f"{env_name}_solved")
+                    print('Save as solved!!', flush=True)
+                    solved = True
+                    break
+
+                if objective_reached > best_objective_reached:
+                    best_objective_reached = objective_reached
+                    ppo.saveCurrentWeights(f"{env_name}_best")
+                    print(
+                        f'Best performance with avg reward of NOT CALCULATED saved at training {training_counter}.',
+                        flush=True)
+
+            i_episode += 1
+            if i_episode >= (max_episodes + 1):
+                break
+
+    ppo.saveCurrentWeights(f"{env_name}_final")
+
+    if tensorboard:
+        logger.close()
+
+
 def test(env_name, env, render, inputspace, _lambda,
          K_epochs, eps_clip, gamma, lr, betas, ckpt_folder, test_episodes,
-         scan_size=121, advantages_func=None):
+         scan_size=121, advantages_func=None, shared_trunk=False, rollout_threads=0, trace_rollout=True,
+         quantized=False):
 
     ckpt = ckpt_folder+'/PPO_continuous_'+env_name+'.pth'
-    print('Load checkpoint from {}'.format(ckpt))
-
-    ppo = PPO(scan_size, inputspace, lr, betas, gamma, _lambda,
-              K_epochs, eps_clip, restore=True, ckpt=ckpt, logger=None,
-              advantages_func=advantages_func)
+    quantized_ckpt = ckpt_folder+'/PPO_continuous_'+env_name+'_int8.pt'
+
+    # the quantized actor is exported again if it does not exist or is older than the checkpoint (like the
+    # compiled levels, see SVGParser.compileLevel), so a retrained model is never tested with stale int8 weights
+    export_quantized = quantized and (not os.path.isfile(quantized_ckpt) or (
+        os.path.isfile(ckpt) and os.path.getmtime(ckpt) > os.path.getmtime(quantized_ckpt)))
+
+    if not quantized or export_quantized:
+        print('Load checkpoint from {}'.format(ckpt))
+        ppo = PPO(scan_size, inputspace, lr, betas, gamma, _lambda,
+                  K_epochs, eps_clip, restore=True, ckpt=ckpt, logger=None,
+                  advantages_func=advantages_func, shared_trunk=shared_trunk, rollout_threads=rollout_threads,
+                  trace_rollout=trace_rollout)
+        select_action_certain = ppo.select_action_certain
+
+    if quantized:
+        # actor only model with int8 linear layers
+        if export_quantized:
+            print('Export quantized actor to {}'.format(quantized_ckpt))
+            export_quantized_actor(ppo.policy, quantized_ckpt, observationsToTensor(env.reset()))
+            del ppo
+        print('Load quantized actor from {}'.format(quantized_ckpt))
+        select_action_certain = RolloutPolicy.load_quantized(quantized_ckpt, num_threads=rollout_threads).act_certain
 
     episode_reward, time_step = 0, 0
     avg_episode_reward, avg_length = 0, 0
@@ -131,14 +244,14 @@ def test(env_name, env, render, inputspace, _lambda,
         states = env.reset()
         while True:
             time_step += 1
-            observations = statesToObservationsTensor(states)
+            observations = observationsToTensor(states)
 
             # Run old policy
-            actions = ppo.select_action_certain(observations)
+            actions = select_action_certain(observations)
 
             states, rewards, dones, _ = env.step(torchToNumpy(actions))
 
-            episode_reward += sum([sum([value for value in reward.values()]) for reward in rewards])
+            episode_reward += np.sum(rewards)
 
             if render:
                 env.render()
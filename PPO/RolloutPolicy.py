@@ -0,0 +1,178 @@
+import copy
+import warnings
+
+import torch
+import torch.nn as nn
+import numpy as np
+
+
+class RolloutActor(nn.Module):
+    """
+    CPU copy of the part of an ActorCritic which is needed to select actions (input network and actor head). Unlike
+    Actor.forward the inputs and outputs are not moved between devices.
+
+    :param policy: The ActorCritic to copy.
+    """
+    def __init__(self, policy):
+        super(RolloutActor, self).__init__()
+        self.shared_trunk = policy.shared_trunk
+        self.inputspace = copy.deepcopy(policy.trunk if policy.shared_trunk else policy.actor.Inputspace).cpu()
+        self.mu = copy.deepcopy(policy.actor.mu).cpu()
+        self.log_std = nn.Parameter(policy.actor.log_std.detach().cpu().clone())
+
+    def forward(self, laser, orientation_to_goal, distance_to_goal, velocity):
+        x = self.inputspace(laser, orientation_to_goal, distance_to_goal, velocity)
+        mu = torch.tanh(self.mu(x))
+        std = torch.exp(self.log_std)
+        return mu, std
+
+    def sync(self, policy):
+        """
+        Copies the current weights of the ActorCritic.
+        """
+        with torch.no_grad():
+            inputspace = policy.trunk if self.shared_trunk else policy.actor.Inputspace
+            for target, source in zip(self.inputspace.parameters(), inputspace.parameters()):
+                target.copy_(source)
+            for target, source in zip(self.inputspace.buffers(), inputspace.buffers()):
+                target.copy_(source)
+            self.mu.weight.copy_(policy.actor.mu.weight)
+            self.mu.bias.copy_(policy.actor.mu.bias)
+            self.log_std.copy_(policy.actor.log_std)
+        self.train(policy.training)
+
+
+class RolloutPolicy:
+    """
+    Selects the actions of the robots during the rollouts. It runs a CPU copy of the actor (traced with TorchScript if
+    enabled) in inference mode and samples from a diagonal normal distribution instead of building a
+    MultivariateNormal with a full covariance matrix every step. The weights are copied from the learner with sync,
+    which PPO calls after every update.
+
+    The copy is in the same mode (train / eval) as the learner, so the actions are sampled exactly like with
+    ActorCritic.act.
+
+    :param policy: The ActorCritic of the learner.
+    :param logger: The logger the actor outputs are logged to (None to disable).
+    :param num_threads: Number of CPU threads used for the rollouts (0 keeps the number of threads of torch).
+    :param trace: Whether the actor is traced with TorchScript.
+    """
+    def __init__(self, policy, logger, num_threads=0, trace=True):
+        self.logger = logger
+        self.num_threads = num_threads
+        self.trace = trace
+        self.traced = None
+        if policy is not None:
+            self.actor = RolloutActor(policy)
+            self.actor.train(policy.training)
+
+    @classmethod
+    def load_quantized(cls, path, num_threads=0):
+        """
+        Creates a policy from an actor exported with export_quantized_actor. Only act_certain is supported, the
+        exported actor is already traced and has no weights to sync.
+
+        :param path: The path of the exported actor.
+        :param num_threads: Number of CPU threads used to select the actions (0 keeps the number of threads of torch).
+        """
+        rollout = cls(None, None, num_threads=num_threads, trace=False)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            rollout.actor = torch.jit.load(str(path), map_location='cpu')
+        return rollout
+
+    def sync(self, policy):
+        self.actor.sync(policy)
+
+    def forward(self, laser, orientation, distance, velocity):
+        if not self.trace:
+            return self.actor(laser, orientation, distance, velocity)
+        # the mode of the dropout is fixed when tracing, so the actor is traced again when it changes. The traced
+        # module shares the parameters with self.actor, synced weights are used without tracing again
+        if self.traced is None or self.traced.training != self.actor.training:
+            # tracing runs the actor once, the random state is restored so the dropout of this run does not change
+            # the sampled actions
+            with warnings.catch_warnings(), torch.random.fork_rng():
+                warnings.simplefilter('ignore')
+                self.traced = torch.jit.trace(self.actor, (laser, orientation, distance, velocity), check_trace=False)
+        return self.traced(laser, orientation, distance, velocity)
+
+    def run(self, function, states):
+        if self.num_threads > 0 and torch.get_num_threads() != self.num_threads:
+            threads = torch.get_num_threads()
+            torch.set_num_threads(self.num_threads)
+            try:
+                return function(states)
+            finally:
+                torch.set_num_threads(threads)
+        return function(states)
+
+    def act(self, states):
+        """
+        Returns an action sampled from the actor's distribution and the log probability of that action.
+
+        :param states: A tuple of the current lidar scan, orientation to goal, distance to goal, and velocity.
+        :return: A tuple of the sampled action and the log probability of that action.
+        """
+        return self.run(self._act, states)
+
+    def act_certain(self, states):
+        """
+        Returns the mean of the actor's distribution.
+
+        :param states: A tuple of the current lidar scan, orientation to goal, distance to goal, and velocity.
+        :return: The action from the actor's distribution.
+        """
+        return self.run(self._act_certain, states)
+
+    def _act(self, states):
+        with torch.inference_mode():
+            laser, orientation, distance, velocity = (state.cpu() for state in states)
+            action_mean, action_std = self.forward(laser, orientation, distance, velocity)
+            if self.logger is not None:
+                self.logger.add_actor_output(*torch.cat((action_mean.mean(0), action_std ** 2)).tolist())
+
+            # diagonal covariance: sampling and log probability of the MultivariateNormal per dimension
+            action = action_mean + action_std * torch.randn_like(action_mean)
+            action = torch.clip(action, -1, 1)
+            action_logprob = (-((action - action_mean) / action_std) ** 2 / 2 - torch.log(action_std)
+                              - np.log(2 * np.pi) / 2).sum(-1)
+
+            return action, action_logprob
+
+    def _act_certain(self, states):
+        with torch.inference_mode():
+            laser, orientation, distance, velocity = (state.cpu() for state in states)
+            action, _ = self.forward(laser, orientation, distance, velocity)
+
+        return action
+
+
+def quantize_actor(actor):
+    """
+    Quantizes the linear layers of an actor dynamically to int8 (weights stored as int8, activations quantized on the
+    fly). The convolutions of the input network stay in float32.
+
+    :param actor: The RolloutActor to quantize, it is not changed.
+    :return: The quantized copy of the actor in eval mode.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(actor).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def export_quantized_actor(policy, path, example_states):
+    """
+    Exports the actor of an ActorCritic as dynamically quantized TorchScript module, which can be loaded with
+    RolloutPolicy.load_quantized without the critic and without the classes of the networks.
+
+    :param policy: The ActorCritic to export.
+    :param path: The path of the exported actor.
+    :param example_states: A tuple of a lidar scan, orientation to goal, distance to goal, and velocity with the
+        shapes of the observations.
+    """
+    actor = quantize_actor(RolloutActor(policy))
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        traced = torch.jit.trace(actor, tuple(example_states), check_trace=False)
+        torch.jit.save(traced, str(path))
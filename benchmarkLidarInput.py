@@ -0,0 +1,109 @@
+from Environment.Environment import Environment
+from PPO.Algorithm import PPO
+from PPO.CoolMemory import SwarmMemory
+from lidarParity import createArgs
+from utils import observationsToTensor, torchToNumpy, observedRays
+import numpy as np
+import argparse
+import random
+import torch
+import time
+
+
+def runEpisode(env, ppo, level, steps, memory=None):
+    """
+    Runs an episode with the actions of the policy
+
+    :param memory: SwarmMemory - if given the actions are sampled and stored in the memory, otherwise the mean actions
+        are used
+    :return: tuple (float, int, float) - time needed to select the actions and to step the environment, number of
+        experiences and percentage of robots which reached their goal
+    """
+    states = env.reset(level)
+    if memory is not None:
+        memory.unroll_last_episode(env.getNumberOfRobots())
+    reached = np.zeros(env.getNumberOfRobots(), dtype=bool)
+    duration, experiences = 0, 0
+    for _ in range(steps):
+        start = time.perf_counter()
+        observations = observationsToTensor(states)
+        if memory is not None:
+            actions, action_logprob = ppo.select_action(observations)
+        else:
+            actions = ppo.select_action_certain(observations)
+        nextStates, rewards, dones, reachedGoals = env.step(torchToNumpy(actions))
+        duration += time.perf_counter() - start
+
+        if memory is not None:
+            memory.add(states, actions, action_logprob, rewards, dones)
+        experiences += len(rewards)
+        reached[:len(reachedGoals)] |= np.asarray(reachedGoals, dtype=bool)
+        states = nextStates
+        if env.is_done():
+            break
+    return duration, experiences, reached.mean()
+
+
+def benchmark(levelFiles, numberOfRays, pooling, cmdArgs):
+    """
+    Trains a policy with the given lidar input for a few updates and evaluates it afterwards
+
+    :return: dict - sizes, throughputs and success rate of the setting
+    """
+    args = createArgs(levelFiles, numberOfRays, False, False)
+    args.lidar_pooling = pooling
+    env = Environment(None, args, args.time_frames, 0)
+    ppo = PPO(observedRays(args), cmdArgs.inputspace, lr=cmdArgs.lr, betas=[0.9, 0.990], gamma=0.99, _lambda=0.95,
+              K_epochs=cmdArgs.K_epochs, eps_clip=0.2, logger=None, ckpt='/tmp/benchmarkLidarInput')
+    memory = SwarmMemory(env.getNumberOfRobots(), capacity=cmdArgs.update_experience)
+
+    stepTime, stepExperiences, updateTime, updateExperiences = 0, 0, 0, 0
+    level = 0
+    for _ in range(cmdArgs.updates):
+        while len(memory) < cmdArgs.update_experience:
+            duration, experiences, _ = runEpisode(env, ppo, level % len(levelFiles), cmdArgs.steps, memory)
+            stepTime += duration
+            stepExperiences += experiences
+            level += 1
+        updateExperiences += len(memory)
+        start = time.perf_counter()
+        ppo.update(memory, cmdArgs.batches, next_obs=observationsToTensor(env.get_observations()))
+        updateTime += time.perf_counter() - start
+
+    ppo.set_eval()
+    success = [runEpisode(env, ppo, episode % len(levelFiles), cmdArgs.steps)[2]
+               for episode in range(cmdArgs.eval_episodes)]
+
+    parameters = sum(p.numel() for p in ppo.policy.parameters())
+    return {'rays': numberOfRays, 'pooling': pooling, 'observed': observedRays(args),
+            'parameters': parameters / 1e6, 'checkpoint': parameters * 4 / 2 ** 20,
+            'steps': stepExperiences / stepTime, 'update': updateExperiences / updateTime if updateTime > 0 else 0,
+            'success': np.mean(success)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the throughput and success rate of different lidar inputs of the neural net')
+    parser.add_argument('--settings', type=str, nargs='+', default=['1081:1', '1081:4', '1081:16', '271:1'],
+                        help='Settings as number_of_rays:lidar_pooling')
+    parser.add_argument('--level_files', type=str, nargs='+', default=['ez.svg', 'ez2.svg', 'ez3.svg', 'ez4.svg'], help='Levels to train and evaluate on')
+    parser.add_argument('--steps', type=int, default=200, help='Steps per episode')
+    parser.add_argument('--updates', type=int, default=2, help='Number of updates per setting')
+    parser.add_argument('--update_experience', type=int, default=512, help='how many experiences to update the policy')
+    parser.add_argument('--batches', type=int, default=2, help='number of batches')
+    parser.add_argument('--K_epochs', type=int, default=3, help='update the policy K times')
+    parser.add_argument('--lr', type=float, default=0.0003)
+    parser.add_argument('--inputspace', default='big', help='big or small')
+    parser.add_argument('--eval_episodes', type=int, default=4, help='Episodes to evaluate the success rate')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the levels and the networks')
+    cmdArgs = parser.parse_args()
+
+    print('{:>6s} {:>8s} {:>9s} {:>11s} {:>14s} {:>12s} {:>13s} {:>8s}'.format(
+        'rays', 'pooling', 'observed', 'params [M]', 'checkpoint MB', 'steps exp/s', 'update exp/s', 'success'))
+    for setting in cmdArgs.settings:
+        numberOfRays, pooling = (int(value) for value in setting.split(':'))
+        random.seed(cmdArgs.seed)
+        np.random.seed(cmdArgs.seed)
+        torch.manual_seed(cmdArgs.seed)
+        result = benchmark(cmdArgs.level_files, numberOfRays, pooling, cmdArgs)
+        print('{rays:6d} {pooling:8d} {observed:9d} {parameters:11.2f} {checkpoint:14.1f} {steps:12.1f} {update:13.1f} '
+              '{success:8.2f}'.format(**result), flush=True)
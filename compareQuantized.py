@@ -0,0 +1,97 @@
+from Environment.Environment import Environment
+from PPO.Algorithm import PPO
+from PPO.RolloutPolicy import RolloutPolicy, export_quantized_actor
+from lidarParity import createArgs
+from utils import observationsToTensor, torchToNumpy, observedRays
+import numpy as np
+import argparse
+import random
+import torch
+import time
+import os
+
+
+def compareLevel(env, level, fp32, int8, steps):
+    """
+    Drives the robots of a level with the actions of the fp32 actor and compares them with the actions of the
+    quantized actor every step
+
+    :param fp32: function - act_certain of the fp32 actor
+    :param int8: function - act_certain of the quantized actor
+    :return: tuple (np.array, list, list) - absolute differences of all actions, latencies of the fp32 and of the
+        quantized actor in seconds
+    """
+    states = env.reset(level)
+    differences, latenciesFp32, latenciesInt8 = [], [], []
+    for _ in range(steps):
+        observations = observationsToTensor(states)
+        start = time.perf_counter()
+        actionsFp32 = fp32(observations)
+        latenciesFp32.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        actionsInt8 = int8(observations)
+        latenciesInt8.append(time.perf_counter() - start)
+        differences.append(torchToNumpy(torch.abs(actionsFp32 - actionsInt8)).ravel())
+
+        states, _, _, _ = env.step(torchToNumpy(actionsFp32))
+        if env.is_done():
+            break
+    return np.concatenate(differences), latenciesFp32, latenciesInt8
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports a dynamically int8 quantized actor and compares it with the fp32 actor on the levels')
+    parser.add_argument('--ckpt', type=str, required=True, help='Checkpoint (PPO_continuous_*.pth) to export')
+    parser.add_argument('--output', type=str, default=None, help='Path of the quantized actor (default: checkpoint name with _int8.pt)')
+    parser.add_argument('--level_files', type=str, nargs='+', default=None, help='Levels to compare on (default: all levels in svg/)')
+    parser.add_argument('--steps', type=int, default=50, help='Steps per level')
+    parser.add_argument('--inputspace', default='big', help='big or small')
+    parser.add_argument('--shared_trunk', action='store_true', help='Export into the shared trunk layout')
+    parser.add_argument('--number_of_rays', type=int, default=1081, help='The number of Rays emittet by the laser')
+    parser.add_argument('--lidar_pooling', type=int, default=1, help='Number of neighbouring rays reduced to their minimum (as in training)')
+    parser.add_argument('--threads', type=int, default=0, help='Number of CPU threads (0 keeps the default number of threads of torch)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the levels')
+    cmdArgs = parser.parse_args()
+
+    levelFiles = cmdArgs.level_files
+    if levelFiles is None:
+        svgPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svg')
+        levelFiles = sorted(f for f in os.listdir(svgPath) if os.path.isfile(os.path.join(svgPath, f)))
+    output = cmdArgs.output
+    if output is None:
+        output = os.path.splitext(cmdArgs.ckpt)[0] + '_int8.pt'
+
+    random.seed(cmdArgs.seed)
+    np.random.seed(cmdArgs.seed)
+    if cmdArgs.threads > 0:
+        torch.set_num_threads(cmdArgs.threads)
+
+    args = createArgs(levelFiles, cmdArgs.number_of_rays, False, False)
+    args.lidar_pooling = cmdArgs.lidar_pooling
+    env = Environment(None, args, args.time_frames, 0)
+
+    ppo = PPO(observedRays(args), cmdArgs.inputspace, lr=0, betas=[0.9, 0.990], gamma=0.99, _lambda=0.95,
+              K_epochs=0, eps_clip=0.2, logger=None, restore=True, ckpt=cmdArgs.ckpt, shared_trunk=cmdArgs.shared_trunk)
+    ppo.set_eval()
+    export_quantized_actor(ppo.policy, output, observationsToTensor(env.reset(0)))
+    quantized = RolloutPolicy.load_quantized(output)
+
+    actorBytes = sum(p.numel() * p.element_size() for p in ppo.rollout_policy.actor.parameters())
+    print('fp32 actor: {:.1f} MB  int8 actor: {:.1f} MB ({})'.format(
+        actorBytes / 2 ** 20, os.path.getsize(output) / 2 ** 20, output))
+
+    allDifferences, allFp32, allInt8 = [], [], []
+    for level in range(len(levelFiles)):
+        differences, latenciesFp32, latenciesInt8 = compareLevel(env, level, ppo.select_action_certain,
+                                                                 quantized.act_certain, cmdArgs.steps)
+        allDifferences.append(differences)
+        allFp32 += latenciesFp32
+        allInt8 += latenciesInt8
+        print('{:25s} action difference mean: {:.2e} max: {:.2e}  latency fp32: {:6.1f} ms  int8: {:6.1f} ms'.format(
+            levelFiles[level], differences.mean(), differences.max(), 1000 * np.median(latenciesFp32),
+            1000 * np.median(latenciesInt8)))
+
+    allDifferences = np.concatenate(allDifferences)
+    print('All levels: action difference mean: {:.2e} max: {:.2e}  median latency fp32: {:.1f} ms  int8: {:.1f} ms  '
+          'speedup: {:.2f}x'.format(allDifferences.mean(), allDifferences.max(), 1000 * np.median(allFp32),
+                                    1000 * np.median(allInt8), np.median(allFp32) / np.median(allInt8)))
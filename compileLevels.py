@@ -0,0 +1,61 @@
+import Environment.SVGParser as SVGParser
+import argparse
+import time
+import os
+
+
+def levelData(level):
+    """
+    :param level: SVGParser.CompiledLevel
+    :return: tuple - all values of the level as python floats, to compare levels exactly
+    """
+    lines = [line.getStart() + line.getEnd() + line.getN() for line in level.lines]
+    circles = [(circle.getPosX(), circle.getPosY(), circle.getRadius()) for circle in level.circles]
+    return (list(level.arenaSize), lines, circles, [tuple(data) for data in level.robotsData],
+            [tuple(data) for data in level.stationsData], [tuple(data) for data in level.startAndGoalCircles])
+
+
+def compileLevels(levelFiles):
+    """
+    Compiles the level files into binary levels (SVGParser.COMPILED_FOLDER), which are loaded by the simulation
+    instead of the svgs, and checks that the binary levels contain exactly the parsed svgs
+
+    :param levelFiles: list of strings - levels to compile
+    :return: bool - True if all binary levels are identical to the svgs
+    """
+    os.makedirs(SVGParser.COMPILED_FOLDER, exist_ok=True)
+    passed = True
+    parseTimes, loadTimes = [], []
+    for levelFile in levelFiles:
+        start = time.perf_counter()
+        level = SVGParser.CompiledLevel.parse(levelFile)
+        parseTimes.append(time.perf_counter() - start)
+
+        path = SVGParser.compiledLevelPath(levelFile)
+        level.save(path)
+        start = time.perf_counter()
+        loaded = SVGParser.CompiledLevel.load(path)
+        loadTimes.append(time.perf_counter() - start)
+
+        ok = levelData(loaded) == levelData(level)
+        passed = passed and ok
+        print('{:25s} walls: {:4d}  circles: {:3d}  {:6d} bytes  parse: {:6.3f} ms  load: {:6.3f} ms  {}'.format(
+            levelFile, len(level.lines), len(level.circles), os.path.getsize(path), 1000 * parseTimes[-1],
+            1000 * loadTimes[-1], 'OK' if ok else 'FAILED'))
+    print('{} levels  parse: {:.2f} ms  load: {:.2f} ms'.format(len(levelFiles), 1000 * sum(parseTimes),
+                                                               1000 * sum(loadTimes)))
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compiles svg levels into binary levels, which are loaded faster than the svgs')
+    parser.add_argument('level_files', type=str, nargs='*', help='Levels to compile (default: all levels in svg/)')
+    cmdArgs = parser.parse_args()
+
+    levelFiles = cmdArgs.level_files
+    if not levelFiles:
+        levelFiles = sorted(f for f in os.listdir('svg') if os.path.isfile(os.path.join('svg', f)))
+
+    passed = compileLevels(levelFiles)
+    print('Compiled levels to ' + SVGParser.COMPILED_FOLDER if passed else 'Compiling levels FAILED')
+    exit(0 if passed else 1)
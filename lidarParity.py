@@ -0,0 +1,114 @@
+from Environment.Environment import Environment
+from Environment.Components.Lidar import SwarmCollisionRay
+from types import SimpleNamespace
+import numpy as np
+import argparse
+import random
+import os
+
+
+def createArgs(levelFiles, numberOfRays, hasPieSlice, collideOtherTargets):
+    """
+    Creates the args needed to run the simulation without visualization
+
+    :param levelFiles: list of strings - levels to load
+    :return: SimpleNamespace - args as defined in main
+    """
+    args = {}
+    args['mode'] = 'test'
+    args['time_frames'] = 4
+    args['steps'] = 1000
+    args['inputspace'] = 'big'
+    args['image_size'] = 256
+    args['level_files'] = levelFiles
+    args['sim_time_step'] = 0.15
+    args['lidar_grid_cell_size'] = 0
+    args['lidar_angle_tolerance'] = 0
+    args['lidar_backend'] = 'numpy'
+    args['lidar_pooling'] = 1
+    args['distance_field_cell_size'] = 0
+    args['number_of_rays'] = numberOfRays
+    args['field_of_view'] = 270
+    args['has_pie_slice'] = hasPieSlice
+    args['collide_other_targets'] = collideOtherTargets
+    args['manually'] = False
+    args['visualization'] = 'none'
+    args['visualization_paused'] = False
+    args['tensorboard'] = False
+    args['render'] = False
+    args['scale_factor'] = 55
+    args['display_normals'] = True
+    return SimpleNamespace(**args)
+
+
+def compareBackends(simulation, numbaRayCol):
+    """
+    Scans the current state of the simulation with the numpy and the numba backend
+
+    :return: tuple (float, float) - maximal difference of the lidar distances and of the collision distances
+    """
+    robots = simulation.robots
+    sensors = [robot for robot in robots if robot.isActive()]
+    if len(sensors) == 0:
+        return 0, 0
+    scanNumpy = simulation.swarmRayCol.scan(sensors, robots, simulation.geometry, simulation.stations)
+    scanNumba = numbaRayCol.scan(sensors, robots, simulation.geometry, simulation.stations)
+    lidarDiff = np.max(np.abs(scanNumpy[0] - scanNumba[0]))
+    collisionDiff = max(np.max(np.abs(a - b), initial=0) for a, b in zip(scanNumpy[2], scanNumba[2]))
+    collisionDiff = max(collisionDiff, np.max(np.abs(scanNumpy[4] - scanNumba[4])))
+    return lidarDiff, collisionDiff
+
+
+def checkParity(levelFiles, steps, tolerance, numberOfRays=1081, hasPieSlice=False, collideOtherTargets=False):
+    """
+    Drives the robots of every level with random actions and compares the scans of both lidar backends every step
+
+    :param levelFiles: list of strings - levels to check
+    :param steps: int - steps per level
+    :param tolerance: float - maximal allowed difference
+    :return: bool - True if all levels are within the tolerance
+    """
+    args = createArgs(levelFiles, numberOfRays, hasPieSlice, collideOtherTargets)
+    env = Environment(None, args, args.time_frames, 0)
+    numbaRayCol = SwarmCollisionRay(SimpleNamespace(**dict(vars(args), lidar_backend='numba')))
+    passed = True
+    for level in range(len(levelFiles)):
+        env.reset(level)
+        maxLidarDiff, maxCollisionDiff = compareBackends(env.simulation, numbaRayCol)
+        for _ in range(steps):
+            actions = np.random.uniform(-1, 1, size=(len(env.simulation.robots), 2))
+            env.step(actions)
+            lidarDiff, collisionDiff = compareBackends(env.simulation, numbaRayCol)
+            maxLidarDiff = max(maxLidarDiff, lidarDiff)
+            maxCollisionDiff = max(maxCollisionDiff, collisionDiff)
+            if env.is_done():
+                break
+        ok = maxLidarDiff <= tolerance and maxCollisionDiff <= tolerance
+        passed = passed and ok
+        print('{:25s} lidar: {:.3e}  collision distances: {:.3e}  {}'.format(
+            levelFiles[level], maxLidarDiff, maxCollisionDiff, 'OK' if ok else 'FAILED'))
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the numba lidar backend with the numpy reference')
+    parser.add_argument('--level_files', type=str, nargs='+', default=None, help='Levels to check (default: all levels in svg/)')
+    parser.add_argument('--steps', type=int, default=50, help='Steps with random actions per level')
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='Maximal allowed difference')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random actions')
+    cmdArgs = parser.parse_args()
+
+    levelFiles = cmdArgs.level_files
+    if levelFiles is None:
+        svgPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svg')
+        levelFiles = sorted(f for f in os.listdir(svgPath) if os.path.isfile(os.path.join(svgPath, f)))
+
+    random.seed(cmdArgs.seed)
+    np.random.seed(cmdArgs.seed)
+    passed = True
+    for hasPieSlice, collideOtherTargets in [(False, False), (True, False), (False, True)]:
+        print('has_pie_slice: {}, collide_other_targets: {}'.format(hasPieSlice, collideOtherTargets))
+        passed = checkParity(levelFiles, cmdArgs.steps, cmdArgs.tolerance, hasPieSlice=hasPieSlice,
+                             collideOtherTargets=collideOtherTargets) and passed
+    print('Parity check passed' if passed else 'Parity check FAILED')
+    exit(0 if passed else 1)
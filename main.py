@@ -1,11 +1,11 @@
-from PPO.Environment import train, test
+from PPO.Environment import train, train_vector, test
 from Environment.Environment import Environment
-from utils import str2bool, check_args
+from Environment.VectorEnvironment import VectorEnvironment
+from utils import str2bool, check_args, observedRays
 import random
 import sys
 import os
 import argparse
-from PyQt5.QtWidgets import QApplication
 
 
 # use all svg files in the svg folder as default level_files
@@ -61,6 +61,7 @@ parser.add_argument('--steps', type=int, default=500, help='Steps in Environment
 parser.add_argument('--max_episodes', type=float, default="inf", help='Maximum Number of Episodes')
 parser.add_argument('--update_experience', type=int, default=3000, help='how many experiences to update the policy') #40000
 parser.add_argument('--batches', type=int, default=1, help='number of batches') #15
+parser.add_argument('--num_envs', type=int, default=1, help='Number of environments stepped in parallel worker processes during training. Each environment starts on another level of the level files')
 parser.add_argument('--action_std', type=float, default=0.5, help='constant std for action distribution (Multivariate Normal)') # TODO currently not used
 parser.add_argument('--_lambda', type=float, default=0.95, help='lambda for advantage calculation')
 parser.add_argument('--K_epochs', type=int, default=7, help='update the policy K times')
@@ -68,12 +69,21 @@ parser.add_argument('--eps_clip', type=float, default=0.2, help='epsilon for p/q
 parser.add_argument('--gamma', type=float, default=0.99, help='discount factor')
 parser.add_argument('--lr', type=float, default=0.0003)
 parser.add_argument('--inputspace', default='big', help='big or small') # image not advised to use but functional
+parser.add_argument('--shared_trunk', type=str2bool, default=False, help='Actor and critic share one input network and are trained with a combined loss. Checkpoints of the other layout are converted when loading')
+parser.add_argument('--rollout_threads', type=int, default=0, help='Number of CPU threads used to select the actions during the rollouts. 0 keeps the default number of threads of torch')
+parser.add_argument('--trace_rollout', type=str2bool, default=True, help='Trace the actor used to select the actions with TorchScript')
+parser.add_argument('--quantized', type=str2bool, default=False, help='Test mode: run an actor only model with dynamically int8 quantized linear layers (exported from the checkpoint if <model>_int8.pt does not exist)')
 parser.add_argument('--image_size', type=float, default=256, help='size of the image that goes into the neural net')
 
 # Simulation settings
 
 parser.add_argument('--level_files', type=str, nargs='+', default=level_files, help='List of level files as strings')
 parser.add_argument('--sim_time_step', type=float, default=1, help='Time between steps') #.125
+parser.add_argument('--lidar_grid_cell_size', type=float, default=0, help='Cell size (in meters) of the uniform grid used to accelerate the lidar on levels with many walls. 0 disables the grid')
+parser.add_argument('--lidar_angle_tolerance', type=float, default=0, help='Angular tolerance (in radians) of the precomputed lidar ray directions. 0 calculates the exact directions every step')
+parser.add_argument('--lidar_backend', type=str, default='numpy', help='Implementation of the lidar. numpy: batched numpy calculation (reference); numba: parallel Numba JIT kernels (requires numba)')
+parser.add_argument('--lidar_pooling', type=int, default=1, help='Number of neighbouring rays which are reduced to their minimum before the scan is passed to the neural net. 1 passes all rays')
+parser.add_argument('--distance_field_cell_size', type=float, default=0, help='Cell size (in meters) of a precomputed distance field of the walls, in which the distance of the robots to the walls is looked up for the collision check. 0 calculates the exact distances')
 
 # Robot settings
 
@@ -107,26 +117,43 @@ print(args)
 level_index = 0
 
 app = None
-if args.visualization == "single":
-    app = QApplication(sys.argv)
-elif args.visualization == "all":
+if args.visualization == "single" or args.visualization == "all":
+    # PyQt5 is only imported with visualization, headless runs (--visualization none) don't need it or an X server
+    from PyQt5.QtWidgets import QApplication
     app = QApplication(sys.argv)
 
-env = Environment(app, args, args.time_frames, level_index)
+if args.mode == 'train' and args.num_envs > 1:
+    env = VectorEnvironment(args, args.time_frames, args.num_envs)
+else:
+    env = Environment(app, args, args.time_frames, level_index)
 
 # TODO schöner ???!! @Niklas2 DEPRECATED
 # if args.input_style == 'laser':
 #     args.image_size = args.number_of_rays
 
-if args.mode == 'train':
+if args.mode == 'train' and args.num_envs > 1:
+    try:
+        train_vector(args.model_name, env, inputspace=args.inputspace, solved_percentage=args.solved_percentage,
+                     max_episodes=args.max_episodes, update_experience=args.update_experience,
+                     _lambda=args._lambda, K_epochs=args.K_epochs, eps_clip=args.eps_clip,
+                     gamma=args.gamma, lr=args.lr, betas=[0.9, 0.990], ckpt_folder=args.ckpt_folder,
+                     restore=args.restore, log_interval=args.log_interval, scan_size=observedRays(args),
+                     batches=args.batches, tensorboard=args.tensorboard, shared_trunk=args.shared_trunk,
+                     rollout_threads=args.rollout_threads, trace_rollout=args.trace_rollout)
+    finally:
+        env.close()
+elif args.mode == 'train':
     train(args.model_name, env, inputspace=args.inputspace, solved_percentage=args.solved_percentage,
           max_episodes=args.max_episodes, max_timesteps=args.steps, update_experience=args.update_experience,
           _lambda=args._lambda, K_epochs=args.K_epochs, eps_clip=args.eps_clip,
           gamma=args.gamma, lr=args.lr, betas=[0.9, 0.990], ckpt_folder=args.ckpt_folder,
-          restore=args.restore, log_interval=args.log_interval, scan_size=args.number_of_rays,
-          batches=args.batches, tensorboard=args.tensorboard)
+          restore=args.restore, log_interval=args.log_interval, scan_size=observedRays(args),
+          batches=args.batches, tensorboard=args.tensorboard, shared_trunk=args.shared_trunk,
+          rollout_threads=args.rollout_threads, trace_rollout=args.trace_rollout)
 elif args.mode == 'test':
     test(args.model_name, env, inputspace=args.inputspace,
          render=args.render, _lambda=args._lambda, K_epochs=args.K_epochs, eps_clip=args.eps_clip,
          gamma=args.gamma, lr=args.lr, betas=[0.9, 0.990], ckpt_folder=args.ckpt_folder, test_episodes=100,
-         scan_size=args.number_of_rays)
+         scan_size=observedRays(args), shared_trunk=args.shared_trunk,
+         rollout_threads=args.rollout_threads, trace_rollout=args.trace_rollout,
+         quantized=args.quantized)
@@ -5,7 +5,6 @@ import random
 import sys
 import os
 import argparse
-from PyQt5.QtWidgets import QApplication
 from types import SimpleNamespace
 
 def startSimulation(args, level_files, createReward, get_advantages):
@@ -21,6 +20,11 @@ def startSimulation(args, level_files, createReward, get_advantages):
     # Simulation settings
     args['level_files']=level_files
     args['sim_time_step']=0.15
+    args['lidar_grid_cell_size']=0
+    args['lidar_angle_tolerance']=0
+    args['lidar_backend']='numpy'
+    args['lidar_pooling']=1
+    args['distance_field_cell_size']=0
 
     # Robot settings
     args['number_of_rays']=1081
@@ -48,7 +52,10 @@ def startSimulation(args, level_files, createReward, get_advantages):
 
     level_index = 0
 
-    app = QApplication(sys.argv)
+    app = None
+    if args.visualization != "none":
+        from PyQt5.QtWidgets import QApplication
+        app = QApplication(sys.argv)
 
     env = Environment(app, args, args.time_frames, level_index, reward_func=createReward)
 
@@ -0,0 +1,64 @@
+import os
+import random
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Environment.Environment import Environment, perRobotReward
+from lidarParity import createArgs
+
+
+def legacyReward(robot, dist_new, dist_old, reachedPickup, collision, runOutOfTime):
+    """
+    Environment.createReward of a single robot, written like the reward functions of the notebooks: the distances
+    to the goal are read from robot.state_raw instead of the parameters
+    """
+    current = robot.state_raw[robot.time_steps - 1]
+    last = robot.state_raw[robot.time_steps - 2]
+    legacyReward.velocities.append((current[4], current[5], last[4], last[5]))
+
+    reward = {'arrival': 0.0, 'out_of_time': 0.0, 'collision': 0.0, 'dist': 0.0}
+    if reachedPickup:
+        reward['arrival'] = 2500.0
+    elif runOutOfTime:
+        reward['out_of_time'] = -500.0
+    elif collision:
+        reward['collision'] = -2500.0
+    else:
+        goalDistNew, goalDistOld = current[8], last[8]
+        reward['dist'] = (300 if goalDistOld > goalDistNew else 100) * (goalDistOld - goalDistNew)
+    return reward
+
+
+def stepOnce(levelFile, reward_func, actions):
+    random.seed(3)
+    np.random.seed(3)
+    args = createArgs([levelFile], 271, False, False)
+    env = Environment(None, args, args.time_frames, 0, reward_func=reward_func)
+    env.reset(0)
+    env.step(np.zeros((env.getNumberOfRobots(), 2)))
+    _, rewards, dones, _ = env.step(actions)
+    return env, rewards, dones
+
+
+def test_per_robot_reward_reading_state_raw_matches_createReward(monkeypatch):
+    # the levels are loaded relative to the repository
+    monkeypatch.chdir(ROOT)
+    actions = np.array([[1.0, 0.5], [0.2, -1.0], [-0.3, 0.0], [0.8, 1.0]])
+
+    legacyReward.velocities = []
+    legacyEnv, legacyRewards, legacyDones = stepOnce('tunnel.svg', legacyReward, actions)
+    env, rewards, dones = stepOnce('tunnel.svg', None, actions)
+
+    np.testing.assert_array_equal(legacyDones, dones)
+    np.testing.assert_allclose(legacyRewards, rewards, rtol=0, atol=1e-9)
+    for key, values in env.rewardComponents.items():
+        np.testing.assert_allclose(legacyEnv.rewardComponents[key], values, rtol=0, atol=1e-9)
+
+    # state_raw holds the velocities (per time step) of the current and of the last step
+    swarm = legacyEnv.simulation.swarm
+    np.testing.assert_array_equal(np.array(legacyReward.velocities[-len(actions):]),
+                                  np.concatenate((swarm.velocity, swarm.lastVelocity), axis=1))
@@ -1,8 +1,6 @@
-from torch.utils.tensorboard import SummaryWriter
 import argparse
 import numpy as np
 import torch
-from PIL import Image
 import os
 import time
 from collections import deque
@@ -71,6 +69,30 @@ def statesToObservationsTensor(list):
     return [torch.tensor(laser, dtype=torch.float32), torch.tensor(ori, dtype=torch.float32),
             torch.tensor(dist, dtype=torch.float32), torch.tensor(vel, dtype=torch.float32)]
 
+def observationsToTensor(observations):
+    """
+    Wraps the observations packed by Environment.get_observations as tensors without copying them
+    :param observations: list of float32 np.arrays [laser, orientation, distance, velocity]
+    :return: list of tensors sharing the memory of the arrays
+    """
+    return [torch.from_numpy(observation) for observation in observations]
+
+def observedRays(args):
+    """
+    :param args: args defined in main
+    :return: number of laser values in the observations (number of rays after the min pooling of --lidar_pooling)
+    """
+    return -(-args.number_of_rays // args.lidar_pooling)
+
+def minPoolScan(laser, pooling):
+    """
+    Reduces a laser scan to the minimum of each sector of consecutive rays, so the nearest obstacle of a sector is kept
+    :param laser: np.array of the laser values
+    :param pooling: number of rays of a sector (the last sector may be smaller)
+    :return: np.array with ceil(len(laser) / pooling) values
+    """
+    return np.minimum.reduceat(laser, np.arange(0, len(laser), pooling))
+
 def torchToNumpy(tensor: torch.Tensor) -> np.ndarray:
     return tensor.detach().cpu().numpy()
 
@@ -121,6 +143,7 @@ def scan1DTo2D(distancesNorm, img_size, print=False):
 
     # prints scans in folder
     if print:
+        from PIL import Image
         image[data[:, 0], data[:, 1]] = 255
         im = Image.fromarray(image).convert('RGB')
         frmt = "{0:06d}"
@@ -175,15 +198,20 @@ def timeit(f):
 def check_args(args):
     assert args.image_size > 0, "Image size must be positive"
     assert args.batches > 0, "Batches must be positive"
+    assert args.num_envs > 0, "Number of environments must be positive"
+    assert args.rollout_threads >= 0, "Number of rollout threads must not be negative"
     assert args.lr > 0, "Learning rate must be positive"
     assert args.max_episodes > 0, "Number of episodes must be positive"
     assert args.time_frames > 0, "Number of time frames must be positive"
     assert args.print_interval > 0, "Print every must be positive"
     assert args.number_of_rays > 0, "Number of scans must be positive"
+    assert args.lidar_pooling > 0, "Lidar pooling must be positive"
+    assert args.distance_field_cell_size >= 0, "Distance field cell size must not be negative"
     assert args.update_experience > 0, "Update experience must be positive"
     assert args.update_experience > args.batches, "Update experience must be greater than batch size"
     assert args.visualization == "none" or args.visualization == "single" or args.visualization == "all", "Visualization must be none, single or all"
     assert args.inputspace == "big" or args.inputspace == "small", "Input space must be big or small"
+    assert args.lidar_backend == "numpy" or args.lidar_backend == "numba", "Lidar backend must be numpy or numba"
     assert os.path.exists(args.ckpt_folder), "Checkpoint folder does not exist."
 
 class Logger(object):
@@ -224,6 +252,7 @@ class Logger(object):
 
     def set_logging(self, logging):
         if logging:
+            from torch.utils.tensorboard import SummaryWriter
             self.writer = SummaryWriter(self.log_dir)
         elif self.logging:
             self.close()
@@ -271,14 +300,13 @@ class Logger(object):
         if self.logging and self.episode > self.last_logging_episode:
             self.writer.add_scalar('objective reached', self.percentage_objective_reached(), self.episode)
 
-    def add_reward(self, rewards):
-        for reward in rewards:
-            for key in reward.keys():
-                #quick and dirty change it
-                if key in self.reward.keys():
-                    self.reward[key] += reward[key]
-                else:
-                    self.reward[key] = reward[key]  
+    def add_reward(self, rewardComponents):
+        """
+        :param rewardComponents: dict of np.arrays - reward of every robot for each component (see
+            Environment.createReward)
+        """
+        for key, rewards in rewardComponents.items():
+            self.reward[key] = self.reward.get(key, 0) + float(np.sum(rewards))
 
     def percentage_objective_reached(self):
         return self.objective_reached / (self.episode - self.last_logging_episode)
@@ -386,6 +414,66 @@ class CircularBuffer:
     def get_buffer(self):
         return self.buffer
     
+class FrameHistory:
+    """
+    Ring buffer of the last frames of the lidar state of a robot. The channels of the frames are stored in
+    preallocated arrays, so adding a frame only overwrites the oldest one instead of reallocating the history.
+
+    :param size: (int) number of frames kept
+    :param number_of_rays: (int) number of rays of the laser scan
+    """
+    def __init__(self, size, number_of_rays):
+        self.size = size
+        self.laser = np.zeros((size, number_of_rays))
+        self.orientation = np.zeros((size, 2))
+        self.distance = np.zeros((size, 1))
+        self.velocity = np.zeros((size, 2))
+        self.timestep = np.zeros(size)
+        self.index = 0  # position of the next frame
+        self.count = 0
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+    def add(self, laser, orientation, distance, velocity, timestep):
+        self.laser[self.index] = laser
+        self.orientation[self.index] = orientation
+        self.distance[self.index] = distance
+        self.velocity[self.index] = velocity
+        self.timestep[self.index] = timestep
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def __len__(self):
+        return self.count
+
+    def get_order(self, reversed=False):
+        """
+        :param reversed: (bool) if True the newest frame comes first, otherwise the oldest
+        :return: (np.ndarray) indices of the frames in the buffer in the requested order
+        """
+        order = (self.index - self.count + np.arange(self.count)) % self.size
+        return order[::-1] if reversed else order
+
+    def get_arrays(self, reversed=False):
+        """
+        :param reversed: (bool) if True the newest frame comes first, otherwise the oldest
+        :return: (tuple) copies of the laser, orientation, distance, velocity and timestep channels in the requested
+            order, each with the frames in the first dimension
+        """
+        order = self.get_order(reversed)
+        return self.laser[order], self.orientation[order], self.distance[order], self.velocity[order], \
+               self.timestep[order]
+
+    def get_frames(self, reversed=False):
+        """
+        :param reversed: (bool) if True the newest frame comes first, otherwise the oldest
+        :return: (list) frames [laser, orientation, distance, velocity, timestep] in the requested order
+        """
+        laser, orientation, distance, velocity, timestep = self.get_arrays(reversed)
+        return [[laser[i], orientation[i], distance[i], velocity[i], timestep[i]] for i in range(len(laser))]
+
 def is_staying_in_place(buffer, threshold=1.0):
     # Make sure the buffer is full of valid positions
     if buffer.count_invalid_positions() > 0: